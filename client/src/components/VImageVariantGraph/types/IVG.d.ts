@@ -41,11 +41,29 @@ export interface Node {
     height: number
 }
 
-export interface Edge {
+// edge between the images of a prompt in one cluster and the images of another prompt in one cluster
+export interface ClusterEdge {
     id: number
     action: string
     changes: WordChange[]
     ratio: number
+    image_pairs: number
+    src_clu: number
+    src_pmt: number
+    srcNodes: number[]
+    tgt_clu: number
+    tgt_pmt: number
+    tgtNodes: number[]
+    weight: number
+    word: string
+}
+
+// edge between two images, expanded from a cluster edge where it is drawn
+export interface Edge {
+    id: string
+    action: string
+    changes: WordChange[]
+    ratio: number
     src:  number
     src_clu: number
     src_pmt: number
@@ -65,7 +83,7 @@ export interface EdgeGroup {
     tgt_clu: number
     weight: number
     word: string
-    edges: number[]
+    edges: number[] // indices of the cluster edges of the group
     baryCenter: Point
 }
 
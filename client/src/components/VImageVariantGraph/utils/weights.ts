@@ -2,12 +2,13 @@ const jsonCopy = (o: object) => {
     return o ? JSON.parse(JSON.stringify(o)) : o;
 }
 
-export const sortImagesByWeight = (images, edges, edgeGroups) => {
-    const _images = calculateImageWeights(images, edges, edgeGroups);
+export const sortImagesByWeight = (images, clusterEdges, edgeGroups) => {
+    const _images = calculateImageWeights(images, clusterEdges, edgeGroups);
     return _images.sort((a, b) => b.weight - a.weight).map((d) => d.index);
 }
 
-const calculateImageWeights = (images, edges, edgeGroups) => {
+// every image pair of a cluster edge adds the edge weight to both images
+const calculateImageWeights = (images, clusterEdges, edgeGroups) => {
     const _images = jsonCopy(images);
     for (const img of _images) {
         img.weight = 0;
@@ -15,9 +16,13 @@ const calculateImageWeights = (images, edges, edgeGroups) => {
 
     for (const group of edgeGroups) {
         group.edges.forEach((e) => {
-            const edge = edges[e];
-            _images[edge.src].weight += edge.weight;
-            _images[edge.tgt].weight += edge.weight;
+            const edge = clusterEdges[e];
+            edge.srcNodes.forEach((src) => {
+                _images[src].weight += edge.weight * edge.tgtNodes.length;
+            });
+            edge.tgtNodes.forEach((tgt) => {
+                _images[tgt].weight += edge.weight * edge.srcNodes.length;
+            });
         });
     }
 
@@ -1,6 +1,7 @@
-import type { RawEdgeGroup, WordEdge } from '@/plugins/session'
+import type { ClusterEdge, RawEdgeGroup, WordEdge } from '@/plugins/session'
+import type { ClusterTree } from '@/utils/cluster'
 
-const url_host = 'https://vis.pku.edu.cn/prompthis'
+export const urlHost = 'https://vis.pku.edu.cn/prompthis'
 
 const url_paths = {
     createSession: '/create/session',
@@ -8,6 +9,7 @@ const url_paths = {
     fetchSessionData: '/fetch/session_data',
     fetchNewData: '/fetch/new_data',
     fetchFullImage: '/fetch/full_image',
+    fetchImage: '/fetch/image',
     logIn: '/login',
     runGeneration: '/generate',
     tokenizePrompts: '/prompt/tokenize',
@@ -18,7 +20,7 @@ const url_paths = {
 export const urls = Object.fromEntries(
     Object
         .entries(url_paths)
-        .map(([key, value]) => [key, url_host + value])
+        .map(([key, value]) => [key, urlHost + value])
 )
 
 console.log(urls)
@@ -26,6 +28,7 @@ console.log(urls)
 export interface FetchSessionRequest {
     userId?: number
     sessionId?: number
+    imageMode?: 'reference'
 }
 
 export interface BaseResponse {
@@ -52,15 +55,19 @@ export interface NewDataResponse {
 }
 
 interface TokenizePromptsData {
-    prompts: object[]
+    prompts: { id: number, text: string }[]
+    version?: string
+    delta?: boolean
 }
 
 export interface TokenizePromptResponse {
+    status: string
     data: TokenizePromptsData
 }
 
 interface ImageClusterData {
     clusters: Record<string, number>
+    tree?: ClusterTree // if requested with tree
 }
 
 export interface ImageClusterResponse {
@@ -68,7 +75,8 @@ export interface ImageClusterResponse {
 }
 
 interface EdgeDeriveData {
-    edges: WordEdge[]
+    edges?: WordEdge[] // one edge per image pair, unless mode is 'clusters'
+    clusterEdges?: ClusterEdge[] // one edge per cluster pair, if mode is 'clusters'
     edgeGroups: RawEdgeGroup[]
 }
 
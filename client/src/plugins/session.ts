@@ -99,6 +99,20 @@ export interface WordEdge {
     word: string
 }
 
+// edge between the images of a prompt in one cluster and the images of another prompt in one cluster
+export interface ClusterEdge {
+    action: string
+    changes: WordChange[]
+    ratio: number
+    image_pairs: number
+    src_clu: number
+    src_pmt: number
+    tgt_clu: number
+    tgt_pmt: number
+    weight: number
+    word: string
+}
+
 export interface RawEdgeGroup {
     action: string
     changes: WordChange[]
@@ -110,9 +124,14 @@ export interface RawEdgeGroup {
 
 export interface EdgeGroup extends RawEdgeGroup {
     idx: number
-    edges: number[]
+    edges: number[] // indices of the cluster edges of the group
 }
 
+// edges of a group share the word, the action and the cluster pair
+export const edgeGroupKey = (edge: RawEdgeGroup | ClusterEdge): string => (
+    `${edge.word}|${edge.action}|${edge.src_clu}|${edge.tgt_clu}`
+)
+
 export const transformRawSessionList = (data: RawSessionItem[]): SessionItem[] => {
     return CamelCaseList(data) as SessionItem[]
 }
@@ -4,10 +4,14 @@ import { useStore as useUserStore } from './user'
 import { urls } from '../plugins/apis'
 import { request, poll } from '../utils/request'
 import { jacardSimilarity } from '../utils/similarity'
+import { cutClusterTree } from '../utils/cluster'
 
-import type { RawSessionData, T2IRecord, CacheRecord, Point, WordEdge, EdgeGroup } from '../plugins/session'
+import type { RawSessionData, T2IRecord, CacheRecord, Point, ClusterEdge, EdgeGroup } from '../plugins/session'
+import type { ClusterTree } from '../utils/cluster'
 import type { FetchSessionRequest, GenerationResponse, NewDataResponse, TokenizePromptResponse, ImageClusterResponse, EdgeDeriveResponse } from '../plugins/apis'
-import { transformRawSessionData, addTokenToRecords } from '../plugins/session'
+import { transformRawSessionData, addTokenToRecords, edgeGroupKey } from '../plugins/session'
+
+const MAX_WARD_IMAGES = 5000
 
 export const useStore = defineStore('session', {
     state: () => ({
@@ -16,9 +20,13 @@ export const useStore = defineStore('session', {
         image_projection: {} as Record<string, Point>,
         text_projection: {} as Record<string, Point>,
         clusters: {} as Record<string, number>,
+        clusterTree: null as ClusterTree | null, // linkage tree of the projection it was computed for
+        clusterTreeKey: null as string | null,
         cache: null as CacheRecord | null,
-        edges: [] as WordEdge[],
+        clusterEdges: [] as ClusterEdge[], // expanded to image pairs where they are drawn
         edgeGroups: [] as EdgeGroup[],
+        tokenizedPrompts: [] as { id: number, text: string }[], // tokenized prompts of the records
+        tokenVersion: null as string | null, // version of the tokenized history kept on the server
     }),
     getters: {
         promptSimilarityMatrix(state) {
@@ -38,7 +46,7 @@ export const useStore = defineStore('session', {
     actions: {
         async fetchSessionData() {
             const userStore = useUserStore()
-            const payload = {} as FetchSessionRequest
+            const payload = { imageMode: 'reference' } as FetchSessionRequest
             if (userStore.userId !== null && userStore.sessionId !== null) {
                 payload['userId'] = userStore.userId
                 payload['sessionId'] = userStore.sessionId
@@ -54,9 +62,15 @@ export const useStore = defineStore('session', {
         async fetchFullImage(filename: string, callback: (d: string) => void) {
             const userStore = useUserStore()
             const { userId, sessionId } = userStore
-            const payload = { userId, sessionId, filename }
-            const data = await request<{data: string}>(urls.fetchFullImage, payload)
-            callback(data.data)
+            const params = new URLSearchParams({
+                userId: String(userId),
+                sessionId: String(sessionId),
+                filename: `${filename}.png`,
+                isPublic: '1',
+            })
+            // the full image is loaded by the browser as binary JPEG
+            const data = `/fetch/image?${params.toString()}`
+            callback(data)
             return data
         },
         async runGeneration(payload: CacheRecord) {
@@ -71,7 +85,7 @@ export const useStore = defineStore('session', {
                 return status
             }
             this.cache = { promptId, prompt }
-            const action = () => request<NewDataResponse>(urls.fetchNewData, { promptId, userId, sessionId })
+            const action = () => request<NewDataResponse>(urls.fetchNewData, { promptId, userId, sessionId, imageMode: 'reference' })
             const onSuccess = (result) => {
                 const { records, images, image_projection, text_projection } = transformRawSessionData(result.data)
                 this.image_projection = { ...this.image_projection, ...image_projection }
@@ -83,17 +97,49 @@ export const useStore = defineStore('session', {
             poll(action, onSuccess)
         },
         async tokenizePrompts() {
+            const { userId, sessionId } = useUserStore()
             const prompts = this.records.map((record) => ({ prompt: record.prompt }))
-            const payload = { prompts }
-            const data = await request<TokenizePromptResponse>(urls.tokenizePrompts, payload)
-            const tokenizedPrompts = data.data.prompts
+            const known = this.tokenizedPrompts
+            // only send the new prompts if the history has been appended to
+            const isAppended = this.tokenVersion !== null
+                && known.length <= prompts.length
+                && known.every((prompt, index) => prompt.text === prompts[index].prompt)
+
+            let data = null as TokenizePromptResponse | null
+            if (isAppended) {
+                const payload = { prompts: prompts.slice(known.length), userId, sessionId, version: this.tokenVersion }
+                data = await request<TokenizePromptResponse>(urls.tokenizePrompts, payload)
+            }
+            if (data === null || data.status !== 'success') {
+                const payload = { prompts, userId, sessionId }
+                data = await request<TokenizePromptResponse>(urls.tokenizePrompts, payload)
+            }
+
+            // a delta only has the prompts whose result changed
+            const tokenizedPrompts = data.data.delta ? [...known] : []
+            data.data.prompts.forEach((prompt) => {
+                tokenizedPrompts[prompt.id] = prompt
+            })
+            this.tokenizedPrompts = tokenizedPrompts
+            this.tokenVersion = data.data.version ?? null
+
             const records = addTokenToRecords(this.records, tokenizedPrompts)
             this.records = records
         },
         async clusterImages(projection: Record<string, Point>, thresh: number) {
-            const payload = { embeddings: projection, threshold: thresh }
+            // a new threshold for the same projection only cuts the tree again
+            const treeKey = JSON.stringify(projection)
+            if (this.clusterTree && this.clusterTreeKey === treeKey) {
+                this.clusters = cutClusterTree(this.clusterTree, thresh)
+                return
+            }
+            // exact ward is quadratic in the number of images
+            const method = Object.keys(projection).length > MAX_WARD_IMAGES ? 'grid' : 'ward'
+            const payload = { embeddings: projection, threshold: thresh, tree: true, method }
             const data = await request<ImageClusterResponse>(urls.clusterImages, payload)
             this.clusters = data.data.clusters
+            this.clusterTree = data.data.tree ?? null
+            this.clusterTreeKey = treeKey
         },
         async deriveEdges(promptPairs: [number, number][]) {
             // prompts
@@ -107,26 +153,27 @@ export const useStore = defineStore('session', {
                 ))
             ))
             const imageClusters = this.clusters
-            const payload = { prompts, promptPairs, imageClusters, imageIndices }
+            const { userId, sessionId } = useUserStore()
+            // edges come per cluster pair and are expanded to image pairs where they are drawn
+            const mode = 'clusters'
+            const payload = { prompts, promptPairs, imageClusters, imageIndices, mode, userId, sessionId }
             const data = await request<EdgeDeriveResponse>(urls.deriveEdges, payload)
-            const { edges, edgeGroups } = data.data
+            const { edgeGroups } = data.data
+            const clusterEdges = data.data.clusterEdges ?? []
 
             const edgeGroups_ = edgeGroups as EdgeGroup[]
+            const groupIndices = new Map<string, number>()
             edgeGroups_.forEach((group, index) => {
-                const subEdges = [] as number[]
-                edges.forEach((edge, index) => {
-                    if (
-                        edge.word === group.word &&
-                        edge.action === group.action &&
-                        edge.src_clu === group.src_clu &&
-                        edge.tgt_clu === group.tgt_clu
-                    ) subEdges.push(index)
-                })
-                group.edges = subEdges
+                group.edges = []
                 group.idx = index
+                groupIndices.set(edgeGroupKey(group), index)
+            })
+            clusterEdges.forEach((edge, index) => {
+                const groupIndex = groupIndices.get(edgeGroupKey(edge))
+                if (groupIndex !== undefined) edgeGroups_[groupIndex].edges.push(index)
             })
 
-            this.edges = edges
+            this.clusterEdges = clusterEdges
             this.edgeGroups = edgeGroups_
         },
         emptySessionData() {
@@ -135,8 +182,12 @@ export const useStore = defineStore('session', {
             this.image_projection = {}
             this.text_projection = {}
             this.clusters = {}
+            this.clusterTree = null
+            this.clusterTreeKey = null
             this.cache = null
-            this.edges = []
+            this.clusterEdges = []
+            this.tokenizedPrompts = []
+            this.tokenVersion = null
             this.edgeGroups = []
         },
         emptyCache() {
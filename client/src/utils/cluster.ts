@@ -0,0 +1,54 @@
+// Linkage tree of /image/cluster: merge i joins left[i] and right[i], where leaves are 0..n-1
+// and merge i is n+i, and maxDist[i] is the largest merge distance below merge i
+export interface ClusterTree {
+    images: string[]
+    left: number[]
+    right: number[]
+    maxDist: number[]
+    leaves?: number[] // leaf of every image, if leaves are not images
+}
+
+// Cut the tree at a distance threshold, numbering clusters as scipy's fcluster does
+export const cutClusterTree = (tree: ClusterTree, threshold: number): Record<string, number> => {
+    const { images, left, right, maxDist } = tree
+    const leaves = tree.leaves ?? images.map((_, i) => i)
+    const n = left.length + 1
+    const labels = Array(n).fill(1) as number[]
+    if (n < 2) return Object.fromEntries(images.map((image, i) => [image, labels[leaves[i]]]))
+
+    // depth-first from the root, left before right
+    const stack = [2 * n - 2]
+    const visited = new Set<number>()
+    let leader = -1 // merge whose subtree is the current cluster
+    let numClusters = 0
+    while (stack.length > 0) {
+        const root = stack[stack.length - 1] - n
+        const lc = left[root], rc = right[root]
+        if (leader === -1 && maxDist[root] <= threshold) {
+            leader = root
+            numClusters += 1
+        }
+        if (lc >= n && !visited.has(lc)) {
+            visited.add(lc)
+            stack.push(lc)
+            continue
+        }
+        if (rc >= n && !visited.has(rc)) {
+            visited.add(rc)
+            stack.push(rc)
+            continue
+        }
+        // points outside any cluster are clusters of their own
+        if (lc < n) {
+            if (leader === -1) numClusters += 1
+            labels[lc] = numClusters
+        }
+        if (rc < n) {
+            if (leader === -1) numClusters += 1
+            labels[rc] = numClusters
+        }
+        if (leader === root) leader = -1
+        stack.pop()
+    }
+    return Object.fromEntries(images.map((image, i) => [image, labels[leaves[i]]]))
+}
@@ -0,0 +1,9 @@
+import { urlHost } from '../plugins/apis'
+
+// Images are either base64 encoded JPEG data or references to /fetch/image
+export const imageSrc = (data: string): string => {
+    if (data.startsWith('/fetch/')) {
+        return urlHost + data
+    }
+    return 'data:image/jpeg;base64,' + data
+}
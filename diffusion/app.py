@@ -1,3 +1,4 @@
+import os
 import copy
 import logging
 import tornado.httpserver
@@ -7,10 +8,12 @@ import tornado.web
 import tornado.websocket
 
 from tornado.options import define, options
+from tornado.httpclient import AsyncHTTPClient
 
 import modules
 from utils import request_scheduler
 from utils.config_reader import read_configs
+from utils.executor import run_blocking
 from modules.logger.creation_logger import CreationLogger
 from modules.logger.session_logger import SessionLogger
 from extension import Extension
@@ -46,6 +49,12 @@ class BaseHandler(tornado.web.RequestHandler):
             return None
         raise tornado.web.HTTPError(400, f"Missing argument: {arg}")
 
+    async def write_json(self, data):
+        """Encode large responses in the executor instead of on the IOLoop."""
+        body = await run_blocking(tornado.escape.json_encode, data)
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write(body)
+
     def register_extension(self, data):
         # filter the extensions to be registered
         handler_name = getattr(self, "handler_name", "")
@@ -68,9 +77,9 @@ class HelloWorld(BaseHandler):
 
 
 class LogInHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         username = self.get_argument("username")
-        userid = match_username_with_userid(username)
+        userid = await run_blocking(match_username_with_userid, username)
         if userid == -1:
             status = 'failed'
         else:
@@ -82,10 +91,10 @@ class LogInHandler(BaseHandler):
 
 
 class CreateSessionHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         user_id = self.get_argument('userId', required=False)
-        session_logger = SessionLogger(user_id)
-        sessions = session_logger.log_session()
+        session_logger = await run_blocking(SessionLogger, user_id)
+        sessions = await run_blocking(session_logger.log_session)
         self.write({
             'status': 'success',
             'sessions': sessions
@@ -93,10 +102,10 @@ class CreateSessionHandler(BaseHandler):
 
 
 class fetchSessionListHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         user_id = self.get_argument('userId', required=False)
-        session_logger = SessionLogger(user_id)
-        sessions = session_logger.fetch_session_list()
+        session_logger = await run_blocking(SessionLogger, user_id)
+        sessions = await run_blocking(session_logger.fetch_session_list)
         self.write({
             'status': 'success',
             'sessions': sessions
@@ -108,7 +117,7 @@ class Text2ImageCreationHandler(BaseHandler):
     def handler_name(self):
         return "text2image_creation"
 
-    def post(self):
+    async def post(self):
         """post"""
         # get arguments
         user_id = self.get_argument('user_id', required=False)
@@ -117,7 +126,7 @@ class Text2ImageCreationHandler(BaseHandler):
         settings = self.get_argument('settings')
 
         # register logger
-        logger = CreationLogger(user_id, thread_id)
+        logger = await run_blocking(CreationLogger, user_id, thread_id)
 
         # register extension
         extensions = self.register_extension({
@@ -136,8 +145,16 @@ class Text2ImageCreationHandler(BaseHandler):
         })
 
 
+class FetchModelStatusHandler(BaseHandler):
+    def get(self):
+        self.write({
+            "status": "success",
+            "models": request_scheduler.get_stats()
+        })
+
+
 class FetchLogHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         dsl = self.get_argument("dsl")
 
         extensions = extension_config["extensions"]
@@ -148,13 +165,13 @@ class FetchLogHandler(BaseHandler):
 
         session_reader = readers['session']
         reader = session_reader(dsl, extensions)
-        input_data = reader.read()
+        input_data = await reader.read_async()
 
-        self.write(input_data)
+        await self.write_json(input_data)
 
 
 class FetchFullImageHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         user_id = self.get_argument('userId', required=False)
         thread_id = self.get_argument('sessionId', required=False)
         filename = self.get_argument('filename')
@@ -164,9 +181,39 @@ class FetchFullImageHandler(BaseHandler):
         filename = filename + '.png'
 
         reader = readers['base'](mode, directory, filename)
-        data = reader.read()
+        data = await run_blocking(reader.read)
+
+        await self.write_json({'data': data})
+
+
+class FetchImageHandler(BaseHandler):
+    """Serve an image as JPEG bytes instead of base64 in JSON"""
+
+    def get_path_argument(self, name, default=None):
+        value = self.get_query_argument(name, default)
+        if value is not None and (value in ('', '.', '..') or os.path.basename(value) != value):
+            raise tornado.web.HTTPError(400, f"Invalid argument: {name}")
+        return value
+
+    async def get(self):
+        user_id = self.get_path_argument('userId', 'None')
+        thread_id = self.get_path_argument('sessionId', 'None')
+        filename = self.get_path_argument('filename')
+        preview = self.get_query_argument('preview', '0') in ('1', 'true')
 
-        self.write({'data': data})
+        if filename is None:
+            raise tornado.web.HTTPError(400, "Missing argument: filename")
+
+        directory = f'./outputs/{user_id}/{thread_id}/data'
+        if not os.path.exists(os.path.join(directory, filename)):
+            raise tornado.web.HTTPError(404)
+
+        reader = readers['base']('one', directory, filename)
+        data = await run_blocking(reader.read_image_bytes, filename, preview=preview)
+
+        self.set_header("Content-Type", "image/jpeg")
+        self.set_header("Cache-Control", "public, max-age=86400")
+        self.write(data)
 
 
 class FetchDataHandler(BaseHandler):
@@ -178,9 +225,10 @@ class FetchDataHandler(BaseHandler):
 
 
 class FetchNewGenerationHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         dsl = self.get_argument("dsl")
-        apis = read_dsl2api.read_new_generation(dsl)
+        reference_images = dsl.get("imageMode") == "reference"
+        apis = await run_blocking(read_dsl2api.read_new_generation, dsl)
 
         if apis is None:
             self.write({
@@ -193,10 +241,10 @@ class FetchNewGenerationHandler(BaseHandler):
 
         for api in apis:
             reader = base_reader(**api)
-            data = reader.read(preview=True)
+            data = await run_blocking(reader.read, preview=True, reference=reference_images)
             input_data[api["dsl"]["attribute"]] = data
 
-        self.write({
+        await self.write_json({
             "status": "success",
             "data": input_data
         })
@@ -217,7 +265,9 @@ class Application(tornado.web.Application):
             ('/fetch/data', FetchDataHandler),
             ('/fetch/session_list', fetchSessionListHandler),
             ('/fetch/full_image', FetchFullImageHandler),
-            ("/fetch/new_generation", FetchNewGenerationHandler)
+            ('/fetch/image', FetchImageHandler),
+            ("/fetch/new_generation", FetchNewGenerationHandler),
+            ("/fetch/model_status", FetchModelStatusHandler),
         ]
         settings = {
             "debug": True
@@ -227,6 +277,7 @@ class Application(tornado.web.Application):
 
 if __name__ == "__main__":
     tornado.options.parse_command_line()
+    AsyncHTTPClient.configure(None, max_clients=100)
     print("server running at server:%d ..."%(tornado.options.options.port))
     app = Application()
     http_server = tornado.httpserver.HTTPServer(app)
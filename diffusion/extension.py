@@ -1,5 +1,8 @@
 import json
 import requests
+from tornado.httpclient import AsyncHTTPClient
+
+from utils.executor import run_blocking
 import translators.extension_dsl2api as dsl2api
 from modules.reader.readers import readers
 from modules.logger.base_logger import BaseLogger
@@ -31,6 +34,29 @@ class Extension:
         output_data = response["output"]
         self.log_output(output_data)
 
+    async def execute_async(self):
+        """Execute the extension without blocking the IOLoop."""
+        print("execute extension")
+
+        input_data = await run_blocking(self.get_input)
+
+        payload = {
+            "input": input_data,
+            "config": self.config
+        }
+        body = await run_blocking(json.dumps, payload)
+
+        response = await AsyncHTTPClient().fetch(
+            self.url,
+            method="POST",
+            body=body,
+            headers={"Content-Type": "application/json"},
+            request_timeout=10,
+        )
+        response = await run_blocking(json.loads, response.body)
+        output_data = response["output"]
+        await run_blocking(self.log_output, output_data)
+
     def get_input(self):
         read_dsl = {
             'metaInfo': self.config['metaInfo'],
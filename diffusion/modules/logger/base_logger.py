@@ -1,6 +1,10 @@
 import os
 import json
 
+import numpy as np
+
+from .embedding_store import EmbeddingStore
+
 
 class ThreadLogger:
     def __init__(self):
@@ -18,6 +22,8 @@ class BaseLogger:
             files = self.files["filename"]
         elif self.mode == "list":
             files = [file["filename"] for file in self.files]
+        elif self.mode == "embeddings":
+            files = self.files["filenames"]
         return (
             f"BaseLogger("
             f"mode={self.mode}, "
@@ -33,6 +39,8 @@ class BaseLogger:
             self.write_one(self.files)
         elif self.mode == "list":
             self.write_many(self.files)
+        elif self.mode == "embeddings":
+            self.write_embeddings(self.files)
         else:
             raise NotImplementedError
 
@@ -47,6 +55,15 @@ class BaseLogger:
             self.write_json(file)
 
     def write_many(self, files):
+        if not files:
+            return
+        if EmbeddingStore.exists(self.directory):
+            # reads of the directory go to the store, JSON files would not be read
+            self.write_embeddings({
+                "filenames": [file["filename"] for file in files],
+                "matrix": np.array([file["data"] for file in files])
+            })
+            return
         for file in files:
             self.write_one(file)
 
@@ -54,3 +71,7 @@ class BaseLogger:
         file_path = os.path.join(self.directory, file["filename"])
         with open(file_path, "w", encoding="utf-8") as f:
             json.dump(file["data"], f, indent=4, ensure_ascii=False)
+
+    def write_embeddings(self, files):
+        store = EmbeddingStore(self.directory)
+        store.append(files["filenames"], files["matrix"])
@@ -9,6 +9,9 @@ from PIL import Image
 from datetime import datetime
 from pydantic import BaseModel, Field, validator
 
+from .record_store import RecordStore
+from ..reader.thumbnail_cache import thumbnail_cache
+
 
 class CreationLogLine(BaseModel):
     prompt_id: int = Field(title="Prompt ID")
@@ -44,6 +47,20 @@ class CreationResponse(BaseModel):
         return v
 
 
+def get_log_columns():
+    return list(CreationLogLine.model_json_schema()["properties"].keys())
+
+
+def to_record(info):
+    """Convert a dumped CreationLogLine to a JSON-serializable record."""
+    record = {}
+    for key, value in info.items():
+        if isinstance(value, datetime):
+            value = value.strftime("%Y-%m-%d %H:%M:%S")
+        record[key] = value
+    return record
+
+
 class CreationLogger:
     def __init__(self, user_id=None, thread_id=None, log_dir = "./outputs"):
         self.user_id = user_id
@@ -63,7 +80,12 @@ class CreationLogger:
         self.thread_log_path = os.path.join(thread_dir, "log.csv")
         self.thread_data_dir = os.path.join(thread_dir, "data")
 
-        if not os.path.exists(self.thread_log_path):
+        self.thread_dir = thread_dir
+        self.store = RecordStore(thread_dir, columns=get_log_columns())
+
+        if RecordStore.exists(thread_dir):
+            self.row_idx = len(self.store)
+        elif not os.path.exists(self.thread_log_path):
             self.row_idx = 0
         else:
             df = pd.read_csv(self.thread_log_path)
@@ -77,49 +99,43 @@ class CreationLogger:
         if not os.path.exists(self.thread_data_dir):
             os.makedirs(self.thread_data_dir)
 
-        # create thread log file if not exists
-        if not os.path.exists(self.thread_log_path):
-            columns = CreationLogLine.model_json_schema()["properties"].keys()
-            df = pd.DataFrame(columns=columns)
-            df.to_csv(self.thread_log_path, index=False)
+        # create thread log store if not exists, importing a legacy log.csv
+        self.store.init(csv_path=self.thread_log_path)
+
+    def export_csv(self, csv_path=None):
+        """Export the thread log as log.csv for tools that read the CSV directly."""
+        if csv_path is None:
+            csv_path = self.thread_log_path
+        self.store.export_csv(csv_path)
 
     def log_request(self, request_info):
         print("log request")
 
-        # create thread data directory if not exists
-        if not os.path.exists(self.thread_data_dir):
-            os.makedirs(self.thread_data_dir)
+        self.init_log_file()
+
+        # hold the store lock so that the row number embedded in the record
+        # and the setting filename is the row the record is appended to
+        with self.store.lock:
+            row_num = len(self.store)
+
+            # save settings
+            create_time = request_info["time"]
+            create_time_str = create_time.strftime("%Y%m%d%H%M%S")
+            setting_filename = f"{row_num}_{create_time_str}_settings.json"
+            data_ = copy.deepcopy(request_info["data"])
+            data_["prompt_id"] = row_num
+            data_["model"] = request_info["model"]
+            data_["create_time"] = create_time.strftime("%Y-%m-%d %H:%M:%S")
+            data_["create_timezone"] = request_info["timezone"]
+            data_["setting_filename"] = setting_filename
+            creation_info = CreationLogLine(**data_).model_dump()
 
-        # create thread log file if not exists
-        if not os.path.exists(self.thread_log_path):
-            columns = CreationLogLine.model_json_schema()["properties"].keys()
-            df = pd.DataFrame(columns=columns)
-            df.to_csv(self.thread_log_path, index=False)
-
-        df = pd.read_csv(self.thread_log_path)
-        row_num = df.shape[0]
-
-        # save settings
-        create_time = request_info["time"]
-        create_time_str = create_time.strftime("%Y%m%d%H%M%S")
-        setting_filename = f"{row_num}_{create_time_str}_settings.json"
-        data_ = copy.deepcopy(request_info["data"])
-        data_["prompt_id"] = row_num
-        data_["model"] = request_info["model"]
-        data_["create_time"] = create_time.strftime("%Y-%m-%d %H:%M:%S")
-        data_["create_timezone"] = request_info["timezone"]
-        data_["setting_filename"] = setting_filename
-        creation_info = CreationLogLine(**data_).model_dump()
-
-        new_row = pd.DataFrame([creation_info])
-        df = pd.concat([df, new_row], ignore_index=True)
-        df.to_csv(self.thread_log_path, index=False)
+            self.store.append(to_record(creation_info))
 
         # save request as json file
         setting_filepath = os.path.join(self.thread_data_dir, setting_filename)
-        request_ = copy.deepcopy(request_info)
-        del request_["logger"]
-        del request_["extensions"]
+        request_ = copy.deepcopy({k: v for k, v in request_info.items()
+                                  if k not in ("logger", "extensions")})
         request_["time"] = request_["time"].strftime("%Y-%m-%d %H:%M:%S")
         with open(setting_filepath, "w", encoding="utf-8") as f:
             json.dump({
@@ -148,6 +164,7 @@ class CreationLogger:
             filename = f'{row_idx}({idx}).png'
             filepath = os.path.join(self.thread_data_dir, filename)
             image.save(filepath)
+            thumbnail_cache.put(filepath, image)
             output_filenames.append(filename)
 
         # save parameters and info
@@ -159,12 +176,10 @@ class CreationLogger:
             json.dump(settings, f, indent=4)
 
         # update log
-        df = pd.read_csv(self.thread_log_path)
-        info = df.iloc[row_idx].dropna().to_dict()
+        info = {k: v for k, v in self.store.get(row_idx).items() if v is not None}
         info = {**info, **response["parameters"], **response["info"]}
         info["finish_time"] = finishi_time.strftime("%Y-%m-%d %H:%M:%S")
         info["finish_timezone"] = timezone_name
         info["output_filenames"] = json.dumps(output_filenames)
         info = CreationLogLine(**info).model_dump()
-        df.iloc[row_idx] = info
-        df.to_csv(self.thread_log_path, index=False)
+        self.store.update(row_idx, to_record(info))
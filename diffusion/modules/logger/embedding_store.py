@@ -0,0 +1,183 @@
+"""
+Append-only embedding store for preprocess outputs.
+
+The embeddings of a thread are rows of one binary matrix in
+``embeddings.bin``, opened with ``np.memmap``. ``embeddings.jsonl`` holds
+the filename of every row, one line per row, and ``embeddings.meta.json`` the
+dtype and dimension of the rows. Writing an embedding again appends a new row
+and the filename points to the latest one. Rows and index lines left by an
+interrupted append are ignored when reading and dropped before the next
+append, so row i is always the one of line i. The filenames are the JSON
+filenames of the legacy layout, so filters by filename work on both. JSON
+files of a directory are imported when its store is created, embeddings
+logged as a list of files afterwards are appended to the store (see
+``BaseLogger.write_many``), and ``export_json`` writes that layout back.
+
+Embeddings travel between the apps packed: the filenames, dtype, shape and
+the base64 of the matrix bytes, see ``pack_embeddings``.
+"""
+
+import os
+import json
+import base64
+
+import numpy as np
+
+from .record_store import _get_lock
+
+MATRIX_FILENAME = "embeddings.bin"
+INDEX_FILENAME = "embeddings.jsonl"
+META_FILENAME = "embeddings.meta.json"
+PACKED_FORMAT = "embeddings"
+
+
+def is_packed(data):
+    return isinstance(data, dict) and data.get("format") == PACKED_FORMAT
+
+
+def pack_embeddings(filenames, matrix):
+    """Embeddings as a JSON-serializable dict, the matrix is not copied before encoding."""
+    matrix = np.ascontiguousarray(matrix)
+    return {
+        "format": PACKED_FORMAT,
+        "filenames": list(filenames),
+        "dtype": matrix.dtype.name,
+        "shape": list(matrix.shape),
+        "data": base64.b64encode(memoryview(matrix).cast("B")).decode(),
+    }
+
+
+def unpack_embeddings(data):
+    """Filenames and matrix of packed embeddings."""
+    matrix = np.frombuffer(base64.b64decode(data["data"]), dtype=data["dtype"])
+    return data["filenames"], matrix.reshape(data["shape"])
+
+
+class EmbeddingStore:
+    def __init__(self, directory) -> None:
+        self.directory = directory
+        self.matrix_path = os.path.join(directory, MATRIX_FILENAME)
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self.meta_path = os.path.join(directory, META_FILENAME)
+        self.lock = _get_lock(self.matrix_path)
+
+    def __str__(self) -> str:
+        return f"EmbeddingStore(directory={self.directory})"
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, META_FILENAME))
+
+    def meta(self):
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def row_size(meta):
+        return np.dtype(meta["dtype"]).itemsize * meta["dim"]
+
+    def __len__(self):
+        if not os.path.exists(self.meta_path):
+            return 0
+        return len(self.row_filenames())
+
+    def row_filenames(self):
+        """The filename of every complete row, the lines of the index backed by a matrix row."""
+        with open(self.index_path, "rb") as f:
+            lines = f.read().split(b"\n")[:-1]  # without a line torn by a crash
+        rows = os.path.getsize(self.matrix_path) // self.row_size(self.meta())
+        return [json.loads(line) for line in lines[:rows]]
+
+    def append(self, filenames, matrix):
+        """Append rows, a filename written before then points to its new row."""
+        matrix = np.ascontiguousarray(matrix)
+        if matrix.ndim != 2 or len(matrix) != len(filenames):
+            raise ValueError(f"expected one row per filename, got shape {matrix.shape}")
+
+        with self.lock:
+            if not os.path.exists(self.meta_path):
+                self._create(matrix.dtype, matrix.shape[1])
+            self._append(filenames, matrix)
+
+    def _create(self, dtype, dim):
+        """Create the store, importing embeddings written as JSON files before."""
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        legacy = sorted(fn for fn in os.listdir(self.directory)
+                        if fn.endswith(".json") and fn != META_FILENAME)
+
+        open(self.matrix_path, "wb").close()
+        open(self.index_path, "wb").close()
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump({"dtype": np.dtype(dtype).name, "dim": dim}, f)
+
+        vectors = []
+        for filename in legacy:
+            with open(os.path.join(self.directory, filename), "r", encoding="utf-8") as f:
+                vectors.append(json.load(f))
+        if legacy:
+            self._append(legacy, np.array(vectors))
+
+    def _append(self, filenames, matrix):
+        meta = self.meta()
+        if matrix.shape[1] != meta["dim"]:
+            raise ValueError(f"expected rows of dimension {meta['dim']}, got {matrix.shape[1]}")
+
+        # rows first: a crash before the index is written leaves extra rows,
+        # which the next append drops before writing
+        self._truncate(meta)
+        with open(self.matrix_path, "ab") as f:
+            f.write(matrix.astype(meta["dtype"], copy=False).tobytes())
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(filename) + "\n" for filename in filenames)
+
+    def _truncate(self, meta):
+        """Drop the rows and index lines of an interrupted append, so both files have as many rows."""
+        with open(self.index_path, "rb") as f:
+            lines = f.read().split(b"\n")[:-1]
+        rows = min(len(lines), os.path.getsize(self.matrix_path) // self.row_size(meta))
+        index_size = sum(len(line) + 1 for line in lines[:rows])
+        if os.path.getsize(self.index_path) != index_size:
+            os.truncate(self.index_path, index_size)
+        if os.path.getsize(self.matrix_path) != rows * self.row_size(meta):
+            os.truncate(self.matrix_path, rows * self.row_size(meta))
+
+    def index(self):
+        """The latest row of every filename, in the order filenames were first written."""
+        if not os.path.exists(self.meta_path):
+            return {}
+        return {filename: row for row, filename in enumerate(self.row_filenames())}
+
+    def filenames(self):
+        return list(self.index())
+
+    def matrix(self, rows=None):
+        """All rows as a read-only memory map, including rows written again later."""
+        meta = self.meta()
+        if rows is None:
+            rows = len(self)
+        if rows == 0:
+            return np.empty((0, meta["dim"]), dtype=meta["dtype"])
+        return np.memmap(self.matrix_path, dtype=meta["dtype"], mode="r",
+                         shape=(rows, meta["dim"]))
+
+    def read(self, filenames=None):
+        """Rows of filenames, all by default; the memory map itself if they are all rows in order."""
+        with self.lock:
+            row_filenames = self.row_filenames()
+            matrix = self.matrix(len(row_filenames))
+        index = {filename: row for row, filename in enumerate(row_filenames)}
+        if filenames is None:
+            filenames = list(index)
+        rows = np.array([index[filename] for filename in filenames], dtype=np.int64)
+        if len(rows) == len(matrix) and np.array_equal(rows, np.arange(len(matrix))):
+            return filenames, matrix
+        return filenames, matrix[rows]
+
+    def export_json(self, directory=None):
+        """Write every embedding as a JSON file, as preprocess outputs were written before."""
+        directory = directory or self.directory
+        filenames, matrix = self.read()
+        for filename, vector in zip(filenames, matrix):
+            with open(os.path.join(directory, filename), "w", encoding="utf-8") as f:
+                json.dump(vector.tolist(), f, indent=4)
@@ -0,0 +1,169 @@
+"""
+Append-only record store for thread logs.
+
+Records are kept as JSON lines in ``log.jsonl``. ``log.idx`` holds one
+fixed-width byte offset per row, so appending a row or replacing a row costs
+one write to each file regardless of how long the thread is. Replacing a row
+appends the new version and repoints its index slot; the old line is left in
+place until the log is exported or compacted.
+"""
+
+import os
+import csv
+import json
+import struct
+import threading
+
+RECORD_FILENAME = "log.jsonl"
+INDEX_FILENAME = "log.idx"
+
+_OFFSET = struct.Struct("<Q")
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _get_lock(path):
+    """One lock per store so that concurrent loggers of a thread do not interleave."""
+    path = os.path.abspath(path)
+    with _locks_guard:
+        if path not in _locks:
+            _locks[path] = threading.RLock()
+        return _locks[path]
+
+
+def parse_record(record):
+    """Drop empty fields and decode JSON-encoded values, as done for log.csv rows."""
+    parsed = {}
+    for key, value in record.items():
+        if value is None:
+            continue
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except json.decoder.JSONDecodeError:
+                pass
+        parsed[key] = value
+    return parsed
+
+
+class RecordStore:
+    def __init__(self, directory, columns=None) -> None:
+        self.directory = directory
+        self.columns = list(columns) if columns is not None else None
+        self.record_path = os.path.join(directory, RECORD_FILENAME)
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self.lock = _get_lock(self.record_path)
+
+    def __str__(self) -> str:
+        return f"RecordStore(directory={self.directory})"
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, INDEX_FILENAME))
+
+    def init(self, csv_path=None):
+        """Create the store, importing rows of a legacy log.csv if given."""
+        with self.lock:
+            if os.path.exists(self.index_path):
+                return
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+
+            rows = []
+            if csv_path is not None and os.path.exists(csv_path):
+                with open(csv_path, "r", encoding="utf-8", newline="") as f:
+                    rows = [{k: (v if v != "" else None) for k, v in row.items()}
+                            for row in csv.DictReader(f)]
+
+            with open(self.record_path, "wb") as rf, open(self.index_path, "wb") as xf:
+                for row in rows:
+                    xf.write(_OFFSET.pack(rf.tell()))
+                    rf.write(self._encode(row))
+
+    def __len__(self):
+        if not os.path.exists(self.index_path):
+            return 0
+        return os.path.getsize(self.index_path) // _OFFSET.size
+
+    def append(self, record):
+        """Append a record and return its row index."""
+        with self.lock:
+            row_idx = len(self)
+            offset = self._write_record(record)
+            with open(self.index_path, "ab") as f:
+                f.write(_OFFSET.pack(offset))
+            return row_idx
+
+    def update(self, row_idx, record):
+        """Replace the record at ``row_idx``."""
+        with self.lock:
+            if row_idx < 0 or row_idx >= len(self):
+                raise IndexError(f"row {row_idx} out of range")
+            offset = self._write_record(record)
+            with open(self.index_path, "r+b") as f:
+                f.seek(row_idx * _OFFSET.size)
+                f.write(_OFFSET.pack(offset))
+
+    def get(self, row_idx):
+        """Read the record at ``row_idx``."""
+        with open(self.index_path, "rb") as f:
+            f.seek(row_idx * _OFFSET.size)
+            chunk = f.read(_OFFSET.size)
+        if len(chunk) < _OFFSET.size:
+            raise IndexError(f"row {row_idx} out of range")
+        offset, = _OFFSET.unpack(chunk)
+        with open(self.record_path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def read_all(self):
+        """Read the latest version of every record, in row order."""
+        if not os.path.exists(self.index_path):
+            return []
+        with self.lock:
+            return self._read_all()
+
+    def export_csv(self, csv_path):
+        """Write all records to a CSV file with the same layout as log.csv."""
+        records = self.read_all()
+        columns = self.columns
+        if columns is None:
+            columns = []
+            for record in records:
+                columns += [key for key in record if key not in columns]
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+            for record in records:
+                writer.writerow({k: v for k, v in record.items() if v is not None})
+
+    def compact(self):
+        """Rewrite the store without superseded records."""
+        with self.lock:
+            records = self._read_all()
+            tmp_record_path = self.record_path + ".tmp"
+            tmp_index_path = self.index_path + ".tmp"
+            with open(tmp_record_path, "wb") as rf, open(tmp_index_path, "wb") as xf:
+                for record in records:
+                    xf.write(_OFFSET.pack(rf.tell()))
+                    rf.write(self._encode(record))
+            os.replace(tmp_record_path, self.record_path)
+            os.replace(tmp_index_path, self.index_path)
+
+    def _read_all(self):
+        with open(self.index_path, "rb") as f:
+            index = f.read()
+        with open(self.record_path, "rb") as f:
+            content = f.read()
+        return [json.loads(content[offset:content.index(b"\n", offset)])
+                for (offset,) in _OFFSET.iter_unpack(index)]
+
+    def _write_record(self, record):
+        with open(self.record_path, "ab") as f:
+            offset = f.tell()
+            f.write(self._encode(record))
+        return offset
+
+    @staticmethod
+    def _encode(record):
+        return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
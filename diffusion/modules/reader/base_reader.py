@@ -5,6 +5,9 @@ import base64
 import pandas as pd
 from PIL import Image
 from .readers import register_reader
+from .thumbnail_cache import thumbnail_cache
+from ..logger.record_store import RecordStore, parse_record
+from ..logger.embedding_store import EmbeddingStore, pack_embeddings
 
 
 @register_reader("base")
@@ -23,29 +26,40 @@ class BaseReader:
             f")"
         )
 
-    def read(self, preview=False):
+    def read(self, preview=False, reference=False):
+        """Read the files.
+
+        With reference=True images are not read; their data is None and
+        clients fetch them separately by filename.
+        """
         if self.filenames is None:
             return None
         if self.mode == "one":
-            return self.read_one(self.filenames, preview=preview)
-        return self.read_many(self.filenames, preview=preview)
+            return self.read_one(self.filenames, preview=preview, reference=reference)
+        if EmbeddingStore.exists(self.directory):
+            return self.read_embeddings(self.filenames)
+        return self.read_many(self.filenames, preview=preview, reference=reference)
 
-    def read_one(self, filename, preview=False) -> dict or list or str:
+    def read_one(self, filename, preview=False, reference=False) -> dict or list or str:
         segs = filename.split(".")
         suffix = segs[-1]
 
         if suffix == "csv":
+            if filename == "log.csv" and RecordStore.exists(self.directory):
+                return self.read_log()
             return self.read_csv(filename)
         elif suffix == "png":
+            if reference:
+                return None
             return self.read_image(filename, preview=preview)
         elif suffix == "json":
             return self.read_json(filename)
         raise NotImplementedError
 
-    def read_many(self, filenames, preview=False) -> list:
+    def read_many(self, filenames, preview=False, reference=False) -> list:
         return [{
             "filename": filename,
-            "data": self.read_one(filename, preview) 
+            "data": self.read_one(filename, preview, reference)
         } for filename in filenames]
 
     def read_csv(self, filename) -> list:
@@ -71,6 +85,15 @@ class BaseReader:
         df = df.apply(row_parse_json, axis=1)
         return df.to_dict(orient="records")
 
+    def read_log(self) -> list:
+        store = RecordStore(self.directory)
+        return [parse_record(record) for record in store.read_all()]
+
+    def read_embeddings(self, filenames) -> dict:
+        """Embeddings of filenames packed as one matrix, see pack_embeddings."""
+        store = EmbeddingStore(self.directory)
+        return pack_embeddings(*store.read(filenames))
+
     def read_json(self, filename) -> dict:
         filepath = os.path.join(self.directory, filename)
         with open(filepath, "r", encoding="utf-8") as f:
@@ -81,38 +104,21 @@ class BaseReader:
                 return {}
 
     def read_image(self, filename, preview=False, max_width=128, max_height=128) -> str:
+        image_data = self.read_image_bytes(filename, preview, max_width, max_height)
+
+        # Encode the image data as Base64
+        return base64.b64encode(image_data).decode()
+
+    def read_image_bytes(self, filename, preview=False, max_width=128, max_height=128) -> bytes:
         filepath = os.path.join(self.directory, filename)
+
+        if preview:
+            # previews are served from the thumbnail cache without decoding the image
+            return thumbnail_cache.get(filepath, max_width, max_height)
+
         image = Image.open(filepath)
 
-        # Convert the resized image to bytes (image stream)
+        # Convert the image to bytes (image stream)
         img_io = io.BytesIO()
         image.save(img_io, 'JPEG')
-        img_io.seek(0)
-
-        # Encode the image data as Base64
-        image_data_base64 = base64.b64encode(img_io.getvalue()).decode()
-
-        if not preview:
-            return image_data_base64
-
-        # Check the image dimensions
-        width, height = image.size
-        if width > max_width or height > max_height:
-            # Resize the image if it's larger than the maximum dimensions
-            ratio = min(max_width / width, max_height / height)
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-            resized_image = image.resize((new_width, new_height))
-        else:
-            # Keep the original image if it's smaller than or equal to the maximum dimensions
-            resized_image = image
-
-        # Convert the resized image to bytes (image stream)
-        img_io = io.BytesIO()
-        resized_image.save(img_io, 'JPEG')
-        img_io.seek(0)
-
-        # Encode the image data as Base64
-        image_data_base64 = base64.b64encode(img_io.getvalue()).decode()
-
-        return image_data_base64
+        return img_io.getvalue()
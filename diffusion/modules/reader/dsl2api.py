@@ -5,6 +5,7 @@ import os
 
 from utils.filepath import get_session_directory, replace_filenames_extension
 from .readers import readers
+from ..logger.embedding_store import EmbeddingStore
 
 
 def dsl2api(dsl):
@@ -60,7 +61,9 @@ def parse_attribute_api(attribute, meta_info):
 
         # already processed files
         processed_dir = os.path.join(session_directory, name, task)
-        if os.path.exists(processed_dir):
+        if EmbeddingStore.exists(processed_dir):
+            already_processed = set(EmbeddingStore(processed_dir).filenames())
+        elif os.path.exists(processed_dir):
             already_processed = os.listdir(processed_dir)
         else:
             already_processed = []
@@ -138,7 +141,10 @@ def get_attribute_filenames(attribute, session_directory, session_log):
             raise NotImplementedError
     else:
         path = os.path.join(session_directory, path)
-        if os.path.exists(path):
+        if EmbeddingStore.exists(path):
+            directory = path
+            filenames = EmbeddingStore(directory).filenames()
+        elif os.path.exists(path):
             directory = path
             filenames = os.listdir(directory)
         else:
@@ -1,3 +1,4 @@
+from utils.executor import run_blocking
 from .readers import register_reader, readers
 from .dsl2api import dsl2api
 
@@ -43,33 +44,55 @@ class SessionReader:
     def __init__(self, dsl, extensions=[]) -> None:
         self.dsl = dsl
         self.extensions = extensions
+        # 'reference' leaves image data out, clients fetch images by filename
+        self.reference_images = dsl.get('imageMode') == 'reference'
 
         if 'attributes' not in self.dsl:
             self.dsl['attributes'] = default_attributes
 
     def read(self):
         apis = dsl2api(self.dsl)
+
+        if self.is_incomplete(apis):
+            # run extensions
+            extensions = sorted(self.extensions)
+            for ext in extensions:
+                ext.execute()
+            apis = dsl2api(self.dsl)
+
+        return self.read_apis(apis)
+
+    async def read_async(self):
+        """Same as read, but file access runs in the executor and extensions
+        are requested without blocking the IOLoop."""
+        apis = await run_blocking(dsl2api, self.dsl)
+
+        if await run_blocking(self.is_incomplete, apis):
+            extensions = sorted(self.extensions)
+            for ext in extensions:
+                await ext.execute_async()
+            apis = await run_blocking(dsl2api, self.dsl)
+
+        return await run_blocking(self.read_apis, apis)
+
+    def is_incomplete(self, apis):
+        """Whether a non-empty session misses some of the requested files."""
         base_reader = readers["base"]
 
         # check if there is none records
-        empty_session = False
         for api in apis:
             if api['attribute']['attribute'] == 'log/log':
                 reader = base_reader(**api['api'])
                 logs = reader.read()
                 if len(logs) == 0:
-                    empty_session = True
-                    break
+                    return False
 
         # check if all files exist
         api_list = [api['api'] for api in apis]
-        if not empty_session and False in api_list:
-            # run extensions
-            extensions = sorted(self.extensions)
-            for ext in extensions:
-                ext.execute()
-            apis = dsl2api(self.dsl)
+        return False in api_list
 
+    def read_apis(self, apis):
+        base_reader = readers["base"]
         input_data = {}
 
         for api in apis:
@@ -77,7 +100,7 @@ class SessionReader:
                 data = None
             else:
                 reader = base_reader(**api['api'])
-                data = reader.read(preview=True)
+                data = reader.read(preview=True, reference=self.reference_images)
             attribute_name = api['attribute']['attribute']
             input_data[attribute_name] = {
                 'attribute': api['attribute'],
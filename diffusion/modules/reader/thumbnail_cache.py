@@ -0,0 +1,120 @@
+'''
+Cache of JPEG previews of generated images.
+
+Previews are keyed by the image path and its modification time, so a rewritten
+image never serves a stale preview. Encoded previews are kept in an in-memory
+LRU and in a content-addressed directory on disk, so that session loads serve
+them without decoding the original PNGs.
+'''
+import os
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+CACHE_DIR = './outputs/.thumbnails'
+MAX_ENTRIES = 4096
+MAX_WIDTH = 128
+MAX_HEIGHT = 128
+
+
+def make_preview(image, max_width=MAX_WIDTH, max_height=MAX_HEIGHT) -> bytes:
+    '''Resize an image to fit in max_width x max_height and encode it as JPEG'''
+    # Check the image dimensions
+    width, height = image.size
+    if width > max_width or height > max_height:
+        # Resize the image if it's larger than the maximum dimensions
+        ratio = min(max_width / width, max_height / height)
+        new_width = int(width * ratio)
+        new_height = int(height * ratio)
+        image = image.resize((new_width, new_height))
+
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    img_io = io.BytesIO()
+    image.save(img_io, 'JPEG')
+    return img_io.getvalue()
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES) -> None:
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __str__(self) -> str:
+        return (
+            f"ThumbnailCache("
+            f"cache_dir={self.cache_dir}, "
+            f"entries={len(self.entries)}/{self.max_entries}"
+            f")"
+        )
+
+    def key(self, filepath, max_width=MAX_WIDTH, max_height=MAX_HEIGHT):
+        stat = os.stat(filepath)
+        identity = f'{os.path.abspath(filepath)}:{stat.st_mtime_ns}:{max_width}x{max_height}'
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def get(self, filepath, max_width=MAX_WIDTH, max_height=MAX_HEIGHT) -> bytes:
+        '''Get the JPEG preview of an image, creating it on a miss'''
+        key = self.key(filepath, max_width, max_height)
+
+        data = self.get_memory(key)
+        if data is not None:
+            return data
+
+        data = self.get_disk(key)
+        if data is None:
+            with Image.open(filepath) as image:
+                data = make_preview(image, max_width, max_height)
+            self.put_disk(key, data)
+
+        self.put_memory(key, data)
+        return data
+
+    def put(self, filepath, image, max_width=MAX_WIDTH, max_height=MAX_HEIGHT):
+        '''Cache the preview of an image that has just been saved to filepath'''
+        key = self.key(filepath, max_width, max_height)
+        data = make_preview(image, max_width, max_height)
+        self.put_disk(key, data)
+        self.put_memory(key, data)
+
+    def get_memory(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def put_memory(self, key, data):
+        with self.lock:
+            self.entries[key] = data
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.jpg')
+
+    def get_disk(self, key):
+        path = self.disk_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def put_disk(self, key, data):
+        path = self.disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so readers never see a partial preview
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+thumbnail_cache = ThumbnailCache()
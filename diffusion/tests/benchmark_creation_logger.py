@@ -0,0 +1,100 @@
+'''
+Benchmark per-request logging latency as a thread grows.
+
+Compares the append-only record store used by CreationLogger with the previous
+approach of reading and rewriting the whole log.csv for every request and
+response.
+
+Run from the diffusion directory:
+    python tests/benchmark_creation_logger.py --rows 5000
+'''
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import pandas as pd
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from modules.logger.record_store import RecordStore
+from modules.logger.creation_logger import get_log_columns
+
+
+def make_row(row_idx, finished=False):
+    row = {
+        'prompt_id': row_idx,
+        'model': 'stable-diffusion-webui',
+        'create_time': '2024-01-01 00:00:00',
+        'create_timezone': 'Asia/Shanghai',
+        'steps': 20,
+        'batch_size': 4,
+        'prompt': f'a photo of a cat, prompt number {row_idx}, highly detailed',
+        'setting_filename': f'{row_idx}_20240101000000_settings.json',
+    }
+    if finished:
+        row['finish_time'] = '2024-01-01 00:00:10'
+        row['finish_timezone'] = 'Asia/Shanghai'
+        row['width'] = 512
+        row['height'] = 512
+        row['output_filenames'] = f'["{row_idx}(0).png", "{row_idx}(1).png"]'
+    return row
+
+
+def log_with_csv(csv_path, row_idx):
+    df = pd.read_csv(csv_path)
+    df = pd.concat([df, pd.DataFrame([make_row(row_idx)])], ignore_index=True)
+    df.to_csv(csv_path, index=False)
+
+    df = pd.read_csv(csv_path, dtype=object)
+    row = make_row(row_idx, finished=True)
+    df.iloc[row_idx] = [row.get(column) for column in df.columns]
+    df.to_csv(csv_path, index=False)
+
+
+def log_with_store(store, row_idx):
+    row_idx = store.append(make_row(row_idx))
+    store.update(row_idx, make_row(row_idx, finished=True))
+
+
+def run(rows, checkpoints, csv_limit):
+    directory = tempfile.mkdtemp()
+    csv_path = os.path.join(directory, 'log.csv')
+    pd.DataFrame(columns=get_log_columns()).to_csv(csv_path, index=False)
+    store = RecordStore(directory, columns=get_log_columns())
+    store.init()
+
+    print(f"{'rows':>8} {'store (ms)':>12} {'csv (ms)':>12}")
+    try:
+        for row_idx in range(rows):
+            is_checkpoint = (row_idx + 1) in checkpoints
+
+            start = time.perf_counter()
+            log_with_store(store, row_idx)
+            store_time = time.perf_counter() - start
+
+            csv_time = None
+            if row_idx < csv_limit:
+                start = time.perf_counter()
+                log_with_csv(csv_path, row_idx)
+                csv_time = time.perf_counter() - start
+
+            if is_checkpoint:
+                csv_str = f'{csv_time * 1000:12.3f}' if csv_time is not None else f"{'-':>12}"
+                print(f'{row_idx + 1:8d} {store_time * 1000:12.3f} {csv_str}')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--csv-limit', type=int, default=2000,
+                        help='stop timing the csv path after this many rows')
+    args = parser.parse_args()
+
+    checkpoints = {1, 10, 100, 500, 1000, 2000, 5000, 10000, 20000, args.rows}
+    run(args.rows, checkpoints, args.csv_limit)
@@ -0,0 +1,100 @@
+'''
+Benchmark writing and reading the image embeddings of a thread.
+
+Compares the embedding store with the previous layout of one indented JSON
+file per image. Every generation writes the embeddings of its images and then
+reads the embeddings of the whole thread for the projection, as the image
+projection extension does. Reading is timed up to the payload sent to
+preprocess: a list of JSON vectors before, packed embeddings now.
+
+Run from the diffusion directory:
+    python tests/benchmark_embedding_store.py --images 1000 --batch 4
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from modules.logger.embedding_store import EmbeddingStore, pack_embeddings, unpack_embeddings
+
+
+def write_json(directory, filenames, matrix):
+    for filename, vector in zip(filenames, matrix):
+        with open(os.path.join(directory, filename), 'w', encoding='utf-8') as f:
+            json.dump(vector.tolist(), f, indent=4)
+
+
+def read_json(directory):
+    data = []
+    for filename in os.listdir(directory):
+        with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f:
+            data.append({'filename': filename, 'data': json.load(f)})
+    return json.dumps(data)
+
+
+def read_store(directory):
+    return json.dumps(pack_embeddings(*EmbeddingStore(directory).read()))
+
+
+def run(num_images, batch, dim, dtype, seed):
+    rng = np.random.default_rng(seed)
+    root = tempfile.mkdtemp()
+    json_dir = os.path.join(root, 'json')
+    store_dir = os.path.join(root, 'store')
+    os.makedirs(json_dir)
+    store = EmbeddingStore(store_dir)
+
+    timings = {'json write': 0, 'json read': 0, 'store write': 0, 'store read': 0}
+    payloads = {}
+    try:
+        for start in range(0, num_images, batch):
+            filenames = [f'{start // batch}({i}).json' for i in range(batch)]
+            matrix = rng.normal(size=(batch, dim)).astype(np.float32)
+
+            begin = time.perf_counter()
+            write_json(json_dir, filenames, matrix)
+            timings['json write'] += time.perf_counter() - begin
+            begin = time.perf_counter()
+            payloads['json'] = read_json(json_dir)
+            timings['json read'] += time.perf_counter() - begin
+
+            begin = time.perf_counter()
+            store.append(filenames, matrix.astype(dtype))
+            timings['store write'] += time.perf_counter() - begin
+            begin = time.perf_counter()
+            payloads['store'] = read_store(store_dir)
+            timings['store read'] += time.perf_counter() - begin
+
+        json_matrix = {item['filename']: item['data'] for item in json.loads(payloads['json'])}
+        filenames, store_matrix = unpack_embeddings(json.loads(payloads['store']))
+        max_diff = max(np.abs(np.array(json_matrix[fn]) - row).max()
+                       for fn, row in zip(filenames, store_matrix))
+
+        generations = -(-num_images // batch)
+        print(f'{num_images} images of dimension {dim}, {generations} generations of {batch}')
+        for name, elapsed in timings.items():
+            print(f'{name:>12}: {elapsed:8.2f}s total, {elapsed / generations * 1000:8.2f}ms per generation')
+        print(f"last payload: json {len(payloads['json']) / 2 ** 20:.1f}MB, "
+              f"store {len(payloads['store']) / 2 ** 20:.1f}MB, max difference {max_diff:.2e}")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--batch', type=int, default=4)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--dtype', default='float16', choices=['float16', 'float32'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.images, args.batch, args.dim, args.dtype, args.seed)
@@ -0,0 +1,98 @@
+'''
+Consistency of the embedding store after an interrupted append, and with
+embeddings logged as JSON files.
+
+Run from the diffusion directory:
+    python -m pytest tests/test_embedding_store.py
+'''
+import os
+import sys
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from modules.logger.base_logger import BaseLogger
+from modules.logger.embedding_store import EmbeddingStore, MATRIX_FILENAME, INDEX_FILENAME
+
+
+class TestInterruptedAppend(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = EmbeddingStore(self.directory)
+        self.vectors = np.arange(16, dtype=np.float32).reshape(4, 4)
+        self.store.append(['a.json', 'b.json'], self.vectors[:2])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, data):
+        with open(os.path.join(self.directory, filename), 'ab') as f:
+            f.write(data)
+
+    def assert_rows(self, filenames, rows):
+        read_filenames, matrix = self.store.read()
+        self.assertEqual(read_filenames, filenames)
+        np.testing.assert_array_equal(matrix, self.vectors[rows])
+
+    def test_rows_without_index(self):
+        '''Crash after the matrix write, before the index write'''
+        self.write(MATRIX_FILENAME, np.ones((1, 4), dtype=np.float32).tobytes())
+        self.assert_rows(['a.json', 'b.json'], [0, 1])
+
+        self.store.append(['c.json'], self.vectors[2:3])
+        self.assert_rows(['a.json', 'b.json', 'c.json'], [0, 1, 2])
+
+    def test_torn_row(self):
+        '''Crash partway through the matrix write'''
+        self.write(MATRIX_FILENAME, b'\x01' * 6)
+        self.assertEqual(len(self.store), 2)
+
+        self.store.append(['c.json'], self.vectors[2:3])
+        self.assert_rows(['a.json', 'b.json', 'c.json'], [0, 1, 2])
+
+    def test_torn_index_line(self):
+        '''Crash partway through the index write, the rows of the append are all written'''
+        self.write(MATRIX_FILENAME, self.vectors[2:4].tobytes())
+        self.write(INDEX_FILENAME, b'"c.json"\n"d.js')
+        self.assert_rows(['a.json', 'b.json', 'c.json'], [0, 1, 2])
+
+        self.store.append(['d.json'], self.vectors[3:4])
+        self.assert_rows(['a.json', 'b.json', 'c.json', 'd.json'], [0, 1, 2, 3])
+
+    def test_written_again(self):
+        self.store.append(['a.json'], self.vectors[2:3])
+        filenames, matrix = self.store.read(['a.json', 'b.json'])
+        self.assertEqual(filenames, ['a.json', 'b.json'])
+        np.testing.assert_array_equal(matrix, self.vectors[[2, 1]])
+
+
+class TestJsonFiles(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def log(self, filenames, vectors):
+        files = [{'filename': fn, 'data': vector} for fn, vector in zip(filenames, vectors)]
+        BaseLogger('list', self.directory, files).write()
+
+    def test_imported(self):
+        self.log(['a.json'], [[1.0, 2.0]])
+        EmbeddingStore(self.directory).append(['b.json'], np.array([[3.0, 4.0]]))
+        filenames, matrix = EmbeddingStore(self.directory).read()
+        self.assertEqual(filenames, ['a.json', 'b.json'])
+        np.testing.assert_array_equal(matrix, [[1, 2], [3, 4]])
+
+    def test_logged_after_the_store(self):
+        EmbeddingStore(self.directory).append(['a.json'], np.array([[1.0, 2.0]]))
+        self.log(['b.json', 'c.json'], [[3.0, 4.0], [5.0, 6.0]])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'b.json')))
+        filenames, matrix = EmbeddingStore(self.directory).read()
+        self.assertEqual(filenames, ['a.json', 'b.json', 'c.json'])
+        np.testing.assert_array_equal(matrix, [[1, 2], [3, 4], [5, 6]])
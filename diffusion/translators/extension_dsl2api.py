@@ -3,6 +3,7 @@ import json
 
 from modules.reader.readers import readers
 from modules.reader.dsl2api import dsl2api as read_dsl2api
+from modules.logger.embedding_store import is_packed, unpack_embeddings
 from utils.filepath import get_session_directory
 
 
@@ -123,7 +124,14 @@ def output_dsl2api(output_data, config):
 
     target, mapping, suffix = config["output"].split("-")
 
-    if target == "map":
+    if target == "map" and is_packed(output_data):
+        mode = "embeddings"
+        filenames, matrix = unpack_embeddings(output_data)
+        files = {
+            "filenames": [f"{os.path.splitext(fn)[0]}.{suffix}" for fn in filenames],
+            "matrix": matrix
+        }
+    elif target == "map":
         mode = "list"
         for item in output_data:
             filename, _ = os.path.splitext(item["filename"])
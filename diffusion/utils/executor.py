@@ -0,0 +1,16 @@
+'''Run blocking disk and CPU work off the IOLoop'''
+
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.ioloop
+
+MAX_WORKERS = 8
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="diffusion-io")
+
+
+def run_blocking(func, *args, **kwargs):
+    '''Run func(*args, **kwargs) in the shared executor and return an awaitable'''
+    loop = tornado.ioloop.IOLoop.current()
+    return loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
@@ -1,35 +1,139 @@
 """
 This module contains the RequestQueue class which manages a queue of requests.
+
+Each configured model gets a ModelWorkerPool: a bounded queue served by a fixed
+number of worker coroutines on the IOLoop. Requests beyond the queue size are
+rejected immediately, so a busy model pushes back instead of piling up work.
+Calls to the model run on the non-blocking HTTP client and logging runs in the
+shared executor, so a generation never blocks the IOLoop.
 """
 
-import queue
-import threading
+import json
+import time
+import asyncio
+import traceback
 from datetime import datetime
-import requests
 import pytz
+from tornado.httpclient import AsyncHTTPClient
+
+from .executor import run_blocking
 
 
 request_queue = None # RequestQueue
 
 
+class ModelWorkerPool:
+    def __init__(self, name, urls, max_concurrency, max_queue_size):
+        self.name = name
+        self.urls = urls
+        self.max_concurrency = max_concurrency
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait_time = 0.0
+        self.total_service_time = 0.0
+        self.max_wait_time = 0.0
+        self.max_service_time = 0.0
+
+        self.handler = None
+        self.workers = []
+
+    def start(self, handler):
+        """Set the request handler; workers are spawned on the IOLoop at the first request."""
+        self.handler = handler
+
+    def spawn_workers(self):
+        # spread workers over the replicas of the model
+        for idx in range(self.max_concurrency):
+            url = self.urls[idx % len(self.urls)]
+            worker = asyncio.ensure_future(self.work(self.handler, url))
+            self.workers.append(worker)
+
+    def submit(self, request_info):
+        """Enqueue a request without waiting, raising asyncio.QueueFull if the pool is saturated."""
+        if not self.workers:
+            self.spawn_workers()
+
+        request_info["enqueue_time"] = time.perf_counter()
+        try:
+            self.queue.put_nowait(request_info)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+
+    async def work(self, handler, url):
+        while True:
+            request_info = await self.queue.get()
+            start_time = time.perf_counter()
+            wait_time = start_time - request_info["enqueue_time"]
+            self.in_flight += 1
+
+            succeeded = False
+            try:
+                succeeded = await handler(request_info, url)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                service_time = time.perf_counter() - start_time
+                self.in_flight -= 1
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.total_wait_time += wait_time
+                self.total_service_time += service_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+                self.max_service_time = max(self.max_service_time, service_time)
+                self.queue.task_done()
+
+    def stats(self):
+        finished = self.completed + self.failed
+        return {
+            "name": self.name,
+            "replicas": len(self.urls),
+            "max_concurrency": self.max_concurrency,
+            "max_queue_size": self.queue.maxsize,
+            "queue_depth": self.queue.qsize(),
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_time": self.total_wait_time / finished if finished else 0.0,
+            "max_wait_time": self.max_wait_time,
+            "avg_service_time": self.total_service_time / finished if finished else 0.0,
+            "max_service_time": self.max_service_time,
+        }
+
+
 class RequestQueue:
     def __init__(self, config):
-        self.queues = {}
-        self.urls = {}
-        self.is_running = {}
+        self.pools = {}
 
         for url in config:
-            self.queues[url["name"]] = queue.Queue(maxsize=url["max_queue_size"])
-            self.urls[url["name"]] = url["url"]
-            self.is_running[url["name"]] = False
+            # a model can be served by several replicas listed under `replicas`
+            urls = url.get("replicas") or [url["url"]]
+            max_concurrency = url.get("max_concurrency", len(urls))
+            pool = ModelWorkerPool(
+                name=url["name"],
+                urls=urls,
+                max_concurrency=max_concurrency,
+                max_queue_size=url["max_queue_size"],
+            )
+            pool.start(self.process_request)
+            self.pools[url["name"]] = pool
 
     def add_request(self, url_name, data, logger, extensions=None, method="POST"):
+        if url_name not in self.pools:
+            return False, f"Unknown model: {url_name}"
+
         timezone_name = "Asia/Shanghai"
         current_time = datetime.now(pytz.timezone(timezone_name))
 
         request_info = {
             "model": url_name,
-            "url": self.urls[url_name],
             "method": method,
             "time": current_time,
             "timezone": timezone_name,
@@ -39,28 +143,33 @@ class RequestQueue:
         }
 
         try:
-            self.queues[url_name].put(request_info, block=False)
+            self.pools[url_name].submit(request_info)
             id = logger.get_prompt_id()
-            threading.Thread(target=self.run, args=(url_name,)).start()
             return True, id
-        except queue.Full:
+        except asyncio.QueueFull:
             return False, "System is busy"
 
-    def process_request(self, request_info):
-        url = request_info['url']
+    async def process_request(self, request_info, url):
         method = request_info['method']
         data = request_info['data']
+        request_info['url'] = url
 
         # Log request meta data
         logger = request_info['logger']
         print("log request meta data")
-        logger.log_request(request_info)
+        await run_blocking(logger.log_request, request_info)
 
         response = None
 
         if method == "POST":
             try:
-                response = requests.post(url=url, json=data, timeout=600)
+                response = await AsyncHTTPClient().fetch(
+                    url,
+                    method="POST",
+                    body=json.dumps(data),
+                    headers={"Content-Type": "application/json"},
+                    request_timeout=600,
+                )
             except Exception:
                 response = None
         else:
@@ -68,33 +177,30 @@ class RequestQueue:
 
         if response is None:
             print("response is None")
-            return
+            return False
 
         # Log response
-        logger.log_response(response.json())
+        await run_blocking(lambda: logger.log_response(json.loads(response.body)))
 
-        # Execute extensions
-        self.execute_extensions(request_info['extensions'], "post_request")
+        # Execute extensions, a failed extension does not fail the generation
+        try:
+            await self.execute_extensions(request_info['extensions'], "post_request")
+        except Exception:
+            traceback.print_exc()
 
-        return
+        return True
 
     def is_empty(self, url_name):
-        return self.queues[url_name].empty()
-
-    def run(self, url_name):
-        if self.is_running[url_name]:
-            return
-        self.is_running[url_name] = True
-        while not self.is_empty(url_name):
-            request_info = self.queues[url_name].get()
-            self.process_request(request_info)
-        self.is_running[url_name] = False
-
-    def execute_extensions(self, extensions, trigger_time):
+        return self.pools[url_name].queue.empty()
+
+    def get_stats(self):
+        return [pool.stats() for pool in self.pools.values()]
+
+    async def execute_extensions(self, extensions, trigger_time):
         extensions_ = [ext for ext in extensions if ext.trigger_time == trigger_time]
         extensions_ = sorted(extensions_)
         for ext in extensions_:
-            ext.execute()
+            await ext.execute_async()
 
 
 def initialize_request_queue(config):
@@ -106,3 +212,8 @@ def add_request(url_name, data, logger, extensions=None):
     global request_queue
     state, description = request_queue.add_request(url_name, data, logger, extensions)
     return state, description
+
+
+def get_stats():
+    global request_queue
+    return request_queue.get_stats()
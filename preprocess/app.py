@@ -1,4 +1,5 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import tornado.httpserver
 import tornado.ioloop
 import tornado.options
@@ -9,11 +10,25 @@ from tornado.options import define, options
 
 import modules
 from modules.processors import processors
+from modules.image_encoding.clip_encoding import clip_service, image_batcher, text_batcher, \
+    MODES as CLIP_MODES
+from utils.embedding_cache import text_embedding_cache, CACHE_DIR, CAPACITY
 
 app_logger = logging.getLogger(__name__)
 
 define("port", default=5707, help = "run on the given port", type = int)
 define("show", default=False, help = "run on the given port", type = bool)
+define("clip_mode", default="eager", help = f"CLIP inference mode, one of {CLIP_MODES}", type = str)
+define("clip_device", default=None, help = "CLIP device, cuda if available by default", type = str)
+define("clip_threads", default=None, help = "intra-op threads of CLIP on the CPU", type = int)
+define("warmup", default=True, help = "load and warm up CLIP at startup", type = bool)
+define("workers", default=8, help = "threads processing requests concurrently", type = int)
+define("batch_wait", default=0.005, help = "seconds CLIP waits to batch concurrent requests", type = float)
+define("text_cache", default=CACHE_DIR, help = "directory of the prompt embedding cache, empty to keep it in memory", type = str)
+define("text_cache_size", default=CAPACITY, help = "prompt embeddings kept in memory", type = int)
+
+# requests are processed in threads, so CLIP can batch those of concurrent sessions
+executor = None
 
 
 class BaseHandler(tornado.web.RequestHandler):
@@ -29,6 +44,18 @@ class BaseHandler(tornado.web.RequestHandler):
         raise tornado.web.HTTPError(400, f"Missing argument: {arg}")
 
 
+class ReadyHandler(BaseHandler):
+    def get(self):
+        '''Readiness probe, 503 until the CLIP model is loaded'''
+        if not clip_service.ready:
+            self.set_status(503)
+        self.write({
+            "ready": clip_service.ready,
+            "service": str(clip_service),
+            "text_cache": text_embedding_cache.stats()
+        })
+
+
 def get_preprocess_handlers():
     handlers = []
 
@@ -41,11 +68,12 @@ def get_preprocess_handlers():
     def register_preprocess_handler(name, processor):
         @register_handler(name)
         class PreprocessHandler(BaseHandler):
-            def post(self):
+            async def post(self):
                 input_data = self.get_argument("input", required=True)
                 config = self.get_argument("config", required=True)
                 preprocessor = processor(input_data, config)
-                output_data = preprocessor.process()
+                output_data = await tornado.ioloop.IOLoop.current().run_in_executor(
+                    executor, preprocessor.process)
                 response = {
                     "output": output_data,
                     "config": config
@@ -65,6 +93,7 @@ class Application(tornado.web.Application):
     """
     def __init__ (self):
         handlers = get_preprocess_handlers()
+        handlers.append((r"/ready", ReadyHandler))
         settings = {
             "debug": True
         }
@@ -73,7 +102,16 @@ class Application(tornado.web.Application):
 if __name__ == "__main__":
     tornado.options.parse_command_line()
     print("server running at server:%d ..."%(tornado.options.options.port))
+    clip_service.configure(mode=options.clip_mode, device=options.clip_device,
+                           threads=options.clip_threads)
+    image_batcher.max_wait = text_batcher.max_wait = options.batch_wait
+    text_embedding_cache.configure(directory=options.text_cache, capacity=options.text_cache_size)
+    executor = ThreadPoolExecutor(max_workers=options.workers)
     app = Application()
     http_server = tornado.httpserver.HTTPServer(app)
     http_server.listen(options.port)
-    tornado.ioloop.IOLoop.instance().start()
+    io_loop = tornado.ioloop.IOLoop.instance()
+    if options.warmup:
+        # warm up in the background, /ready answers 503 meanwhile
+        io_loop.run_in_executor(None, clip_service.warmup)
+    io_loop.start()
@@ -0,0 +1,110 @@
+'''
+Coalesce encoding requests of concurrent sessions into batches.
+
+Callers submit the inputs of a request and wait for its outputs. A worker
+thread takes the first pending request, waits for more requests until
+max_wait seconds have passed or max_batch inputs are pending, runs them as one
+batch and hands every request its rows of the outputs. A request is never
+split, a request larger than max_batch is run alone. A request that arrives
+when nothing else is pending still waits max_wait, which is small next to a
+forward pass of the model.
+'''
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+MAX_BATCH = 64
+MAX_WAIT = 0.005
+
+
+class MicroBatcher:
+    '''Runs encode on batches of the inputs of concurrent requests'''
+    def __init__(self, encode, concatenate=np.concatenate, max_batch=MAX_BATCH,
+                 max_wait=MAX_WAIT, name="batcher") -> None:
+        self.encode = encode
+        self.concatenate = concatenate
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.name = name
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.worker = None
+        self.held = None # a request that did not fit the last batch
+        self.batches = 0
+        self.requests = 0
+        self.items = 0
+
+    def __str__(self) -> str:
+        return (
+            f"MicroBatcher("
+            f"name={self.name}, "
+            f"batches={self.batches}, "
+            f"requests={self.requests}, "
+            f"items={self.items}"
+            f")"
+        )
+
+    def submit(self, inputs):
+        '''Queue the inputs of a request, returns a future of its outputs'''
+        future = Future()
+        if len(inputs) == 0:
+            future.set_result(inputs)
+            return future
+        self.start()
+        self.pending.put((inputs, future))
+        return future
+
+    def __call__(self, inputs):
+        return self.submit(inputs).result()
+
+    def start(self):
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name=self.name, daemon=True)
+                self.worker.start()
+
+    def collect(self):
+        '''The next batch of requests, waits for the first one'''
+        if self.held is not None:
+            batch, self.held = [self.held], None
+        else:
+            batch = [self.pending.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.pending.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if size + len(request[0]) > self.max_batch:
+                self.held = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            try:
+                inputs = [request[0] for request in batch]
+                outputs = self.encode(inputs[0] if len(inputs) == 1 else self.concatenate(inputs))
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            self.batches += 1
+            self.requests += len(batch)
+            start = 0
+            for request, future in batch:
+                end = start + len(request)
+                future.set_result(outputs[start:end])
+                start = end
+            self.items += start
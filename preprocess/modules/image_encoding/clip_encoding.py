@@ -1,81 +1,243 @@
+'''
+CLIP embeddings of images and prompts.
+
+The model is loaded by a service on first use, or by warmup, so importing the
+processors does not load it and the app can answer readiness probes while it
+loads. The service runs in one of the MODES:
+- eager: the float model, the default
+- quantized: linear layers quantized to int8 on the fly, CPU only
+- jit: the TorchScript archive of the model
+- onnx: the model exported to ONNX and run by ONNX Runtime, CPU only
+
+Inference runs without autograd, and the number of intra-op threads can be
+set for CPU hosts. Inputs are prepared in the threads of the requests and the
+model runs them in batches coalesced across requests, see MicroBatcher.
+Prompts encoded before, by any session, are read from the text embedding
+cache instead, see TextEmbeddingCache.
+'''
 import os
-import sys
-import json
+import time
+import threading
 
 import torch
 import numpy as np
 
+from utils.embedding_cache import text_embedding_cache
 from . import clip
-
-# Get the parent directory of the current script (text-image-diff)
-current_dir = os.path.dirname(os.path.abspath(__file__))
-parent_dir = os.path.dirname(current_dir)
-
-# Add the parent directory to the Python path
-sys.path.append(parent_dir)
-
-# preparation
-clip.available_models()
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = clip.load("ViT-B/32", device=device)
-
-model.cuda().eval()
-input_resolution = model.visual.input_resolution
-context_length = model.context_length
-vocab_size = model.vocab_size
-
-print("device:", device)
-print("Model parameters:", f"{np.sum([int(np.prod(p.shape)) for p in model.parameters()]):,}")
-print("Input resolution:", input_resolution)
-print("Context length:", context_length)
-print("Vocab size:", vocab_size)
+from .batcher import MicroBatcher
+
+MODEL_NAME = "ViT-B/32"
+MODES = ("eager", "quantized", "jit", "onnx")
+BATCH_SIZE = 64
+ONNX_DIR = os.path.expanduser("~/.cache/clip/onnx")
+
+# inference_mode is faster than no_grad, but needs torch 1.9
+inference_mode = getattr(torch, "inference_mode", torch.no_grad)
+
+
+class ImageEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images):
+        return self.model.encode_image(images)
+
+
+class TextEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, texts):
+        return self.model.encode_text(texts)
+
+
+class OnnxEncoder:
+    '''Runs an encoder exported to ONNX, exports it if the file is missing'''
+    def __init__(self, encoder, example, path, threads=None):
+        import onnxruntime
+
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            torch.onnx.export(encoder, example, path, input_names=["input"],
+                              output_names=["output"], opset_version=12,
+                              dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}})
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, inputs):
+        outputs = self.session.run(None, {"input": inputs.numpy()})
+        return torch.from_numpy(outputs[0])
+
+
+class ClipService:
+    '''The CLIP model, loaded on first use'''
+    def __init__(self, name=MODEL_NAME, mode="eager", device=None, threads=None,
+                 batch_size=BATCH_SIZE) -> None:
+        self.name = name
+        self.mode = mode
+        self.device = device
+        self.threads = threads
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.model = None
+        self.preprocess = None
+        self.encode_image = None
+        self.encode_text = None
+        self.load_time = None
+        self.warm = False
+
+    def __str__(self) -> str:
+        return (
+            f"ClipService("
+            f"name={self.name}, "
+            f"mode={self.mode}, "
+            f"device={self.device}, "
+            f"threads={self.threads}, "
+            f"ready={self.ready}"
+            f")"
+        )
+
+    @property
+    def ready(self):
+        return self.model is not None
+
+    @property
+    def model_id(self):
+        '''The model and the mode, as modes change the embeddings slightly'''
+        return f"{self.name}/{self.mode}"
+
+    def configure(self, mode=None, device=None, threads=None, batch_size=None):
+        '''Change the options, before the model is loaded'''
+        if self.ready:
+            raise RuntimeError("The CLIP model is already loaded")
+        if mode is not None:
+            self.mode = mode
+        if device is not None:
+            self.device = device
+        if threads is not None:
+            self.threads = threads
+        if batch_size is not None:
+            self.batch_size = batch_size
+
+    def load(self):
+        '''Load the model if it is not loaded yet'''
+        if self.ready:
+            return self
+        with self.lock:
+            if not self.ready:
+                self._load()
+        return self
+
+    def _load(self):
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown CLIP mode {self.mode}, available modes = {MODES}")
+        if self.device is None:
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        if self.mode in ("quantized", "onnx") and self.device != "cpu":
+            raise ValueError(f"CLIP mode {self.mode} runs on the CPU only")
+        if self.threads:
+            torch.set_num_threads(self.threads)
+
+        start = time.perf_counter()
+        model, preprocess = clip.load(self.name, device=self.device, jit=self.mode == "jit")
+        model.eval()
+
+        if self.mode == "jit":
+            encode_image, encode_text = model.encode_image, model.encode_text
+            input_resolution = model.input_resolution.item()
+        else:
+            input_resolution = model.visual.input_resolution
+            if self.mode == "quantized":
+                model = torch.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8)
+            encode_image, encode_text = model.encode_image, model.encode_text
+            if self.mode == "onnx":
+                prefix = os.path.join(ONNX_DIR, self.name.replace("/", "-"))
+                encode_image = OnnxEncoder(
+                    ImageEncoder(model), torch.zeros(1, 3, input_resolution, input_resolution),
+                    f"{prefix}-image.onnx", self.threads)
+                encode_text = OnnxEncoder(
+                    TextEncoder(model), clip.tokenize(["a photo"]),
+                    f"{prefix}-text.onnx", self.threads)
+
+        self.preprocess = preprocess
+        self.encode_image = encode_image
+        self.encode_text = encode_text
+        self.load_time = time.perf_counter() - start
+        self.model = model
+
+        print("CLIP:", self)
+        print("Load time:", f"{self.load_time:.1f}s")
+        print("Input resolution:", input_resolution)
+        print("Intra-op threads:", torch.get_num_threads())
+
+    def warmup(self):
+        '''Load the model and run it once, so the first request is not slow'''
+        self.load()
+        if not self.warm:
+            self.text_embeddings(["a photo"])
+            self.image_embeddings([np.zeros((32, 32, 3), dtype=np.uint8)])
+            self.warm = True
+        return self
+
+    def encode(self, encoder, inputs):
+        '''Embeddings of a tensor of inputs, batch by batch'''
+        vectors = []
+        with inference_mode():
+            for start in range(0, len(inputs), self.batch_size):
+                batch = inputs[start:start + self.batch_size].to(self.device)
+                vectors.append(encoder(batch).float().cpu().numpy())
+        return np.concatenate(vectors)
+
+    def image_inputs(self, images):
+        '''Tensor of PIL images, or of HxWx3 uint8 arrays'''
+        from PIL import Image
+
+        self.load()
+        images = [Image.fromarray(image) if isinstance(image, np.ndarray) else image
+                  for image in images]
+        return torch.stack([self.preprocess(image) for image in images])
+
+    def text_inputs(self, texts):
+        return clip.tokenize(texts, truncate=True)
+
+    def encode_images(self, inputs):
+        self.load()
+        return self.encode(self.encode_image, inputs)
+
+    def encode_texts(self, inputs):
+        self.load()
+        return self.encode(self.encode_text, inputs)
+
+    def image_embeddings(self, images):
+        return self.encode_images(self.image_inputs(images))
+
+    def text_embeddings(self, texts):
+        return self.encode_texts(self.text_inputs(texts))
+
+
+clip_service = ClipService()
+image_batcher = MicroBatcher(clip_service.encode_images, torch.cat, name="clip-image")
+text_batcher = MicroBatcher(clip_service.encode_texts, torch.cat, name="clip-text")
 
 
 def clip_embeddings(images):
     print("images:", len(images))
+    return image_batcher(clip_service.image_inputs(images))
 
-    images_ = []
-
-    for image in images:
-        image_ = preprocess(image).unsqueeze(0).to(device)
-        images_.append(image_)
-
-    if len(images) == 1:
-        images_.append(images_[0])
-
-    with torch.no_grad():
-        images_ = torch.stack(images_).to(device)
-        images_ = torch.squeeze(images_)
-        vectors = model.encode_image(images_)
-        vectors = vectors.cpu()
-        vectors = vectors.detach().numpy()
 
-    if len(images) == 1:
-        vectors = vectors[:1]
-
-    return vectors
+def encode_texts(texts):
+    return text_batcher(clip_service.text_inputs(texts))
 
 
 def clip_text_embeddings(texts):
     print("texts:", len(texts))
-
-    texts_ = []
-
-    for text in texts:
-        text_ = clip.tokenize(text, truncate=True).to(device)
-        texts_.append(text_)
-
-    if len(texts) == 1:
-        texts_.append(texts_[0])
-
-    with torch.no_grad():
-        texts_ = torch.stack(texts_).to(device)
-        texts_ = torch.squeeze(texts_)
-        vectors = model.encode_text(texts_)
-        vectors = vectors.cpu()
-        vectors = vectors.detach().numpy()
-
-    if len(texts) == 1:
-        vectors = vectors[:1]
-
-    return vectors
+    embeddings = text_embedding_cache.embeddings(clip_service.model_id, texts, encode_texts)
+    print("text cache:", text_embedding_cache)
+    return embeddings
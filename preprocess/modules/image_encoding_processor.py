@@ -4,6 +4,7 @@ import base64
 from io import BytesIO
 from PIL import Image
 
+from utils.embeddings import pack_embeddings
 from .processors import register_processor
 from .base_processor import BaseProcessor
 from .image_encoding.clip_encoding import clip_embeddings
@@ -23,6 +24,9 @@ class ImageEncodingProcessor(BaseProcessor):
             - 'data': a list of images, each is a dictionary:
                 - 'filename': image filename
                 - 'data': base64 encoded image
+
+        The embeddings are packed as one matrix if the configuration sets
+        'embedding_dtype', see pack_embeddings.
         '''
 
         def open_image(base64_data):
@@ -38,6 +42,10 @@ class ImageEncodingProcessor(BaseProcessor):
 
         embeddings = clip_embeddings(images)
 
+        dtype = self.config.get("embedding_dtype")
+        if dtype is not None:
+            return pack_embeddings([item["filename"] for item in input_data], embeddings, dtype)
+
         output_data = []
         for idx, item in enumerate(input_data):
             item_ = copy.deepcopy(item)
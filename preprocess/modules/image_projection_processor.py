@@ -1,7 +1,8 @@
 import numpy as np
 
+from utils.embeddings import unpack_embeddings
 from utils.procrustes import align
-from utils.projection import tSNE
+from utils.projection import project
 from .processors import register_processor
 from .base_processor import BaseProcessor
 
@@ -19,6 +20,7 @@ class ImageProjectionProcessor(BaseProcessor):
             - 'data': a list of image encoding, each is a dictionary:
                 - 'filename': image filename
                 - 'data': image embedding
+              or the embeddings packed as one matrix, see unpack_embeddings
         - 'preprocess/image_projection':
             - 'attribute': attribute configuration
             - 'data': a dictionary
@@ -27,29 +29,16 @@ class ImageProjectionProcessor(BaseProcessor):
         '''
         image_data = self.input_data["preprocess/image_encoding"]["data"]
 
-        embeddings = [image["data"] for image in image_data]
-        embeddings = np.array(embeddings)
-        points = tSNE(embeddings)
-
-        output_data = {}
-        for idx, item in enumerate(image_data):
-            filename = item["filename"]
-            value = points[idx].tolist()
-            output_data[filename] = value
+        filenames, embeddings = unpack_embeddings(image_data)
+        points = project(self.config, filenames, embeddings)
 
         previous_projection = self.input_data["preprocess/image_projection"]["data"]
-        if previous_projection is None:
-            return output_data
 
         # input matrices for procrustes must have contain >1 unique points
-        if len(previous_projection) <= 1:
-            return output_data
-
-        # align the new projection with the previous one
-        ref_data = list(previous_projection.items())
-        tgt_data = list(output_data.items())
-
-        tgt_data = align(ref_data, tgt_data)
-        tgt_data = dict(tgt_data)
+        if previous_projection is not None and len(previous_projection) > 1:
+            # align the new projection with the previous one
+            ref_keys = list(previous_projection.keys())
+            ref_points = np.array(list(previous_projection.values()))
+            points = align(ref_keys, ref_points, filenames, points)
 
-        return tgt_data
+        return dict(zip(filenames, points.tolist()))
@@ -1,5 +1,6 @@
 import copy
 
+from utils.embeddings import pack_embeddings
 from .processors import register_processor
 from .base_processor import BaseProcessor
 from .image_encoding.clip_encoding import clip_text_embeddings
@@ -23,6 +24,10 @@ class TextEncodingProcessor(BaseProcessor):
 
         embeddings = clip_text_embeddings(texts)
 
+        dtype = self.config.get('embedding_dtype')
+        if dtype is not None:
+            return pack_embeddings([item['filename'] for item in input_data], embeddings, dtype)
+
         output_data = []
         for idx, item in enumerate(input_data):
             item_ = copy.deepcopy(item)
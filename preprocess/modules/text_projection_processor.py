@@ -1,9 +1,11 @@
 '''Embedding prompts to 2D space.'''
 import os
+
 import numpy as np
 
-from utils.projection import tSNE
+from utils.projection import project
 from utils.procrustes import align
+from utils.embeddings import unpack_embeddings
 from .processors import register_processor
 from .base_processor import BaseProcessor
 
@@ -26,6 +28,7 @@ class TextProjectionProcessor(BaseProcessor):
             - 'data': a list of text encoding, each is a dictionary:
                 - 'filename': setting filename
                 - 'data': text embedding
+              or the embeddings packed as one matrix, see unpack_embeddings
         - 'preprocess/image_projection':
             - 'attribute': attribute configuration
             - 'data': a dictionary
@@ -34,52 +37,38 @@ class TextProjectionProcessor(BaseProcessor):
         '''
         text_data = self.input_data['preprocess/text_encoding']['data']
 
-        embeddings = [text['data'] for text in text_data]
-        embeddings = np.array(embeddings)
-        points = tSNE(embeddings)
-
-        output_data = {}
-        for idx, item in enumerate(text_data):
-            filename = item['filename']
-            value = points[idx].tolist()
-            output_data[filename] = value
+        filenames, embeddings = unpack_embeddings(text_data)
+        points = project(self.config, filenames, embeddings)
 
         image_projection = self.input_data['preprocess/image_projection']['data']
-        if image_projection is None:
-            return output_data
-
-        # input matrices for procrustes must have contain >1 unique points
-        if len(image_projection) <= 1:
-            return output_data
+        if image_projection is None or len(image_projection) <= 1:
+            # input matrices for procrustes must have contain >1 unique points
+            return dict(zip(filenames, points.tolist()))
 
         # log data
         logs = self.input_data['log/log']['data']
+        rows = {filename: idx for idx, filename in enumerate(filenames)}
 
-        # transform output_data and image projection to (key, value) list
-        tgt_data = []
-        ref_data = []
-
-        prompt_id_dict = {}
+        # key the text projection and the image projection by the prompt_id in log
+        tgt_keys, tgt_rows, setting_filenames = [], [], []
+        ref_keys, ref_points = [], []
 
         for item in logs:
-            # key is the prompt_id in log
             prompt_id = item['prompt_id']
             setting_filename = item['setting_filename']
             output_filenames = item['output_filenames']
 
-            if setting_filename in output_data:
-                value = output_data[setting_filename]
-                tgt_data.append((prompt_id, value))
-                prompt_id_dict[prompt_id] = setting_filename
+            if setting_filename in rows:
+                tgt_keys.append(prompt_id)
+                tgt_rows.append(rows[setting_filename])
+                setting_filenames.append(setting_filename)
 
             for image_filename in output_filenames:
                 image_projection_filename = os.path.splitext(image_filename)[0] + '.json'
                 if image_projection_filename in image_projection:
-                    value = image_projection[image_projection_filename]
-                    ref_data.append((prompt_id, value))
+                    ref_keys.append(prompt_id)
+                    ref_points.append(image_projection[image_projection_filename])
 
         # align text projection with image projection
-        tgt_data = align(ref_data, tgt_data)
-        tgt_data = {prompt_id_dict[key]: value for key, value in tgt_data}
-
-        return tgt_data
+        aligned = align(ref_keys, np.array(ref_points), tgt_keys, points[tgt_rows])
+        return dict(zip(setting_filenames, aligned.tolist()))
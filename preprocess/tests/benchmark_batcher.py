@@ -0,0 +1,87 @@
+'''
+Benchmark batching concurrent CLIP encoding requests.
+
+Every client thread sends requests of a few images or prompts one after the
+other, like sessions generating images concurrently. Requests are encoded
+directly, each with its own forward pass, or through a MicroBatcher. The
+throughput and the mean latency of requests are reported for every number of
+clients, one client shows the latency of a single request.
+
+Run from the preprocess directory:
+    python tests/benchmark_batcher.py --clients 1 4 16 --kind image
+'''
+import os
+import sys
+import time
+import argparse
+import threading
+
+import numpy as np
+import torch
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from modules.image_encoding.batcher import MicroBatcher
+from modules.image_encoding.clip_encoding import ClipService, MODES
+from benchmark_clip import make_images, make_texts
+
+
+def load(clients, requests, encode):
+    '''Requests per second and mean latency of concurrent clients'''
+    latencies = []
+    lock = threading.Lock()
+
+    def client(inputs):
+        for request in inputs:
+            start = time.perf_counter()
+            encode(request)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(requests[i::clients],))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return len(requests) / elapsed, float(np.mean(latencies))
+
+
+def run(kind, mode, client_counts, num_requests, request_size, threads, max_wait, seed):
+    rng = np.random.default_rng(seed)
+    service = ClipService(mode=mode, device='cpu', threads=threads).warmup()
+    if kind == 'image':
+        inputs, encode = service.image_inputs, service.encode_images
+        requests = [make_images(rng, request_size, 512) for _ in range(num_requests)]
+    else:
+        inputs, encode = service.text_inputs, service.encode_texts
+        requests = [make_texts(rng, request_size) for _ in range(num_requests)]
+    batcher = MicroBatcher(encode, torch.cat, max_wait=max_wait)
+
+    print(f"{'clients':>7} {'direct (req/s)':>15} {'batched (req/s)':>16} "
+          f"{'direct (ms)':>12} {'batched (ms)':>13}")
+    for clients in client_counts:
+        direct, direct_latency = load(clients, requests, lambda x: encode(inputs(x)))
+        batched, batched_latency = load(clients, requests, lambda x: batcher(inputs(x)))
+        print(f'{clients:7d} {direct:15.1f} {batched:16.1f} '
+              f'{direct_latency * 1000:12.1f} {batched_latency * 1000:13.1f}')
+    print(batcher)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--kind', choices=['image', 'text'], default='image')
+    parser.add_argument('--mode', choices=MODES, default='eager')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--request-size', type=int, default=1, help='inputs per request')
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    parser.add_argument('--max-wait', type=float, default=0.005)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.kind, args.mode, args.clients, args.requests, args.request_size,
+        args.threads, args.max_wait, args.seed)
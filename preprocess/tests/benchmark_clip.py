@@ -0,0 +1,91 @@
+'''
+Benchmark CLIP embeddings of images and prompts on the CPU.
+
+Loads the model in every mode, warms it up and reports the load time, images
+per second, prompts per second, and the lowest cosine similarity of the
+embeddings to those of the eager mode. Modes whose dependencies are missing,
+e.g. onnxruntime, are skipped.
+
+Run from the preprocess directory:
+    python tests/benchmark_clip.py --modes eager quantized jit onnx --threads 4
+'''
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from modules.image_encoding.clip_encoding import ClipService, MODES
+
+WORDS = ['a', 'photo', 'of', 'cat', 'dog', 'city', 'at', 'night', 'painting',
+         'oil', 'watercolor', 'portrait', 'landscape', 'highly', 'detailed', 'sunset']
+
+
+def make_images(rng, count, size):
+    return [rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def make_texts(rng, count):
+    return [' '.join(rng.choice(WORDS, size=rng.integers(3, 30))) for _ in range(count)]
+
+
+def throughput(encode, inputs, repeat):
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vectors = encode(inputs)
+        elapsed.append(time.perf_counter() - start)
+    return vectors, len(inputs) / min(elapsed)
+
+
+def min_cosine(vectors, reference):
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    return float((vectors * reference).sum(axis=1).min())
+
+
+def run(modes, num_images, num_texts, image_size, threads, batch_size, repeat, seed):
+    rng = np.random.default_rng(seed)
+    images = make_images(rng, num_images, image_size)
+    texts = make_texts(rng, num_texts)
+
+    print(f"{'mode':>10} {'load (s)':>9} {'images/s':>9} {'texts/s':>9} "
+          f"{'image cos':>10} {'text cos':>9}")
+    reference = None
+    for mode in modes:
+        service = ClipService(mode=mode, device='cpu', threads=threads, batch_size=batch_size)
+        try:
+            service.warmup()
+        except ImportError as error:
+            print(f'{mode:>10} skipped: {error}')
+            continue
+
+        image_vectors, images_per_sec = throughput(service.image_embeddings, images, repeat)
+        text_vectors, texts_per_sec = throughput(service.text_embeddings, texts, repeat)
+        if reference is None:
+            reference = image_vectors, text_vectors
+        image_cos = min_cosine(image_vectors, reference[0])
+        text_cos = min_cosine(text_vectors, reference[1])
+        print(f'{mode:>10} {service.load_time:9.1f} {images_per_sec:9.1f} {texts_per_sec:9.1f} '
+              f'{image_cos:10.4f} {text_cos:9.4f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES),
+                        help='the first mode is the reference of the similarities')
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--texts', type=int, default=256)
+    parser.add_argument('--image-size', type=int, default=512)
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.modes, args.images, args.texts, args.image_size, args.threads,
+        args.batch_size, args.repeat, args.seed)
@@ -0,0 +1,85 @@
+'''
+Benchmark projecting a session generation by generation.
+
+Simulates a session whose generations add a few images around a set of
+topics, and projects it after every generation with a full t-SNE fit and
+with the incremental mode. Reports the mean time per generation, the number
+of full fits of the incremental mode, the trustworthiness of the final layouts
+and how far previous points move between generations after the procrustes
+alignment the image projection processor applies.
+
+Run from the preprocess directory:
+    python tests/benchmark_incremental_projection.py --start 100 --generations 25
+'''
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from sklearn.manifold import trustworthiness
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from utils.procrustes import align
+from utils.projection import tSNE, IncrementalTSNE
+
+
+def make_session(rng, points, topics, dim, spread):
+    centers = rng.normal(size=(topics, dim))
+    topic = rng.integers(0, topics, size=points)
+    return centers[topic] + rng.normal(size=(points, dim)) * spread
+
+
+def displacement(previous, points, filenames):
+    '''Mean distance moved by previous points, after aligning to the previous layout'''
+    aligned = align(list(previous), np.array(list(previous.values())), filenames, points)
+    return float(np.mean(np.linalg.norm(aligned[:len(previous)] - list(previous.values()), axis=1)))
+
+
+def run(start, generations, batch, topics, dim, spread, refit_ratio, seed):
+    rng = np.random.default_rng(seed)
+    total = start + generations * batch
+    vectors = make_session(rng, total, topics, dim, spread)
+    filenames = [f'{idx}.json' for idx in range(total)]
+    incremental = IncrementalTSNE(refit_ratio=refit_ratio)
+
+    results = {}
+    for name in ['full', 'incremental']:
+        elapsed = []
+        moved = []
+        previous = None
+        for size in range(start, total + 1, batch):
+            begin = time.perf_counter()
+            if name == 'full':
+                points = tSNE(vectors[:size])
+            else:
+                points = incremental.project('session', filenames[:size], vectors[:size])
+            elapsed.append(time.perf_counter() - begin)
+            if previous is not None:
+                moved.append(displacement(previous, points, filenames[:size]))
+            previous = dict(zip(filenames[:size], points.tolist()))
+        score = trustworthiness(vectors, points, n_neighbors=10, metric='cosine')
+        results[name] = (np.mean(elapsed[1:]), np.mean(moved), score)
+
+    print(f'{start} to {total} points, {generations} generations of {batch}, {incremental}')
+    print(f"{'mode':>12} {'ms/generation':>14} {'moved':>8} {'trustworthiness':>16}")
+    for name, (elapsed, moved, score) in results.items():
+        print(f'{name:>12} {elapsed * 1000:14.1f} {moved:8.3f} {score:16.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--start', type=int, default=100, help='points before the first generation')
+    parser.add_argument('--generations', type=int, default=25)
+    parser.add_argument('--batch', type=int, default=4, help='images per generation')
+    parser.add_argument('--topics', type=int, default=8)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--spread', type=float, default=1.5)
+    parser.add_argument('--refit-ratio', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.start, args.generations, args.batch, args.topics, args.dim, args.spread,
+        args.refit_ratio, args.seed)
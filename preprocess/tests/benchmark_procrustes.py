@@ -0,0 +1,89 @@
+'''
+Benchmark the procrustes alignment of projections.
+
+Compares align on key vectors and arrays with the previous alignment of lists
+of (key, point) pairs, which averaged points per key in dicts and transformed
+the target points one at a time. Keys repeat as prompt ids do when the image
+projection is aligned to the prompts that generated the images.
+
+Run from the preprocess directory:
+    python tests/benchmark_procrustes.py --points 1000 10000 100000
+'''
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from utils.procrustes import align, procrustes, procrustes_preprocess
+
+
+def align_pairs(data1, data2):
+    '''The previous alignment of lists of (key, point) pairs'''
+    def means(data):
+        unique = {}
+        for key, value in data:
+            unique.setdefault(key, []).append(value)
+        return {key: np.mean(value, axis=0) for key, value in unique.items()}
+
+    data1_unique, data2_unique = means(data1), means(data2)
+    common_keys = list(set(data1_unique) & set(data2_unique))
+    ref_points = [data1_unique[key] for key in common_keys]
+    tgt_points = [data2_unique[key] for key in common_keys]
+    _, t, norm = procrustes_preprocess(tgt_points)
+    _, _, _, R, s = procrustes(ref_points, tgt_points)
+
+    data2_aligned = []
+    for key, value in data2:
+        pt = np.array(value)
+        pt += t
+        pt /= norm
+        pt = np.dot(pt, R.T) * s
+        data2_aligned.append((key, pt.tolist()))
+    data2_array = np.array([value for _, value in data2_aligned])
+    min_vals = np.min(data2_array, axis=0)
+    max_vals = np.max(data2_array, axis=0)
+    normalized_data = (data2_array - min_vals) / (max_vals - min_vals)
+    return [(key, normalized_data[i].tolist()) for i, (key, _) in enumerate(data2_aligned)]
+
+
+def run(point_counts, repeats, seed):
+    rng = np.random.default_rng(seed)
+
+    print(f"{'points':>8} {'pairs (ms)':>11} {'arrays (ms)':>12} {'speedup':>8} {'max diff':>9}")
+    for num_points in point_counts:
+        num_keys = max(num_points // 4, 2)
+        ref_keys = [f'prompt{idx}' for idx in rng.integers(0, num_keys, size=num_points)]
+        tgt_keys = [f'prompt{idx}' for idx in rng.integers(0, num_keys, size=num_points)]
+        ref_points = rng.normal(size=(num_points, 2))
+        tgt_points = rng.normal(size=(num_points, 2))
+
+        # the previous processors built the pairs from the dicts of points
+        begin = time.perf_counter()
+        for _ in range(repeats):
+            pairs = align_pairs(list(zip(ref_keys, ref_points.tolist())),
+                                list(zip(tgt_keys, tgt_points.tolist())))
+        pairs_time = (time.perf_counter() - begin) / repeats
+
+        begin = time.perf_counter()
+        for _ in range(repeats):
+            aligned = align(ref_keys, ref_points, tgt_keys, tgt_points)
+        arrays_time = (time.perf_counter() - begin) / repeats
+
+        max_diff = np.abs(np.array([value for _, value in pairs]) - aligned).max()
+        print(f'{num_points:8d} {pairs_time * 1000:11.2f} {arrays_time * 1000:12.2f} '
+              f'{pairs_time / arrays_time:8.1f} {max_diff:9.1e}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.points, args.repeats, args.seed)
@@ -0,0 +1,114 @@
+'''
+Benchmark the projection engines over synthetic sessions.
+
+Sessions have 10 to 50k embeddings around topics, in a space of few
+intrinsic dimensions like CLIP embeddings. Every engine projects every session, and the wall time, the peak memory traced by tracemalloc (with
+--memory) and the neighborhood preservation are reported. Neighborhood
+preservation is the mean fraction of the k nearest neighbors of a point by
+cosine distance that are among its k nearest neighbors in the projection.
+warm_tsne projects a session whose layout of the first 90% of the points is
+known, as after a generation, and only the final fit is timed. Engines
+based on t-SNE are skipped above --tsne-limit points.
+
+Run from the preprocess directory:
+    python tests/benchmark_projection.py --points 10 100 1000 10000 50000
+'''
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from utils.projection import engines, project, normalize_rows
+
+TSNE_ENGINES = ('tsne', 'rp_tsne', 'warm_tsne')
+
+
+def make_session(rng, points, topics, dim, spread, intrinsic=8, noise=0.05):
+    '''Points around topics in a space of intrinsic dimensions, embedded in dim'''
+    centers = rng.normal(size=(topics, intrinsic)) * 3
+    topic = rng.integers(0, topics, size=points)
+    latent = centers[topic] + rng.normal(size=(points, intrinsic)) * spread
+    embedding = np.linalg.qr(rng.normal(size=(dim, intrinsic)))[0].T
+    return latent @ embedding + rng.normal(size=(points, dim)) * noise
+
+
+def nearest_neighbors(points, k):
+    nn = NearestNeighbors(n_neighbors=k + 1).fit(points)
+    return nn.kneighbors(points, return_distance=False)[:, 1:]
+
+
+def preservation(neighbors, points):
+    k = neighbors.shape[1]
+    projected = nearest_neighbors(points, k)
+    kept = [len(np.intersect1d(a, b, assume_unique=True)) for a, b in zip(neighbors, projected)]
+    return np.mean(kept) / k
+
+
+def projector(name, vectors):
+    '''A function projecting vectors with the engine, after any untimed preparation'''
+    filenames = [f'{idx}.json' for idx in range(len(vectors))]
+    config = {'projection': name, 'task': 'benchmark',
+              'metaInfo': {'userId': name, 'sessionId': len(vectors)}}
+    if engines[name].warm:
+        known = max(int(len(vectors) * 0.9), 3)
+        project(config, filenames[:known], vectors[:known])
+    return lambda: project(config, filenames, vectors)
+
+
+def peak_memory(name, vectors):
+    run = projector(name, vectors)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def run(point_counts, names, topics, dim, spread, neighbors, tsne_limit, memory, seed):
+    rng = np.random.default_rng(seed)
+
+    print(f"{'points':>8} {'engine':>10} {'time (s)':>9} {'memory (MB)':>12} {'preserved':>10}")
+    for num_points in point_counts:
+        vectors = make_session(rng, num_points, topics, dim, spread)
+        k = min(neighbors, num_points // 2)
+        high_neighbors = nearest_neighbors(normalize_rows(vectors, 'cosine'), k)
+
+        for name in names:
+            if name in TSNE_ENGINES and num_points > tsne_limit:
+                print(f'{num_points:8d} {name:>10} {"skipped":>9}')
+                continue
+            run_engine = projector(name, vectors)
+            start = time.perf_counter()
+            points = run_engine()
+            elapsed = time.perf_counter() - start
+
+            mem_str = f"{'-':>12}"
+            if memory:
+                mem_str = f'{peak_memory(name, vectors):12.1f}'
+            score = preservation(high_neighbors, points)
+            print(f'{num_points:8d} {name:>10} {elapsed:9.2f} {mem_str} {score:10.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+', default=[10, 100, 1000, 10000, 50000])
+    parser.add_argument('--engines', nargs='+', choices=list(engines), default=list(engines))
+    parser.add_argument('--topics', type=int, default=12)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--spread', type=float, default=1.0)
+    parser.add_argument('--neighbors', type=int, default=10, help='k of the neighborhoods')
+    parser.add_argument('--tsne-limit', type=int, default=10000,
+                        help='skip engines based on t-SNE above this many points')
+    parser.add_argument('--memory', action='store_true', help='also measure peak memory')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.points, args.engines, args.topics, args.dim, args.spread, args.neighbors,
+        args.tsne_limit, args.memory, args.seed)
@@ -0,0 +1,112 @@
+'''
+Benchmark the text embedding cache over simulated sessions.
+
+Sessions send the prompts of their generations to text encoding, drawn from
+a pool where a few prompts are popular, as users regenerate and share them.
+The encoder stands for CLIP: its vectors are derived from the prompt and it
+sleeps --encode-ms per prompt, see benchmark_clip.py for the rates of the
+model. Reports the time spent with and without the cache, the hit rate, the
+overhead of the cache per prompt, and the size and opening time of the file.
+
+Run from the preprocess directory:
+    python tests/benchmark_text_cache.py --sessions 200 --generations 20
+'''
+import os
+import sys
+import time
+import shutil
+import zlib
+import argparse
+import tempfile
+
+import numpy as np
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from utils.embedding_cache import TextEmbeddingCache
+
+MODEL_ID = "ViT-B/32/eager"
+
+
+def make_encoder(dim, encode_ms):
+    def encode(texts):
+        time.sleep(len(texts) * encode_ms / 1000)
+        return np.stack([np.random.default_rng(zlib.crc32(text.encode())).normal(size=dim)
+                         for text in texts]).astype(np.float32)
+    return encode
+
+
+def make_requests(rng, sessions, generations, pool, zipf):
+    '''The prompts of every session, a request per generation'''
+    prompts = [f'a painting of subject {idx} in style {idx % 17}' for idx in range(pool)]
+    weights = 1 / np.arange(1, pool + 1) ** zipf
+    weights /= weights.sum()
+    requests = []
+    for _ in range(sessions):
+        chosen = rng.choice(pool, size=generations, p=weights)
+        # a session sends the settings it has not processed yet, one per generation
+        requests.extend([[prompts[idx]] for idx in chosen])
+    return requests
+
+
+def run(sessions, generations, pool, zipf, dim, encode_ms, capacity, seed):
+    rng = np.random.default_rng(seed)
+    requests = make_requests(rng, sessions, generations, pool, zipf)
+    encode = make_encoder(dim, encode_ms)
+    root = tempfile.mkdtemp()
+    try:
+        begin = time.perf_counter()
+        direct = [encode(texts) for texts in requests]
+        direct_time = time.perf_counter() - begin
+
+        cache = TextEmbeddingCache(directory=root, capacity=capacity)
+        encoded = []
+
+        def counted(texts):
+            encoded.extend(texts)
+            return encode(texts)
+
+        begin = time.perf_counter()
+        cached = [cache.embeddings(MODEL_ID, texts, counted) for texts in requests]
+        cached_time = time.perf_counter() - begin
+        cache.close()
+
+        # the overhead of a hit, through the LRU and through the file
+        warm = TextEmbeddingCache(directory=root, capacity=capacity)
+        begin = time.perf_counter()
+        warm.embeddings(MODEL_ID, [texts[0] for texts in requests], encode)
+        open_time = time.perf_counter() - begin
+        begin = time.perf_counter()
+        for texts in requests:
+            warm.embeddings(MODEL_ID, texts, encode)
+        hit_us = (time.perf_counter() - begin) / len(requests) * 1e6
+        warm.close()
+
+        max_diff = max(np.abs(a - b).max() for a, b in zip(direct, cached))
+        size = sum(os.path.getsize(os.path.join(root, fn)) for fn in os.listdir(root))
+
+        print(f'{sessions} sessions of {generations} generations, {pool} prompts, '
+              f'{len(set(encoded))} encoded, {cache}')
+        print(f'without cache: {direct_time:8.2f}s')
+        print(f'   with cache: {cached_time:8.2f}s, hit rate {cache.hit_rate:.3f}')
+        print(f'cache: {hit_us:.1f}us per cached prompt, file {size / 2 ** 20:.2f}MB '
+              f'opened and read in {open_time * 1000:.1f}ms, max difference {max_diff:.1e}')
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--generations', type=int, default=20)
+    parser.add_argument('--pool', type=int, default=2000, help='distinct prompts')
+    parser.add_argument('--zipf', type=float, default=1.1, help='exponent of prompt popularity')
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--encode-ms', type=float, default=5.0, help='encoding time per prompt')
+    parser.add_argument('--capacity', type=int, default=10000, help='prompts kept in memory')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.sessions, args.generations, args.pool, args.zipf, args.dim, args.encode_ms,
+        args.capacity, args.seed)
@@ -0,0 +1,145 @@
+'''
+Hits, persistence and recovery of the text embedding cache.
+
+Run from the preprocess directory:
+    python -m pytest tests/test_embedding_cache.py
+'''
+import os
+import sys
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from utils.embedding_cache import TextEmbeddingCache, EmbeddingFile, prompt_key
+
+MODEL_ID = 'ViT-B/32/eager'
+DIM = 4
+
+
+class FakeEncoder:
+    '''Embeddings from the length of the prompts, recording the prompts encoded'''
+    def __init__(self):
+        self.encoded = []
+
+    def __call__(self, texts):
+        self.encoded.append(list(texts))
+        return np.array([[len(text), 1, 2, 3] for text in texts], dtype=np.float32)
+
+
+class TestTextEmbeddingCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.encode = FakeEncoder()
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.directory)
+
+    def cache(self, **kwargs):
+        cache = TextEmbeddingCache(directory=self.directory, **kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def bin_path(self):
+        return os.path.join(self.directory, 'ViT-B-32-eager.bin')
+
+    def test_hits_and_misses(self):
+        cache = self.cache()
+        vectors = cache.embeddings(MODEL_ID, ['a cat', 'a dog'], self.encode)
+        np.testing.assert_array_equal(vectors[:, 0], [5, 5])
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+        vectors = cache.embeddings(MODEL_ID, ['a dog', 'a bird', 'a cat'], self.encode)
+        np.testing.assert_array_equal(vectors[:, 0], [5, 6, 5])
+        self.assertEqual(self.encode.encoded, [['a cat', 'a dog'], ['a bird']])
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+        self.assertAlmostEqual(cache.hit_rate, 0.4)
+        self.assertEqual(cache.stats()['entries'], 3)
+
+    def test_duplicates_encoded_once(self):
+        cache = self.cache()
+        cache.embeddings(MODEL_ID, ['a cat', 'a cat', 'a cat'], self.encode)
+        self.assertEqual(self.encode.encoded, [['a cat']])
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_normalized_prompts_share_a_key(self):
+        self.assertEqual(prompt_key(MODEL_ID, ' a  cat\n'), prompt_key(MODEL_ID, 'a cat'))
+        self.assertEqual(prompt_key(MODEL_ID, 'cafe\u0301'), prompt_key(MODEL_ID, 'caf\u00e9'))
+        self.assertNotEqual(prompt_key(MODEL_ID, 'A cat'), prompt_key(MODEL_ID, 'a cat'))
+        self.assertNotEqual(prompt_key('ViT-B/32/onnx', 'a cat'), prompt_key(MODEL_ID, 'a cat'))
+
+        cache = self.cache()
+        cache.embeddings(MODEL_ID, ['a cat', ' a \t cat '], self.encode)
+        self.assertEqual(self.encode.encoded, [['a cat']])
+
+    def test_persistence(self):
+        first = self.cache()
+        first.embeddings(MODEL_ID, ['a cat', 'a bird'], self.encode)
+        first.close()
+
+        second = self.cache()
+        vectors = second.embeddings(MODEL_ID, ['a bird', 'a cat'], self.encode)
+        np.testing.assert_array_equal(vectors[:, 0], [6, 5])
+        self.assertEqual(len(self.encode.encoded), 1)
+        self.assertEqual((second.hits, second.misses), (2, 0))
+
+    def test_torn_tail_truncated(self):
+        cache = self.cache()
+        cache.embeddings(MODEL_ID, ['a cat', 'a dog'], self.encode)
+        cache.close()
+        record_size = os.path.getsize(self.bin_path()) // 2
+        with open(self.bin_path(), 'ab') as f:
+            f.write(b'\x01' * (record_size // 2))
+
+        cache = self.cache()
+        cache.embeddings(MODEL_ID, ['a cat', 'a dog', 'a bird'], self.encode)
+        self.assertEqual(self.encode.encoded[1:], [['a bird']])
+        self.assertEqual(os.path.getsize(self.bin_path()), 3 * record_size)
+        cache.close()
+
+        cache = self.cache()
+        vectors = cache.embeddings(MODEL_ID, ['a bird', 'a cat'], self.encode)
+        np.testing.assert_array_equal(vectors[:, 0], [6, 5])
+        self.assertEqual(len(self.encode.encoded), 2)
+
+    def test_rewritten_key_maps_to_last_record(self):
+        path = os.path.join(self.directory, 'model')
+        key = prompt_key(MODEL_ID, 'a cat')
+        file = EmbeddingFile(path, MODEL_ID, 'float16')
+        file.put([key], np.zeros((1, DIM)))
+        file.put([key], np.ones((1, DIM)))
+        file.close()
+
+        file = EmbeddingFile(path, MODEL_ID, 'float16')
+        self.assertEqual(len(file), 1)
+        np.testing.assert_array_equal(file.get(key), np.ones(DIM))
+        file.close()
+
+    def test_model_mismatch(self):
+        path = os.path.join(self.directory, 'model')
+        file = EmbeddingFile(path, MODEL_ID, 'float16')
+        file.put([prompt_key(MODEL_ID, 'a cat')], np.zeros((1, DIM)))
+        file.close()
+        with self.assertRaises(ValueError):
+            EmbeddingFile(path, 'ViT-B/32/onnx', 'float16')
+
+    def test_in_memory(self):
+        cache = self.cache()
+        cache.configure(directory='', capacity=2)
+        cache.embeddings(MODEL_ID, ['a cat', 'a dog'], self.encode)
+        cache.embeddings(MODEL_ID, ['a cat'], self.encode)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(len(self.encode.encoded), 1)
+
+        # a dog is the least recently used, a bird evicts it
+        cache.embeddings(MODEL_ID, ['a bird'], self.encode)
+        cache.embeddings(MODEL_ID, ['a dog'], self.encode)
+        self.assertEqual(self.encode.encoded[1:], [['a bird'], ['a dog']])
+        self.assertEqual(cache.stats()['entries'], 2)
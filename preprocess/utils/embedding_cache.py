@@ -0,0 +1,234 @@
+'''
+Cache of the text embeddings of prompts, shared by all sessions.
+
+Prompts are keyed by the hash of the model id and the prompt, normalized as
+the CLIP tokenizer cleans it up to case: NFC, whitespace runs collapsed and
+stripped. The tokenizer lowercases only after fixing the text with ftfy, so
+the case is kept and a cache hit always has the embedding the model gives.
+
+Every model has an append-only file of (key, embedding) records on disk, the
+keys are indexed in memory when the file is opened, and recently used
+embeddings are kept in an LRU in front of the files. Embeddings are stored
+as float16 by default, and returned as stored for new prompts too, so the
+output does not depend on whether a prompt was cached.
+'''
+import os
+import re
+import json
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_DIR = os.path.expanduser("~/.cache/clip/text_embeddings")
+CAPACITY = 10000
+KEY_SIZE = 16
+
+
+def normalize_prompt(text):
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def prompt_key(model_id, text):
+    '''Digest of the model id and the normalized prompt'''
+    data = f"{model_id}\0{normalize_prompt(text)}".encode("utf-8")
+    return hashlib.blake2b(data, digest_size=KEY_SIZE).digest()
+
+
+class EmbeddingFile:
+    '''Append-only file of the (key, embedding) records of one model'''
+    def __init__(self, path, model_id, dtype) -> None:
+        self.path = path + ".bin"
+        self.meta_path = path + ".meta.json"
+        self.model_id = model_id
+        self.dtype = np.dtype(dtype)
+        self.record = None
+        self.file = None
+        self.index = {}
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["model"] != model_id:
+                raise ValueError(f"{self.path} caches {meta['model']}, not {model_id}")
+            self._open(meta["dtype"], meta["dim"])
+
+    def __len__(self):
+        return len(self.index)
+
+    def _open(self, dtype, dim):
+        self.dtype = np.dtype(dtype)
+        self.record = np.dtype([("key", f"V{KEY_SIZE}"), ("vector", self.dtype, (dim,))])
+        if not os.path.exists(self.path):
+            open(self.path, "wb").close()
+
+        # drop a record torn by a crash while appending
+        rows, torn = divmod(os.path.getsize(self.path), self.record.itemsize)
+        if torn:
+            os.truncate(self.path, rows * self.record.itemsize)
+        if rows:
+            records = np.memmap(self.path, dtype=self.record, mode="r", shape=(rows,))
+            keys = np.ascontiguousarray(records["key"]).tobytes()
+            del records
+            # a key written again points to its last record
+            self.index = {keys[i * KEY_SIZE:(i + 1) * KEY_SIZE]: i for i in range(rows)}
+        self.file = open(self.path, "r+b")
+
+    def _create(self, dim):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_id, "dtype": self.dtype.name, "dim": dim}, f)
+        open(self.path, "wb").close()
+        self._open(self.dtype, dim)
+
+    def get(self, key):
+        row = self.index.get(key)
+        if row is None:
+            return None
+        self.file.seek(row * self.record.itemsize + KEY_SIZE)
+        return np.frombuffer(self.file.read(self.record.itemsize - KEY_SIZE), dtype=self.dtype)
+
+    def put(self, keys, vectors):
+        if self.record is None:
+            self._create(vectors.shape[1])
+        records = np.empty(len(keys), dtype=self.record)
+        records["key"] = np.frombuffer(b"".join(keys), dtype=f"V{KEY_SIZE}")
+        records["vector"] = vectors
+        rows = self.file.seek(0, os.SEEK_END) // self.record.itemsize
+        self.file.write(records.tobytes())
+        self.file.flush()
+        for idx, key in enumerate(keys):
+            self.index[key] = rows + idx
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class TextEmbeddingCache:
+    '''Embeddings of prompts by model, in an LRU in front of files on disk'''
+    def __init__(self, directory=CACHE_DIR, capacity=CAPACITY, dtype="float16") -> None:
+        self.directory = directory
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.lock = threading.Lock()
+        self.lru = OrderedDict()
+        self.files = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self) -> str:
+        return (
+            f"TextEmbeddingCache("
+            f"directory={self.directory}, "
+            f"capacity={self.capacity}, "
+            f"hits={self.hits}, "
+            f"misses={self.misses}, "
+            f"hit_rate={self.hit_rate:.3f}"
+            f")"
+        )
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "entries": sum(len(file) for file in self.files.values()) if self.files
+                           else len(self.lru),
+            }
+
+    def configure(self, directory=None, capacity=None):
+        '''Change the options, before the cache is used; an empty directory keeps it in memory'''
+        with self.lock:
+            if self.files:
+                raise RuntimeError("The text embedding cache is already in use")
+            if directory is not None:
+                self.directory = directory or None
+            if capacity is not None:
+                self.capacity = capacity
+
+    def embeddings(self, model_id, texts, encode):
+        '''
+        Embeddings of texts, encoding only the prompts not cached
+
+        Args:
+            model_id (str): the model and the options changing its embeddings
+            texts (list): prompts
+            encode (callable): embeddings of a list of prompts, as a matrix
+        '''
+        keys = [prompt_key(model_id, text) for text in texts]
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key not in found:
+                    vector = self._get(model_id, key)
+                    if vector is not None:
+                        found[key] = vector
+
+        # encode every new prompt once, in the order of the request
+        missing = OrderedDict()
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = np.asarray(encode(list(missing.values())), dtype=self.dtype)
+            with self.lock:
+                self._put(model_id, list(missing), vectors)
+            found.update(zip(missing, vectors))
+
+        # a hit is a prompt the model did not encode
+        with self.lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return np.stack([found[key] for key in keys]).astype(np.float32)
+
+    def _file(self, model_id):
+        if self.directory is None:
+            return None
+        if model_id not in self.files:
+            name = re.sub(r"[^\w.-]", "-", model_id)
+            self.files[model_id] = EmbeddingFile(
+                os.path.join(self.directory, name), model_id, self.dtype)
+        return self.files[model_id]
+
+    def _get(self, model_id, key):
+        vector = self.lru.get(key)
+        if vector is not None:
+            self.lru.move_to_end(key)
+            return vector
+        file = self._file(model_id)
+        vector = file.get(key) if file is not None else None
+        if vector is not None:
+            self._remember(key, vector)
+        return vector
+
+    def _put(self, model_id, keys, vectors):
+        file = self._file(model_id)
+        if file is not None:
+            file.put(keys, vectors)
+        for key, vector in zip(keys, vectors):
+            self._remember(key, vector)
+
+    def _remember(self, key, vector):
+        self.lru[key] = vector
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.capacity:
+            self.lru.popitem(last=False)
+
+    def close(self):
+        with self.lock:
+            for file in self.files.values():
+                file.close()
+            self.files = {}
+
+
+text_embedding_cache = TextEmbeddingCache()
@@ -0,0 +1,26 @@
+'''Embeddings packed as one matrix, as exchanged with the diffusion app'''
+import base64
+import numpy as np
+
+PACKED_FORMAT = 'embeddings'
+
+
+def pack_embeddings(filenames, matrix, dtype='float32'):
+    '''Filenames and the base64 of the bytes of the matrix of their embeddings'''
+    matrix = np.ascontiguousarray(matrix, dtype=dtype)
+    return {
+        'format': PACKED_FORMAT,
+        'filenames': list(filenames),
+        'dtype': matrix.dtype.name,
+        'shape': list(matrix.shape),
+        'data': base64.b64encode(memoryview(matrix).cast('B')).decode(),
+    }
+
+
+def unpack_embeddings(data):
+    '''Filenames and matrix of embeddings, packed or as a list of {filename, data}'''
+    if isinstance(data, dict) and data.get('format') == PACKED_FORMAT:
+        matrix = np.frombuffer(base64.b64decode(data['data']), dtype=data['dtype'])
+        return data['filenames'], matrix.reshape(data['shape'])
+    filenames = [item['filename'] for item in data]
+    return filenames, np.array([item['data'] for item in data])
@@ -0,0 +1,108 @@
+'''
+Layout of the k-nearest-neighbor graph of points, in the style of UMAP.
+
+Every point gets fuzzy memberships to its nearest neighbors, scaled so the
+memberships of a point sum to log2(k), and the memberships of both directions
+are united. The 2d layout starts from PCA and moves the ends of every edge
+towards each other, with a probability proportional to its membership, and
+away from a few random points per edge, with the low dimensional similarity
+1 / (1 + a d^2b) of UMAP. Updates of an epoch are applied at once, so the
+cost per epoch is linear in the number of edges.
+'''
+import numpy as np
+from scipy.sparse import coo_matrix
+from sklearn.decomposition import PCA
+from sklearn.neighbors import NearestNeighbors
+
+# the curve 1 / (1 + a d^2b) fit to min_dist=0.1 and spread=1, as UMAP does by default
+A = 1.576943460405378
+B = 0.8950608781227859
+MAX_DIMENSIONS = 50
+
+
+def fuzzy_memberships(distances, steps=64):
+    '''Memberships exp(-(d - rho) / sigma) of the neighbors of every point, sum log2(k)'''
+    k = distances.shape[1]
+    target = np.log2(k)
+    rho = distances[:, 0]
+    excess = np.maximum(distances - rho[:, None], 0)
+    lower = np.zeros(len(distances))
+    upper = np.full(len(distances), np.inf)
+    sigma = np.ones(len(distances))
+    for _ in range(steps):
+        total = np.exp(-excess / sigma[:, None]).sum(axis=1)
+        too_large = total > target
+        upper = np.where(too_large, sigma, upper)
+        lower = np.where(too_large, lower, sigma)
+        sigma = np.where(np.isinf(upper), sigma * 2, (lower + upper) / 2)
+    return np.exp(-excess / sigma[:, None])
+
+
+def knn_graph(vectors, n_neighbors):
+    '''Edges (heads, tails) and memberships of the united fuzzy kNN graph'''
+    n = len(vectors)
+    k = min(n_neighbors, n - 1)
+    nn = NearestNeighbors(n_neighbors=k + 1).fit(vectors)
+    distances, neighbors = nn.kneighbors(vectors)
+    distances, neighbors = distances[:, 1:], neighbors[:, 1:] # without the point itself
+
+    memberships = fuzzy_memberships(distances)
+    graph = coo_matrix((memberships.ravel(), (np.repeat(np.arange(n), k), neighbors.ravel())),
+                       shape=(n, n)).tocsr()
+    transpose = graph.T.tocsr()
+    graph = (graph + transpose - graph.multiply(transpose)).tocoo()
+    return graph.row, graph.col, graph.data
+
+
+def clipped(gradient):
+    return np.clip(gradient, -4, 4)
+
+
+def graph_layout(vectors, n_neighbors=15, n_epochs=None, negative_samples=5, seed=0):
+    '''
+    2d layout of the kNN graph of vectors
+
+    Args:
+        vectors (np.ndarray): points, reduced to MAX_DIMENSIONS by PCA if larger
+        n_epochs (int): 200 up to 10k points and 100 above by default
+    '''
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    if vectors.shape[1] > MAX_DIMENSIONS and n > MAX_DIMENSIONS:
+        vectors = PCA(n_components=MAX_DIMENSIONS, random_state=seed).fit_transform(vectors)
+    if n_epochs is None:
+        n_epochs = 200 if n <= 10000 else 100
+
+    heads, tails, weights = knn_graph(vectors, n_neighbors)
+    probability = weights / weights.max()
+
+    layout = PCA(n_components=2, random_state=seed).fit_transform(vectors)
+    layout = 10 * layout / np.abs(layout).max() + rng.normal(scale=1e-4, size=layout.shape)
+
+    for epoch in range(n_epochs):
+        learning_rate = 1 - epoch / n_epochs
+        sampled = rng.random(len(heads)) < probability
+        head, tail = heads[sampled], tails[sampled]
+
+        # attraction along edges, both ends move
+        diff = layout[head] - layout[tail]
+        dist2 = np.maximum((diff ** 2).sum(axis=1), 1e-12)
+        coeff = -2 * A * B * dist2 ** (B - 1) / (1 + A * dist2 ** B)
+        move = learning_rate * clipped(coeff[:, None] * diff)
+
+        # repulsion from random points, only the head moves
+        others = rng.integers(0, n, size=(negative_samples, len(head)))
+        repel = np.zeros_like(move)
+        for other in others:
+            diff = layout[head] - layout[other]
+            dist2 = (diff ** 2).sum(axis=1)
+            coeff = np.where(other != head, 2 * B / ((0.001 + dist2) * (1 + A * dist2 ** B)), 0)
+            repel += learning_rate * clipped(coeff[:, None] * diff)
+
+        step = np.zeros_like(layout)
+        for axis in range(2):
+            step[:, axis] += np.bincount(head, move[:, axis] + repel[:, axis], minlength=n)
+            step[:, axis] -= np.bincount(tail, move[:, axis], minlength=n)
+        layout += step
+
+    return layout
@@ -3,78 +3,63 @@ import numpy as np
 from scipy.linalg import orthogonal_procrustes
 
 
-def align(data1, data2):
+def align(ref_keys, ref_points, tgt_keys, tgt_points):
     '''Align two point sets using procrustes analysis
-    
-    Each point is represented as a (key, value) pair.
+
+    Each point set is a vector of keys and an array of points, one row per key.
     Points with the same key between the two sets are aligned.
-    
+
     key is not necessary unique for each point set.
     If several points have the same key, they will be averaged.
-    '''
 
-    # get unique key-point dict for each point set
-    data1_unique = list2dict(data1)
-    data2_unique = list2dict(data2)
-
-    # get common keys
-    data1_keys = set(data1_unique.keys())
-    data2_keys = set(data2_unique.keys())
-    common_keys = list(data1_keys & data2_keys)
+    Returns the target points aligned and scaled to [0, 1], in their order,
+    or unchanged if they can not be aligned.
+    '''
+    ref_points = np.asarray(ref_points, dtype=np.double)
+    tgt_points = np.asarray(tgt_points, dtype=np.double)
+    if len(ref_points) <= 1 or len(tgt_points) <= 1:
+        return tgt_points
 
-    # get reference points and target points
-    ref_points = [data1_unique[key] for key in common_keys]
-    tgt_points = [data2_unique[key] for key in common_keys]
+    # get the mean point of every key for each point set
+    ref_unique, ref_means = group_means(ref_keys, ref_points)
+    tgt_unique, tgt_means = group_means(tgt_keys, tgt_points)
 
-    if len(ref_points) <= 1 or len(tgt_points) <= 1:
-        return data2
+    # get reference points and target points of the common keys
+    _, ref_idx, tgt_idx = np.intersect1d(ref_unique, tgt_unique,
+                                         assume_unique=True, return_indices=True)
+    if len(ref_idx) <= 1:
+        return tgt_points
+    ref_common = ref_means[ref_idx]
+    tgt_common = tgt_means[tgt_idx]
 
     # procrustes analysis
-    _, t, norm = procrustes_preprocess(tgt_points)
+    _, t, norm = procrustes_preprocess(tgt_common)
 
     try:
-        _, _, _, R, s = procrustes(ref_points, tgt_points)
+        _, _, _, R, s = procrustes(ref_common, tgt_common)
     except ValueError:
-        return data2
+        return tgt_points
 
     # transform target points
-    data2_aligned = []
-    for key, value in data2:
-        pt = np.array(value)
-        pt += t
-        pt /= norm
-        pt = np.dot(pt, R.T) * s
-        data2_aligned.append((key, pt.tolist()))
+    aligned = (tgt_points + t) @ (R.T * (s / norm))
 
     # normalize aligned points
-    data2_array = np.array([value for _, value in data2_aligned])
-    min_vals = np.min(data2_array, axis=0)
-    max_vals = np.max(data2_array, axis=0)
-    normalized_data = (data2_array - min_vals) / (max_vals - min_vals)
+    aligned -= aligned.min(axis=0)
+    aligned /= aligned.max(axis=0)
 
-    # add key back to the list
-    for i, (key, _) in enumerate(data2_aligned):
-        data2_aligned[i] = (key, normalized_data[i].tolist())
+    return aligned
 
-    return data2_aligned
 
+def group_means(keys, points):
+    '''Merge points with the same key
 
-def list2dict(data):
-    '''Merge points with the same key for each point set
-    
-    This results in a list of points with unique keys
+    Returns the sorted unique keys and the mean point of every key
     '''
-    data_unique = {}
-    for key, value in data:
-        if key not in data_unique:
-            data_unique[key] = []
-        data_unique[key].append(value)
-
-    # average points with the same key
-    for key, value in data_unique.items():
-        data_unique[key] = np.mean(value, axis=0)
-
-    return data_unique
+    unique, inverse = np.unique(np.asarray(keys), return_inverse=True)
+    sums = np.zeros((len(unique), points.shape[1]))
+    np.add.at(sums, inverse, points)
+    counts = np.bincount(inverse, minlength=len(unique))
+    return unique, sums / counts[:, None]
 
 
 def procrustes_preprocess(data):
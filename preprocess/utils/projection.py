@@ -1,29 +1,373 @@
-'''Projection functions'''
+'''Projection functions
+
+Projections are made by engines registered by name, selected with
+'projection' in the extension configuration:
+- tsne: t-SNE of the vectors, the default
+- pca: the first two principal components, for a quick overview
+- rp_tsne: t-SNE of a random projection of the vectors to RP_DIMENSIONS
+- knn_graph: the layout of the kNN graph in the style of UMAP, see graph_layout
+- warm_tsne: t-SNE starting from the previous layout of the session
+
+The incremental mode keeps the t-SNE layout of a session and places only the
+new points of every generation, against the fixed layout of the previous
+points. A new point gets affinities to its nearest neighbors among all points,
+calibrated to the perplexity like t-SNE, and minimizes its own KL divergence
+with the Student-t similarities to all points. Each step costs the number of
+new points times the number of points. The layout is refit from scratch when
+the session grew by refit_ratio since the last fit, or when points changed.
+'''
+import threading
+from collections import OrderedDict
+
 import numpy as np
+from sklearn.decomposition import PCA
 from sklearn.manifold import MDS, TSNE
+from sklearn.metrics import pairwise_distances
 from sklearn.preprocessing import MinMaxScaler
+from sklearn.random_projection import GaussianRandomProjection
+
+from .graph_layout import graph_layout
+
+MAX_SESSIONS = 64
+REFIT_RATIO = 0.5
+RP_DIMENSIONS = 50
+WARM_ITERATIONS = 500
+
+# n_iter of TSNE is named max_iter since scikit-learn 1.5
+ITERATIONS = 'max_iter' if 'max_iter' in TSNE().get_params() else 'n_iter'
+
+engines = {}
+
+
+class ProjectionEngine:
+    '''
+    A layout function of vectors, called with at least three distinct vectors
 
-scaler = MinMaxScaler(feature_range=(0, 1))
+    Layouts of incremental engines have the scale of t-SNE, so new points can
+    be placed in them, and warm engines start from the init layout if given.
+    '''
+    def __init__(self, name, layout, incremental=False, warm=False) -> None:
+        self.name = name
+        self.layout = layout
+        self.incremental = incremental
+        self.warm = warm
+
+    def __str__(self) -> str:
+        return (
+            f"ProjectionEngine("
+            f"name={self.name}, "
+            f"incremental={self.incremental}, "
+            f"warm={self.warm}"
+            f")"
+        )
+
+
+def register_engine(name, incremental=False, warm=False):
+    def decorator(layout):
+        engines[name] = ProjectionEngine(name, layout, incremental, warm)
+        return layout
+    return decorator
+
+
+def normalize(X):
+    '''Scale every axis to [0, 1]'''
+    return MinMaxScaler(feature_range=(0, 1)).fit_transform(X)
+
+
+def normalize_rows(vectors, metric):
+    '''Unit rows for the cosine metric, so euclidean distances order them alike'''
+    if metric != 'cosine':
+        return vectors
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
 
 
 def tSNE(vectors, perplexity=5, metric='cosine'):
     '''tSNE'''
+    X = fixed_layout(vectors)
+    if X is not None:
+        return X
+    return normalize(tsne_layout(vectors, perplexity, metric))
+
+
+def fixed_layout(vectors):
+    '''Layout of at most two points or of identical points, None otherwise'''
     if vectors.shape[0] == 1:
         return np.array([[0.5, 0.5]])
     elif vectors.shape[0] == 2:
         return np.array([[0.3, 0.5], [0.7, 0.5]])
 
-    # perplexity must be less than the number of samples
-    perplexity = min(perplexity, vectors.shape[0] - 1)
-
     # check if all the vectors are the same
     if np.all(vectors == vectors[0]):
         X = np.full((vectors.shape[0], 2), 0.5)
         return X
+    return None
+
+
+@register_engine('tsne', incremental=True)
+def tsne_layout(vectors, perplexity=5, metric='cosine', init=None):
+    '''The t-SNE embedding before scaling'''
+    # perplexity must be less than the number of samples
+    perplexity = min(perplexity, vectors.shape[0] - 1)
 
     tsne = TSNE(n_components=2, perplexity=perplexity, metric=metric)
     tsne.fit_transform(vectors)
-    X = tsne.embedding_
-    X_norm = scaler.fit_transform(X)
+    return tsne.embedding_
+
+
+@register_engine('pca')
+def pca_layout(vectors, perplexity=5, metric='cosine', init=None):
+    return PCA(n_components=2).fit_transform(normalize_rows(vectors, metric))
+
+
+@register_engine('rp_tsne', incremental=True)
+def rp_tsne_layout(vectors, perplexity=5, metric='cosine', init=None):
+    '''t-SNE of a gaussian random projection of the vectors'''
+    vectors = normalize_rows(vectors, metric)
+    if vectors.shape[1] > RP_DIMENSIONS:
+        projection = GaussianRandomProjection(n_components=RP_DIMENSIONS, random_state=0)
+        vectors = projection.fit_transform(vectors)
+    perplexity = min(perplexity, vectors.shape[0] - 1)
+    tsne = TSNE(n_components=2, perplexity=perplexity, metric='euclidean', init='pca')
+    return tsne.fit_transform(vectors)
+
+
+@register_engine('knn_graph')
+def knn_graph_layout(vectors, perplexity=5, metric='cosine', init=None):
+    return graph_layout(normalize_rows(vectors, metric))
+
+
+@register_engine('warm_tsne', incremental=True, warm=True)
+def warm_tsne_layout(vectors, perplexity=5, metric='cosine', init=None):
+    '''
+    t-SNE starting from init, without early exaggeration as init is a layout
+    already, and with WARM_ITERATIONS iterations
+    '''
+    if init is None:
+        return tsne_layout(vectors, perplexity, metric)
+    perplexity = min(perplexity, vectors.shape[0] - 1)
+    # the learning rate 'auto' picks without exaggeration would scatter init
+    learning_rate = max(vectors.shape[0] / 12 / 4, 50)
+    tsne = TSNE(n_components=2, perplexity=perplexity, metric=metric, init=init,
+                early_exaggeration=1, learning_rate=learning_rate,
+                **{ITERATIONS: WARM_ITERATIONS})
+    return tsne.fit_transform(vectors)
+
+
+def conditional_affinities(distances, perplexity, steps=64):
+    '''
+    Rows of p_j|i over the given distances with the entropy of the perplexity,
+    by bisection of the precision of every row at once, like t-SNE
+    '''
+    distances = distances - distances.min(axis=1, keepdims=True)
+    target = np.log(perplexity)
+    lower = np.zeros(len(distances))
+    upper = np.full(len(distances), np.inf)
+    beta = np.ones(len(distances))
+    for _ in range(steps):
+        P = np.exp(-distances * beta[:, None])
+        sum_P = P.sum(axis=1)
+        entropy = np.log(sum_P) + beta * (distances * P).sum(axis=1) / sum_P
+        too_flat = entropy > target
+        lower = np.where(too_flat, beta, lower)
+        upper = np.where(too_flat, upper, beta)
+        beta = np.where(np.isinf(upper), beta * 2, (lower + upper) / 2)
+    return P / P.sum(axis=1, keepdims=True)
+
+
+def place_points(vectors, layout, perplexity=5, metric='cosine', n_iter=300,
+                 learning_rate=1.0, seed=0):
+    '''
+    Positions of the points after the first len(layout) ones, against the
+    fixed positions of those in layout
+
+    Args:
+        vectors (np.ndarray): the vectors of all points, previous ones first
+        layout (np.ndarray): the t-SNE positions of the previous points
+    '''
+    num_fixed = len(layout)
+    num_points = len(vectors)
+    new = np.arange(num_fixed, num_points)
+
+    # affinities of new points to their nearest neighbors among all points
+    distances = pairwise_distances(vectors[new], vectors, metric=metric)
+    distances[np.arange(len(new)), new] = np.inf
+    k = min(num_points - 1, int(3 * perplexity + 1))
+    neighbors = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    P = conditional_affinities(
+        np.take_along_axis(distances, neighbors, axis=1),
+        min(perplexity, k - 1) if k > 1 else 1)
+
+    # start at the mean of the previous neighbors weighted by affinities, or
+    # at the nearest previous point if no neighbor is a previous one
+    weights = P * (neighbors < num_fixed)
+    nearest = np.argmin(distances[:, :num_fixed], axis=1)
+    start = layout[nearest]
+    has_fixed = weights.sum(axis=1) > 0
+    fixed_neighbors = np.minimum(neighbors[has_fixed], num_fixed - 1)
+    start[has_fixed] = (weights[has_fixed, :, None] * layout[fixed_neighbors]).sum(axis=1) \
+        / weights[has_fixed].sum(axis=1, keepdims=True)
+    rng = np.random.default_rng(seed)
+    positions = np.concatenate([layout, start + rng.normal(scale=1e-4, size=start.shape)])
+
+    # gradient descent with momentum and gains, like t-SNE, the gradient of
+    # the KL divergence of point i is 2 sum_j (p_ij - q_ij) w_ij (y_i - y_j)
+    # with w_ij = 1 / (1 + |y_i - y_j|^2) and q_ij = w_ij / sum_j w_ij
+    update = np.zeros((len(new), 2))
+    gains = np.ones((len(new), 2))
+    rows = np.arange(len(new))
+    sq_norms = (positions ** 2).sum(axis=1)
+    for it in range(n_iter):
+        Y = positions[new]
+        sq_norms[new] = (Y ** 2).sum(axis=1)
+        W = 1 / (1 + np.maximum(sq_norms[new, None] + sq_norms[None, :] - 2 * Y @ positions.T, 0))
+        W[rows, new] = 0
+        W2 = W * W
+        repulsion = (Y * W2.sum(axis=1)[:, None] - W2 @ positions) / W.sum(axis=1)[:, None]
+
+        diff = Y[:, None, :] - positions[neighbors]
+        PW = P / (1 + (diff ** 2).sum(axis=2))
+        attraction = (PW[:, :, None] * diff).sum(axis=1)
+        grad = 2 * (attraction - repulsion)
+
+        momentum = 0.5 if it < 100 else 0.8
+        inc = update * grad < 0
+        gains = np.maximum(np.where(inc, gains + 0.2, gains * 0.8), 0.01)
+        update = momentum * update - learning_rate * gains * grad
+        positions[new] = Y + update
+
+    return positions[new]
+
+
+class ProjectionState:
+    '''The layout of the points of a session'''
+    def __init__(self, filenames, layout, engine) -> None:
+        self.filenames = list(filenames)
+        self.layout = layout
+        self.engine = engine
+        self.fitted_size = len(filenames) # number of points of the last full fit
+
+    def __str__(self) -> str:
+        return (
+            f"ProjectionState("
+            f"points={len(self.filenames)}, "
+            f"engine={self.engine}, "
+            f"fitted_size={self.fitted_size}"
+            f")"
+        )
+
+
+class IncrementalTSNE:
+    '''t-SNE layouts of recent sessions, extended by the points of new generations'''
+    def __init__(self, perplexity=5, metric='cosine', refit_ratio=REFIT_RATIO,
+                 max_sessions=MAX_SESSIONS) -> None:
+        self.perplexity = perplexity
+        self.metric = metric
+        self.refit_ratio = refit_ratio
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.full_fits = 0
+        self.placements = 0
+
+    def __str__(self) -> str:
+        return (
+            f"IncrementalTSNE("
+            f"sessions={len(self.sessions)}, "
+            f"full_fits={self.full_fits}, "
+            f"placements={self.placements}"
+            f")"
+        )
+
+    def extends(self, state, filenames, engine):
+        '''Whether filenames contain all points of state, laid out by engine'''
+        return state is not None and state.engine == engine and set(state.filenames) <= set(filenames)
+
+    def needs_refit(self, state, filenames, engine):
+        if not self.extends(state, filenames, engine):
+            return True # no layout, or points changed
+        return len(filenames) > state.fitted_size * (1 + self.refit_ratio)
+
+    def place(self, state, filenames, vectors):
+        '''Filenames and vectors with previous points first, and the positions of the new ones'''
+        position = {filename: idx for idx, filename in enumerate(filenames)}
+        previous = set(state.filenames)
+        order = [position[filename] for filename in state.filenames]
+        order += [idx for idx, filename in enumerate(filenames) if filename not in previous]
+        vectors = vectors[order]
+        placed = place_points(vectors, state.layout, self.perplexity, self.metric)
+        return [filenames[idx] for idx in order], vectors, placed
+
+    def project(self, session_key, filenames, vectors, engine='tsne', refit=False):
+        '''
+        Points of vectors scaled to [0, 1], previous points keep their layout
+
+        Args:
+            engine (str): an incremental engine, which makes full fits
+            refit (bool): fit every time, warm engines start from the
+                previous layout with the new points placed
+        '''
+        filenames = requested = list(filenames)
+        with self.lock:
+            state = self.sessions.get(session_key)
+            if state is not None:
+                self.sessions.move_to_end(session_key)
+
+        layout = engines[engine].layout
+        if self.extends(state, filenames, engine) and len(filenames) == len(state.filenames):
+            pass # nothing new to place
+        elif refit or self.needs_refit(state, filenames, engine):
+            if engines[engine].warm and self.extends(state, filenames, engine):
+                filenames, vectors, placed = self.place(state, filenames, vectors)
+                init = np.concatenate([state.layout, placed])
+                points = layout(vectors, self.perplexity, self.metric, init=init)
+            else:
+                points = layout(vectors, self.perplexity, self.metric)
+            state = ProjectionState(filenames, points, engine)
+            self.full_fits += 1
+        else:
+            fitted_size = state.fitted_size
+            filenames, vectors, placed = self.place(state, filenames, vectors)
+            state = ProjectionState(filenames, np.concatenate([state.layout, placed]), engine)
+            state.fitted_size = fitted_size
+            self.placements += 1
+
+        with self.lock:
+            self.sessions[session_key] = state
+            self.sessions.move_to_end(session_key)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+        position = {filename: idx for idx, filename in enumerate(state.filenames)}
+        return normalize(state.layout)[[position[filename] for filename in requested]]
+
+
+incremental_tsne = IncrementalTSNE()
+
+
+def project(config, filenames, vectors):
+    '''
+    Project vectors as configured by the extension
+
+    'projection' names the engine, t-SNE by default. With
+    'projection_mode: incremental', the layout of the session of
+    config['metaInfo'] is kept and extended, see IncrementalTSNE, if the
+    engine is incremental. Warm engines start from the layout of the session.
+    '''
+    config = config or {}
+    name = config.get('projection', 'tsne')
+    if name not in engines:
+        raise ValueError(f"Unknown projection {name}, available projections = {list(engines)}")
+    engine = engines[name]
+
+    points = fixed_layout(vectors)
+    if points is not None:
+        return points
 
-    return X_norm
+    meta_info = config.get('metaInfo')
+    incremental = config.get('projection_mode') == 'incremental'
+    if meta_info and engine.incremental and (incremental or engine.warm):
+        session_key = (meta_info.get('userId'), meta_info.get('sessionId'), config.get('task'))
+        return incremental_tsne.project(session_key, filenames, vectors, name,
+                                        refit=not incremental)
+    return normalize(engine.layout(vectors))
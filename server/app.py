@@ -1,8 +1,9 @@
 import os
 import copy
 import json
+import asyncio
 import logging
-import requests
+from urllib.parse import urlencode
 import tornado.httpserver
 import tornado.ioloop
 import tornado.options
@@ -10,10 +11,13 @@ import tornado.web
 import tornado.websocket
 
 from tornado.options import define, options
+from tornado.httpclient import HTTPClientError
 
-from modules.text_comparison.compare import compare
-from modules.cluster.cluster import image_cluster
-from modules.edge_derivation.derive import derive
+from modules.text_comparison.compare import compare, comparison_cache
+from modules.text_comparison.incremental import tokenize_sessions
+from modules.cluster.cluster import METHODS as CLUSTER_METHODS, image_cluster
+from modules.edge_derivation.derive import derive, derive_clusters
+from utils import upstream
 
 app_logger = logging.getLogger(__name__)
 
@@ -33,6 +37,8 @@ def get_url_head(is_public=True):
 
 # define base handler
 class BaseHandler(tornado.web.RequestHandler):
+    upstream_task = None
+
     def set_default_headers(self):
         self.set_header("Access-Control-Allow-Origin", "*")
 
@@ -47,6 +53,58 @@ class BaseHandler(tornado.web.RequestHandler):
             return None
         raise tornado.web.HTTPError(400, f"Missing argument: {arg}")
 
+    async def post_upstream(self, route, payload):
+        '''Forward a request to the diffusion app without blocking the IOLoop'''
+        is_public = self.get_argument('isPublic', required=False)
+        return await self.run_upstream(route,
+            upstream.post(get_url_head(is_public), route, payload))
+
+    async def run_upstream(self, route, coroutine):
+        self.upstream_task = asyncio.ensure_future(coroutine)
+        try:
+            return await self.upstream_task
+        except asyncio.CancelledError:
+            # the browser has gone away, nothing left to respond to
+            raise tornado.web.Finish()
+        except HTTPClientError as e:
+            if e.code == 599:
+                status = 504
+            elif 400 <= e.code < 500:
+                status = e.code
+            else:
+                status = 502
+            raise tornado.web.HTTPError(status, f"Upstream {route} failed: {e}")
+        except (ConnectionError, OSError) as e:
+            raise tornado.web.HTTPError(502, f"Upstream {route} failed: {e}")
+
+    def on_connection_close(self):
+        # aborts the upstream request, see upstream.fetch
+        if self.upstream_task is not None:
+            self.upstream_task.cancel()
+
+    def get_session_key(self):
+        '''Key of the session a computation belongs to, None if not given'''
+        user_id = self.get_argument('userId', required=False)
+        thread_id = self.get_argument('sessionId', required=False)
+        if user_id is None or thread_id is None:
+            return None
+        key = f'{user_id}-{thread_id}'
+        if os.path.basename(key) != key or key.startswith('.'):
+            raise tornado.web.HTTPError(400, "Invalid argument: sessionId")
+        return key
+
+def image_reference(user_id, thread_id, filename, is_public, preview=True):
+    '''Path of an image on /fetch/image, sent to the client instead of image data'''
+    params = {
+        'userId': user_id,
+        'sessionId': thread_id,
+        'filename': filename,
+        'preview': int(preview),
+    }
+    if is_public:
+        params['isPublic'] = 1
+    return f'/fetch/image?{urlencode(params)}'
+
 # test handler
 class HelloWorld(BaseHandler):
     """Hello World"""
@@ -57,33 +115,30 @@ class HelloWorld(BaseHandler):
 
 # log in
 class LogInHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         username = self.get_argument('username')
-        is_public = self.get_argument('isPublic', required=False)
         payload = { 'username': username }
-        url = f'{get_url_head(is_public)}/login'
-        data = requests.post(url, json=payload, timeout=10).json()
+        data = await self.post_upstream('/login', payload)
         print(data)
         self.write(data)
 
 
 # fetch data
 class FetchSessionListHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         user_id = self.get_argument('userId', required=False)
-        is_public = self.get_argument('isPublic', required=False)
         payload = { 'userId': user_id }
-        url = f'{get_url_head(is_public)}/fetch/session_list'
-        data = requests.post(url, json=payload, timeout=10).json()
+        data = await self.post_upstream('/fetch/session_list', payload)
         self.write(data)
 
 
 class FetchThreadDataHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         # get arguments
         user_id = self.get_argument('userId', required=False)
         thread_id = self.get_argument('sessionId', required=False)
         is_public = self.get_argument('isPublic', required=False)
+        image_mode = self.get_argument('imageMode', required=False)
 
         payload = {
             "dsl": {
@@ -91,14 +146,18 @@ class FetchThreadDataHandler(BaseHandler):
                     "userId": user_id,
                     "sessionId": thread_id,
                 },
+                "imageMode": image_mode,
             }
         }
 
-        url = f'{get_url_head(is_public)}/fetch/log'
-        data = requests.post(url, json=payload, timeout=30).json()
+        data = await self.post_upstream('/fetch/log', payload)
 
         records = data['log/log']['data']
-        images = { image['filename']: image['data'] for image in data['log/image']['data'] }
+        if image_mode == 'reference':
+            images = { image['filename']: image_reference(user_id, thread_id, \
+                       image['filename'], is_public) for image in data['log/image']['data'] }
+        else:
+            images = { image['filename']: image['data'] for image in data['log/image']['data'] }
 
         image_projection = data['preprocess/image_projection']['data']
         text_projection = data['preprocess/text_projection']['data']
@@ -122,10 +181,9 @@ class FetchThreadDataHandler(BaseHandler):
 
 
 class FetchFullImageHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         user_id = self.get_argument('userId', required=False)
         thread_id = self.get_argument('sessionId', required=False)
-        is_public = self.get_argument('isPublic', required=False)
         filename = self.get_argument('filename')
 
         payload = {
@@ -134,28 +192,45 @@ class FetchFullImageHandler(BaseHandler):
             'filename': filename,
         }
 
-        url = f'{get_url_head(is_public)}/fetch/full_image'
-        data = requests.post(url, json=payload, timeout=10).json()
+        data = await self.post_upstream('/fetch/full_image', payload)
 
         self.write(data)
 
+class FetchImageHandler(BaseHandler):
+    '''Stream an image from the diffusion app as binary JPEG'''
+    async def get(self):
+        params = {
+            'userId': self.get_query_argument('userId', 'None'),
+            'sessionId': self.get_query_argument('sessionId', 'None'),
+            'filename': self.get_query_argument('filename'),
+            'preview': self.get_query_argument('preview', '0'),
+        }
+        is_public = self.get_query_argument('isPublic', None)
+
+        self.set_header('Content-Type', 'image/jpeg')
+        self.set_header('Cache-Control', 'public, max-age=86400')
+
+        def on_chunk(chunk):
+            self.write(chunk)
+            self.flush()
+
+        await self.run_upstream('/fetch/image',
+            upstream.stream(get_url_head(is_public), '/fetch/image', params, on_chunk))
+
 # create new sessions and images
 
 class CreateSessionHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         user_id = self.get_argument('userId', required=False)
-        is_public = self.get_argument('isPublic', required=False)
         payload = { 'userId': user_id }
-        url = f'{get_url_head(is_public)}/create/session'
-        data = requests.post(url, json=payload, timeout=10).json()
+        data = await self.post_upstream('/create/session', payload)
         self.write(data)
 
 
 class RunGenerationHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         user_id = self.get_argument('userId', required=False)
         thread_id = self.get_argument('sessionId', required=False)
-        is_public = self.get_argument('isPublic', required=False)
         prompt = self.get_argument('prompt')
 
         payload = {
@@ -170,17 +245,17 @@ class RunGenerationHandler(BaseHandler):
             }
         }
 
-        url = f'{get_url_head(is_public)}/create/txt2img'
-        data = requests.post(url, json=payload, timeout=10).json()
+        data = await self.post_upstream('/create/txt2img', payload)
         self.write(data)
 
 
 class FetchNewDataHandler(BaseHandler):
-    def post(self):
+    async def post(self):
         user_id = self.get_argument('userId', required=False)
         thread_id = self.get_argument('sessionId', required=False)
         prompt_id = self.get_argument('promptId')
         is_public = self.get_argument('isPublic', required=False)
+        image_mode = self.get_argument('imageMode', required=False)
 
         payload = {
             "dsl": {
@@ -189,18 +264,22 @@ class FetchNewDataHandler(BaseHandler):
                     "thread_id": thread_id,
                 },
                 "prompt_id": prompt_id,
+                "imageMode": image_mode,
             }
         }
 
-        url = f'{get_url_head(is_public)}/fetch/new_generation'
-        data = requests.post(url, json=payload, timeout=10).json()
+        data = await self.post_upstream('/fetch/new_generation', payload)
 
         if data["status"] == "failed":
             self.write(data)
             return
 
         records = data["data"]["log/log"]
-        images = { image["filename"]: image["data"] for image in data["data"]["log/image"] }
+        if image_mode == 'reference':
+            images = { image["filename"]: image_reference(user_id, thread_id, \
+                       image["filename"], is_public) for image in data["data"]["log/image"] }
+        else:
+            images = { image["filename"]: image["data"] for image in data["data"]["log/image"] }
         image_projection = {key.rsplit('.', 1)[0] : value for key, value in \
                       data["data"]["preprocess/image_projection"].items()}
         text_projection = data['data']['preprocess/text_projection']
@@ -221,50 +300,105 @@ class FetchNewDataHandler(BaseHandler):
 # process and calculation
 
 class PromptTokenizeHandler(BaseHandler):
-    '''tokenize prompts'''
+    '''tokenize prompts
+
+    With userId and sessionId the tokenized history is kept on the server and
+    the response has its version. A request with that version only sends the
+    prompts appended since, and gets back the prompts whose result changed.
+    A version that does not match the kept history gets the status 'stale',
+    and the full history has to be sent again.
+    '''
     def post(self):
         '''handle post request'''
         prompts = self.get_argument('prompts')
-        result = compare(prompts)
+        session_key = self.get_session_key()
+        version = self.get_argument('version', required=False)
+
+        if session_key is None:
+            with comparison_cache.session(session_key):
+                result = compare(prompts)
+            self.write({
+                'status': 'success',
+                'data': {
+                    'prompts': result,
+                }
+            })
+            return
+
+        if version is None:
+            session = tokenize_sessions.reset(session_key)
+        else:
+            session = tokenize_sessions.get(session_key)
+            if session is None or session.version != version:
+                self.write({ 'status': 'stale' })
+                return
+
+        with comparison_cache.session(session_key):
+            result = session.append(prompts)
         response = {
             'status': 'success',
             'data': {
                 'prompts': result,
+                'version': session.version,
+                'delta': version is not None,
             }
         }
         self.write(response)
 
 
 class ImageClusterHandler(BaseHandler):
-    '''cluster images according to 2d embedding'''
+    '''
+    cluster images according to 2d embedding
+
+    With tree set the response also has the linkage tree, for the client to
+    cut it at other thresholds without a request. method 'grid' clusters
+    large sets of images approximately, in memory linear in their number.
+    '''
     def post(self):
         '''handle post request'''
         embeddings = self.get_argument('embeddings')
         threshold = self.get_argument('threshold')
-        clusters = image_cluster(embeddings, threshold)
-        response = {
-            'data': { 'clusters': clusters }
-        }
+        return_tree = self.get_argument('tree', required=False)
+        method = self.get_argument('method', required=False) or 'ward'
+        if method not in CLUSTER_METHODS:
+            raise tornado.web.HTTPError(400, f"Unknown clustering method: {method}")
+
+        data = {}
+        if return_tree:
+            data['clusters'], data['tree'] = image_cluster(
+                embeddings, threshold, return_tree=True, method=method)
+        else:
+            data['clusters'] = image_cluster(embeddings, threshold, method=method)
+        response = { 'data': data }
         self.write(response)
 
 
 class EdgeDeriveHandler(BaseHandler):
-    '''derive edges'''
+    '''
+    derive edges
+
+    With mode 'clusters' the response has clusterEdges, one edge per prompt
+    pair, pair of clusters and word, instead of one edge per image pair.
+    '''
     def post(self):
         '''handle post request'''
         prompts = self.get_argument('prompts')
         prompt_pairs = self.get_argument('promptPairs')
         image_clusters = self.get_argument('imageClusters')
         image_indices = self.get_argument('imageIndices')
-
-        edges, edge_groups = derive(prompts, prompt_pairs, image_clusters, image_indices)
-
-        response = {
-            'data': {
-                'edges': edges,
-                'edgeGroups': edge_groups,
-            }
-        }
+        mode = self.get_argument('mode', required=False)
+
+        with comparison_cache.session(self.get_session_key()):
+            if mode == 'clusters':
+                cluster_edges, edge_groups = derive_clusters(
+                    prompts, prompt_pairs, image_clusters, image_indices)
+                data = { 'clusterEdges': cluster_edges }
+            else:
+                edges, edge_groups = derive(prompts, prompt_pairs, image_clusters, image_indices)
+                data = { 'edges': edges }
+
+        data['edgeGroups'] = edge_groups
+        response = { 'data': data }
         self.write(response)
 
 
@@ -283,6 +417,7 @@ class Application(tornado.web.Application):
             ("/fetch/session_data", FetchThreadDataHandler),
             ("/fetch/new_data", FetchNewDataHandler),
             ('/fetch/full_image', FetchFullImageHandler),
+            ('/fetch/image', FetchImageHandler),
             ("/generate", RunGenerationHandler),
             ('/prompt/tokenize', PromptTokenizeHandler),
             ('/image/cluster', ImageClusterHandler),
@@ -299,6 +434,7 @@ class Application(tornado.web.Application):
 
 if __name__ == "__main__":
     tornado.options.parse_command_line()
+    upstream.configure_client()
     print("server running at server:%d ..."%(tornado.options.options.port))
     app = Application()
     http_server = tornado.httpserver.HTTPServer(app)
@@ -1,29 +1,139 @@
-from scipy.cluster.hierarchy import linkage, dendrogram, fcluster
+'''
+Hierarchical clustering of image embeddings.
 
+The ward linkage of a set of points is cached by a hash of the points, so
+changing only the threshold of /image/cluster recuts the cached tree with
+fcluster. The tree can also be returned as arrays for the client to cut it.
 
-def image_cluster(embeddings: dict, threshold=1):
+Exact ward needs memory and time quadratic in the number of points. The grid
+method links grid cells of points instead, see grid_ward, for large sets.
+'''
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.cluster.hierarchy import linkage, dendrogram, fcluster, maxdists
+
+from .grid_ward import grid_ward
+
+MAX_ENTRIES = 32
+METHODS = ('ward', 'grid')
+
+
+def compute_linkage(points, method='ward'):
+    '''Linkage matrix of points and the leaf of the tree of every point'''
+    if method == 'grid':
+        return grid_ward(points)
+    return linkage(points, method='ward'), np.arange(len(points))
+
+
+class LinkageCache:
+    '''Linkage trees of recently clustered point sets'''
+    def __init__(self, max_entries=MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self) -> str:
+        return (
+            f"LinkageCache("
+            f"entries={len(self.entries)}/{self.max_entries}, "
+            f"hits={self.hits}, "
+            f"misses={self.misses}"
+            f")"
+        )
+
+    @staticmethod
+    def key(points, method):
+        points = np.ascontiguousarray(points, dtype=np.float64)
+        identity = f'{method}{points.shape}'.encode('utf-8') + points.tobytes()
+        return hashlib.sha1(identity).hexdigest()
+
+    def linkage(self, points, method='ward'):
+        '''Linkage matrix of points and the leaf of every point, computed on a miss'''
+        key = self.key(points, method)
+        with self.lock:
+            tree = self.entries.get(key)
+            if tree is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return tree
+            self.misses += 1
+
+        tree = compute_linkage(points, method)
+        for array in tree:
+            array.flags.writeable = False # shared by all requests for the points
+
+        with self.lock:
+            self.entries[key] = tree
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return tree
+
+
+linkage_cache = LinkageCache()
+
+
+def image_cluster(embeddings: dict, threshold=1, return_tree=False, method='ward'):
     '''Cluster images
-    
+
     Args:
         embeddings (dict): a dictionary of image embeddings,
             e.g. {'i1': {'x': 0.1, 'y': 0.1}, 'i2': {'x': 0.2, 'y': 0.2}, ...}
         threshold (float): the threshold for clustering
+        return_tree (bool): also return the tree, see cluster_tree
+        method (str): 'ward', or 'grid' for large sets of images
+
+    Returns:
+        the cluster of every image, and the tree if return_tree is set
     '''
     point_list = list(embeddings.items())
     points = [value for _, value in point_list]
     points = [[val['x'], val['y']] for val in points]
-    clusters = cluster(points, threshold)
+    clusters = cluster(points, threshold, method)
     result = { key: clusters[i] for i, (key, _) in enumerate(point_list)}
+    if return_tree:
+        tree = cluster_tree(points, method)
+        tree['images'] = [key for key, _ in point_list]
+        return result, tree
     return result
 
 
-def cluster(points, threshold=1):
+def cluster(points, threshold=1, method='ward'):
     '''Given a list of 2d points, cluster them into groups.
-    
+
     Args:
         points (list): a list of 2d points, e.g. [[1, 2], [3, 4], ...]
         threshold (float): the threshold for clustering
+        method (str): 'ward', or 'grid' for large sets of points
     '''
-    Z = linkage(points, method='ward')
-    clusters = fcluster(Z, t=threshold, criterion='distance').tolist()
+    Z, leaves = linkage_cache.linkage(points, method)
+    if len(Z) == 0: # a single leaf
+        return [1] * len(leaves)
+    clusters = fcluster(Z, t=threshold, criterion='distance')[leaves].tolist()
     return clusters
+
+
+def cluster_tree(points, method='ward'):
+    '''The linkage tree of points as arrays
+
+    Returns:
+        a dict with the children ("left", "right") of every merge, leaves are
+        0..n-1 and the i-th merge is n+i, the largest merge distance below
+        every merge ("maxDist") and the leaf of every point ("leaves") if
+        leaves are not points. Cutting it like fcluster with the distance
+        criterion gives the same clusters.
+    '''
+    Z, leaves = linkage_cache.linkage(points, method)
+    tree = {
+        'left': Z[:, 0].astype(int).tolist(),
+        'right': Z[:, 1].astype(int).tolist(),
+        'maxDist': maxdists(Z).tolist() if len(Z) else [],
+    }
+    if method != 'ward':
+        tree['leaves'] = leaves.tolist()
+    return tree
@@ -0,0 +1,148 @@
+'''
+Approximate ward linkage of many 2d points.
+
+Points are binned into a square grid with at most MAX_CELLS occupied cells,
+and the cells are linked by ward with the number of points of every cell as
+its weight, using the nearest-neighbor chain, which needs memory linear in
+the number of cells. Points of a cell always end up in the same cluster, so
+the clusters approach those of exact ward for thresholds well above the cell
+size. Sets of at most MAX_CELLS points are linked exactly.
+'''
+import numpy as np
+from scipy.cluster.hierarchy import linkage
+
+MAX_CELLS = 2048
+
+
+def grid_cells(points, max_cells=MAX_CELLS):
+    '''
+    Bin points into the finest grid with at most max_cells occupied cells
+
+    Returns:
+        the cell of every point, and the centroid and number of points of
+        every cell
+    '''
+    lower = points.min(axis=0)
+    extent = max(float((points.max(axis=0) - lower).max()), 1e-12)
+
+    cells = None
+    bins = max(int(np.sqrt(max_cells)), 1) # at most max_cells cells in any case
+    while True:
+        cell_size = extent / bins
+        index = np.minimum(((points - lower) / cell_size).astype(np.int64), bins - 1)
+        uniques, inverse = np.unique(index[:, 0] * bins + index[:, 1], return_inverse=True)
+        if len(uniques) > max_cells:
+            break
+        cells = inverse
+        if len(uniques) == len(points) or bins >= 2 ** 20:
+            break
+        bins *= 2
+
+    sizes = np.bincount(cells)
+    centroids = np.stack([np.bincount(cells, points[:, 0]) / sizes,
+                          np.bincount(cells, points[:, 1]) / sizes], axis=1)
+    return cells, centroids, sizes
+
+
+def ward_distances(x, y, sizes, i):
+    '''Squared ward distances of cluster i to all clusters, merged ones have inf centroids'''
+    dx = x - x[i]
+    dy = y - y[i]
+    dist = 2 * sizes * sizes[i] / (sizes + sizes[i]) * (dx * dx + dy * dy)
+    dist[i] = np.inf
+    return dist
+
+
+def weighted_ward(centroids, sizes):
+    '''
+    Ward linkage of weighted points, by the nearest-neighbor chain
+
+    Returns:
+        a linkage matrix as scipy.cluster.hierarchy.linkage returns it, the
+        weights only count in the distances
+    '''
+    m = len(sizes)
+    centroids = np.asarray(centroids, dtype=np.float64)
+    x = centroids[:, 0].copy()
+    y = centroids[:, 1].copy()
+    sizes = np.array(sizes, dtype=np.float64)
+    ids = np.arange(m) # point or cluster at every position
+
+    # merges as (cluster, cluster, distance), by the ids of the points or clusters
+    merges = []
+    chain = []
+    num_active = m
+    while num_active > 1:
+        if not chain:
+            chain.append(int(np.argmax(np.isfinite(x))))
+        a = chain[-1]
+        dist = ward_distances(x, y, sizes, a)
+        b = int(np.argmin(dist))
+        # prefer the previous cluster of the chain on ties, so the chain ends
+        if len(chain) > 1 and dist[chain[-2]] <= dist[b]:
+            b = chain[-2]
+
+        if len(chain) > 1 and b == chain[-2]:
+            chain.pop()
+            chain.pop()
+            merges.append((int(ids[a]), int(ids[b]), float(np.sqrt(dist[b]))))
+            # the merged cluster stays at the later position, like scipy
+            a, b = min(a, b), max(a, b)
+            total = sizes[a] + sizes[b]
+            x[b] = (sizes[a] * x[a] + sizes[b] * x[b]) / total
+            y[b] = (sizes[a] * y[a] + sizes[b] * y[b]) / total
+            sizes[b] = total
+            x[a] = y[a] = np.inf
+            num_active -= 1
+
+            # drop merged clusters once they are half of the arrays
+            if num_active * 2 < len(x):
+                keep = np.flatnonzero(np.isfinite(x))
+                position = np.cumsum(np.isfinite(x)) - 1
+                chain = [int(position[c]) for c in chain]
+                x, y, sizes, ids = x[keep], y[keep], sizes[keep], ids[keep]
+        else:
+            chain.append(b)
+
+    return label_merges(merges, m)
+
+
+def label_merges(merges, m):
+    '''Sort merges by distance and number the merged clusters like scipy'''
+    merges = sorted(merges, key=lambda merge: merge[2])
+    parent = np.arange(2 * m - 1)
+    cluster_sizes = np.concatenate([np.ones(m), np.zeros(m - 1)])
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    Z = np.empty((m - 1, 4))
+    for idx, (a, b, dist) in enumerate(merges):
+        ra, rb = find(a), find(b)
+        new = m + idx
+        parent[ra] = parent[rb] = new
+        cluster_sizes[new] = cluster_sizes[ra] + cluster_sizes[rb]
+        Z[idx] = (min(ra, rb), max(ra, rb), dist, cluster_sizes[new])
+    return Z
+
+
+def grid_ward(points, max_cells=MAX_CELLS):
+    '''
+    Approximate ward linkage of 2d points
+
+    Returns:
+        the linkage matrix of the grid cells and the cell of every point
+    '''
+    points = np.asarray(points, dtype=np.float64)
+    if 1 < len(points) <= max_cells:
+        return linkage(points, method='ward'), np.arange(len(points))
+
+    cells, centroids, sizes = grid_cells(points, max_cells)
+    if len(sizes) == 1:
+        return np.empty((0, 4)), cells
+    return weighted_ward(centroids, sizes), cells
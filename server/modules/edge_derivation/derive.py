@@ -1,214 +1,442 @@
+'''
+Derive edges between images from the words changed between their prompts.
+
+Edges are rows of a structured array, one per changed word and image pair,
+with words, actions, images and clusters coded as integers. Bundling edges and
+sharing weights are group-by sums over the codes. np.bincount adds the weights
+of a group in row order like the former dict loops did, so the weights are the
+same to the last bit.
+
+All image pairs of two prompts with the same pair of clusters get the same
+edges, so derive_clusters keeps one row per prompt pair, pair of clusters and
+changed word, weighted by the number of image pairs it stands for. Its cost
+grows with prompts and clusters instead of images squared, and the client
+expands the rows into image edges for the prompt pairs it shows.
+'''
 import os
 import sys
 import json
 import shutil
+import numpy as np
 import pandas as pd
 
 from ..text_comparison.cmp_prompt_with_weight import compare_two_sentences
+from ..text_comparison.distance import distance_matrix
 
 PROMPT_FILE = "prompts.json"
 IMAGE_FILE = "image_cluster.json"
 
+# words not counted as a difference between prompts
+IGNORED_WORDS = [",", ".", "?", "by", "in", "the", "a", "he", "is", "and", "of"]
+DIFF_ACTIONS = ("i", "r", "m", "iw", "rw")
+
 # compare two prompts
 def cmp_prompts(p1, p2):
-    symbols = [",", ".", "?", "by", "in", "the", "a", "he", "is", "and", "of"]
     p1 = p1["words"]
     p2 = p2["words"]
     cmp_res = compare_two_sentences(p1, p2)
     diff_words = [item for item in cmp_res if item[0] != "k"]
-    diff_words = list(filter(lambda x: x[1] not in symbols, diff_words))
+    diff_words = list(filter(lambda x: x[1] not in IGNORED_WORDS, diff_words))
 
     return diff_words
 
 # Prompt pairs to compare
 def get_prompt_pairs(prompts, max_dist=5):
-    cnt_prompts = len(prompts)
-    pairs = []
-
-    for i in range(cnt_prompts):
-        for j in range(i + 1, cnt_prompts):
-            dist = len(cmp_prompts(prompts[i], prompts[j]))
-            if dist <= max_dist:
-                pairs.append((i, j))
-
-    return pairs
+    sentences = [prompt["words"] for prompt in prompts]
+    distances = distance_matrix(sentences, max_dist=max_dist,
+                                actions=DIFF_ACTIONS, ignore=IGNORED_WORDS)
+    rows, cols = np.nonzero(np.triu(distances <= max_dist, 1))
+
+    return [(int(i), int(j)) for i, j in zip(rows, cols)]
+
+
+EDGE_DTYPE = np.dtype([
+    ("word", np.int64),
+    ("action", np.int64),
+    ("changes", np.int64), # merged edges only
+    ("src", np.int64),
+    ("tgt", np.int64),
+    ("src_clu", np.int64),
+    ("tgt_clu", np.int64),
+    ("src_pmt", np.int64),
+    ("tgt_pmt", np.int64),
+    ("ratio", np.int64),
+    ("image_pairs", np.int64), # image pairs the edge stands for
+    ("weight", np.float64),
+])
+
+
+class CodeTable:
+    '''Integer codes of values, in order of first appearance'''
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def __str__(self) -> str:
+        return (
+            f"CodeTable("
+            f"values={len(self.values)}"
+            f")"
+        )
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def decode(self, codes):
+        return [self.values[code] for code in codes.tolist()]
+
+
+class EdgeTables:
+    '''Code tables of the values referenced by edges'''
+    def __init__(self):
+        self.words = CodeTable()
+        self.actions = CodeTable()
+        self.images = CodeTable()
+        self.clusters = CodeTable()
+        self.changes = [] # lists of the changes of merged edges
+
+    def __str__(self) -> str:
+        return (
+            f"EdgeTables("
+            f"words={len(self.words.values)}, "
+            f"images={len(self.images.values)}, "
+            f"changes={len(self.changes)}"
+            f")"
+        )
+
+
+class EdgeEnds:
+    '''Ends of the edges of every prompt, its images or its clusters'''
+    def __init__(self, ends, clusters, images, num_ends, num_images):
+        self.ends = ends # codes of the ends of all prompts
+        self.clusters = clusters # cluster code of every end
+        self.images = images # images every end stands for
+        self.num_ends = num_ends
+        self.num_images = num_images
+        self.starts = np.cumsum(num_ends) - num_ends
+
+    def __str__(self) -> str:
+        return (
+            f"EdgeEnds("
+            f"prompts={len(self.num_ends)}, "
+            f"ends={len(self.ends)}, "
+            f"images={int(self.images.sum())}"
+            f")"
+        )
+
+    @classmethod
+    def from_images(cls, img_cluster, image_indexes, tables):
+        '''Every image as an end'''
+        ends = [tables.images.code(idx) for indexes in image_indexes for idx in indexes]
+        clusters = [tables.clusters.code(img_cluster[idx])
+                    for indexes in image_indexes for idx in indexes]
+        num_images = np.array([len(indexes) for indexes in image_indexes], dtype=np.int64)
+        return cls(np.array(ends, dtype=np.int64), np.array(clusters, dtype=np.int64),
+                   np.ones(len(ends), dtype=np.int64), num_images, num_images)
+
+    @classmethod
+    def from_clusters(cls, img_cluster, image_indexes, tables):
+        '''The images of a prompt in one cluster as an end'''
+        clusters = []
+        images = []
+        num_ends = []
+        for indexes in image_indexes:
+            counts = {}
+            for idx in indexes:
+                cluster = tables.clusters.code(img_cluster[idx])
+                counts[cluster] = counts.get(cluster, 0) + 1
+            clusters.extend(counts.keys())
+            images.extend(counts.values())
+            num_ends.append(len(counts))
+        num_images = np.array([len(indexes) for indexes in image_indexes], dtype=np.int64)
+        return cls(np.arange(len(clusters), dtype=np.int64), np.array(clusters, dtype=np.int64),
+                   np.array(images, dtype=np.int64), np.array(num_ends, dtype=np.int64),
+                   num_images)
+
+
+def group_rows(*columns):
+    '''
+    Group rows by the values of integer columns
+
+    Returns:
+        the group of every row, numbered in order of first appearance,
+        and the index of the first row of every group
+    '''
+    key = np.zeros(len(columns[0]), dtype=np.int64)
+    key_size = 1
+    for column in columns:
+        column_size = int(column.max(initial=0)) + 1
+        if key_size * column_size >= 2 ** 62:
+            # renumber the key densely so that the combined key fits
+            _, key = np.unique(key, return_inverse=True)
+            key_size = int(key.max(initial=0)) + 1
+        key = key * column_size + column
+        key_size *= column_size
+
+    _, first, key = np.unique(key, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    order = np.argsort(first, kind="stable")
+    rank[order] = np.arange(len(first))
+    return rank[key], first[order]
+
+
+def group_bundles(edges):
+    '''Bundles of edges with the same word, action and clusters'''
+    return group_rows(edges["word"], edges["action"], edges["src_clu"], edges["tgt_clu"])
+
+
+def bundle_weight(edges, bundles, num_bundles):
+    '''Weights of the bundles, summed over the image pairs of their edges'''
+    return np.bincount(bundles, edges["weight"] * edges["image_pairs"], num_bundles)
 
 
 # Original edges
-def generate_original_edges(prompts, pairs, img_cluster, image_indexes):
-    edges = []
-
+def generate_original_edges(prompts, pairs, ends, tables):
+    '''
+    Edges for every changed word and pair of ends of the compared prompts
+
+    Edges are in the order of the prompt pairs, changed words, ends of the
+    first prompt and ends of the second prompt.
+    '''
+    # changed words of all pairs and the pair of each word
+    words = []
+    actions = []
+    num_words = []
     for i, j in pairs:
-        images1 = image_indexes[i]
-        images2 = image_indexes[j]
-
         diff_words = cmp_prompts(prompts[i], prompts[j])
-
-        for diff in diff_words:
-            for idx1 in images1:
-                for idx2 in images2:
-                    sum_weight = 1
-                    edge = {
-                        "word": diff[1],
-                        "action": diff[0],
-                        "src": idx1,
-                        "tgt": idx2,
-                        "src_clu": img_cluster[idx1],
-                        "tgt_clu": img_cluster[idx2],
-                        "src_pmt": i,
-                        "tgt_pmt": j,
-                        "ratio": len(images1) * len(images2),
-                        "weight": sum_weight / (len(diff_words) * len(images1) * len(images2))
-                    }
-                    edges.append(edge)
-
+        words.extend([tables.words.code(diff[1]) for diff in diff_words])
+        actions.extend([tables.actions.code(diff[0]) for diff in diff_words])
+        num_words.append(len(diff_words))
+
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    num_words = np.array(num_words, dtype=np.int64)
+    len2 = ends.num_ends[pairs[:, 1]]
+    ratio = ends.num_images[pairs[:, 0]] * ends.num_images[pairs[:, 1]]
+
+    # each changed word of a pair becomes an edge per pair of ends
+    word_pairs = np.repeat(np.arange(len(pairs)), num_words)
+    word_edges = (ends.num_ends[pairs[:, 0]] * len2)[word_pairs]
+    edge_words = np.repeat(np.arange(len(word_pairs)), word_edges)
+    edge_pairs = word_pairs[edge_words]
+    offsets = np.arange(len(edge_words)) - np.repeat(np.cumsum(word_edges) - word_edges, word_edges)
+    src = ends.starts[pairs[edge_pairs, 0]] + offsets // len2[edge_pairs]
+    tgt = ends.starts[pairs[edge_pairs, 1]] + offsets % len2[edge_pairs]
+
+    edges = np.empty(len(edge_words), dtype=EDGE_DTYPE)
+    edges["word"] = np.array(words, dtype=np.int64)[edge_words]
+    edges["action"] = np.array(actions, dtype=np.int64)[edge_words]
+    edges["changes"] = -1
+    edges["src"] = ends.ends[src]
+    edges["tgt"] = ends.ends[tgt]
+    edges["src_clu"] = ends.clusters[src]
+    edges["tgt_clu"] = ends.clusters[tgt]
+    edges["src_pmt"] = pairs[edge_pairs, 0]
+    edges["tgt_pmt"] = pairs[edge_pairs, 1]
+    edges["ratio"] = ratio[edge_pairs]
+    edges["image_pairs"] = ends.images[src] * ends.images[tgt]
+    # 1 / (changed words * ratio), exact as both are integers
+    edges["weight"] = 1 / (num_words * ratio).astype(np.float64)[edge_pairs]
     return edges
 
 
-# Normalize edges
-def normalize_edges(edges):
-    def reverse_edge(edge):
-        edge["src"], edge["tgt"] = edge["tgt"], edge["src"]
-        edge["src_clu"], edge["tgt_clu"] = edge["tgt_clu"], edge["src_clu"]
-        edge["src_pmt"], edge["tgt_pmt"] = edge["tgt_pmt"], edge["src_pmt"]
-        if edge["action"] == "r":
-            edge["action"] = "i"
-        elif edge["action"] == "i":
-            edge["action"] = "r"
-        return edge
-
-    norm_edges = []
-
-    for edge in edges:
-        src_clu = edge["src_clu"]
-        tgt_clu = edge["tgt_clu"]
-        action = edge["action"]
-
-        if src_clu == tgt_clu:
-            src_pmt = edge["src_pmt"]
-            tgt_pmt = edge["tgt_pmt"]
-            if src_pmt > tgt_pmt:
-                edge = reverse_edge(edge)
-        elif src_clu > tgt_clu:
-            edge = reverse_edge(edge)
-
-        norm_edges.append(edge)
-
-    return norm_edges
-
-
-def edge_to_key(edge):
-    word = edge["word"]
-    action = edge["action"]
-    src_clu = edge["src_clu"]
-    tgt_clu = edge["tgt_clu"]
-    return (word, action, src_clu, tgt_clu)
+# Calculate edge weight
+def update_weight(edges):
+    '''
+    Share the weight of the bundles among the edges of each pair of ends
+
+    Returns:
+        the edges grouped by pair of ends in order of first appearance
+    '''
+    bundles, first = group_bundles(edges)
+    bundle_weights = bundle_weight(edges, bundles, len(first))[bundles]
+
+    pairs, first = group_rows(edges["src"], edges["tgt"])
+    pair_weights = np.bincount(pairs, bundle_weights, len(first))
+
+    order = np.argsort(pairs, kind="stable")
+    edges = edges[order]
+    edges["weight"] = bundle_weights[order] / (pair_weights[pairs[order]] * edges["ratio"])
+    return edges
 
 
-# Bundle edges
-def bundle_edges(edges):
-    edge_dict = {}
+def round_weights(weights, digits=3):
+    '''
+    Codes of the weights rounded like round(weight, digits)
+
+    np.round can land on the other side of a tie than Python's correctly
+    rounded round, so weights near a tie are rounded by Python.
+    '''
+    scaled = weights * 10 ** digits
+    rounded = np.round(scaled) / 10 ** digits
+    near_tie = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    rounded[near_tie] = [round(weight, digits) for weight in weights[near_tie].tolist()]
+    _, codes = np.unique(rounded, return_inverse=True)
+    return codes
+
+
+def merge_edges(edges, tables):
+    '''Merge the edges of an image pair with the same weight, rounded to 3 digits'''
+    groups, first = group_rows(edges["src"], edges["tgt"], round_weights(edges["weight"]))
+    counts = np.bincount(groups, minlength=len(first))
+
+    new_edges = edges[first]
+    new_edges["weight"] = np.minimum(new_edges["weight"] * counts, 1.0)
+
+    # a single edge keeps its word, edges with the same change share the changes
+    num_actions = len(tables.actions.values)
+    single = np.flatnonzero(counts == 1)
+    single_changes, inverse = np.unique(
+        new_edges["word"][single] * num_actions + new_edges["action"][single],
+        return_inverse=True)
+    new_edges["changes"][single] = inverse + len(tables.changes)
+    for code in single_changes.tolist():
+        word, action = divmod(code, num_actions)
+        tables.changes.append([{
+            "word": tables.words.values[word],
+            "action": tables.actions.values[action],
+        }])
+
+    # merged edges join the words of their changes
+    members = np.argsort(groups, kind="stable")
+    ends = np.cumsum(counts)
+    multiple = np.flatnonzero(counts > 1)
+    member_words = edges["word"][members].tolist()
+    member_actions = edges["action"][members].tolist()
+    change_codes = {}
+    for group, start, end in zip(multiple.tolist(), (ends - counts)[multiple].tolist(),
+                                 ends[multiple].tolist()):
+        key = (tuple(member_words[start:end]), tuple(member_actions[start:end]))
+        code = change_codes.get(key)
+        if code is None:
+            group_changes = [{
+                "word": tables.words.values[word],
+                "action": tables.actions.values[action],
+            } for word, action in zip(*key)]
+            text = " ".join([change["word"] for change in group_changes])
+            code = change_codes[key] = (tables.words.code(text), len(tables.changes))
+            tables.changes.append(group_changes)
+        new_edges["word"][group], new_edges["changes"][group] = code
 
-    for edge in edges:
-        weight = edge["weight"]
-        key = edge_to_key(edge)
-        if key not in edge_dict:
-            edge_dict[key] = 0
-        edge_dict[key] += weight
+    return new_edges
 
-    return edge_dict
 
+def edges_to_dicts(edges, tables):
+    columns = zip(
+        tables.words.decode(edges["word"]),
+        tables.actions.decode(edges["action"]),
+        edges["changes"].tolist(),
+        tables.images.decode(edges["src"]),
+        tables.images.decode(edges["tgt"]),
+        tables.clusters.decode(edges["src_clu"]),
+        tables.clusters.decode(edges["tgt_clu"]),
+        edges["src_pmt"].tolist(),
+        edges["tgt_pmt"].tolist(),
+        edges["ratio"].tolist(),
+        edges["weight"].tolist(),
+    )
+    return [{
+        "word": word,
+        "action": action,
+        "changes": tables.changes[changes],
+        "src": src,
+        "tgt": tgt,
+        "src_clu": src_clu,
+        "tgt_clu": tgt_clu,
+        "src_pmt": src_pmt,
+        "tgt_pmt": tgt_pmt,
+        "ratio": ratio,
+        "weight": weight,
+    } for word, action, changes, src, tgt, src_clu, tgt_clu, src_pmt, tgt_pmt, ratio, weight
+        in columns]
+
+
+def cluster_edges_to_dicts(edges, tables):
+    columns = zip(
+        tables.words.decode(edges["word"]),
+        tables.actions.decode(edges["action"]),
+        edges["changes"].tolist(),
+        tables.clusters.decode(edges["src_clu"]),
+        tables.clusters.decode(edges["tgt_clu"]),
+        edges["src_pmt"].tolist(),
+        edges["tgt_pmt"].tolist(),
+        edges["ratio"].tolist(),
+        edges["image_pairs"].tolist(),
+        edges["weight"].tolist(),
+    )
+    return [{
+        "word": word,
+        "action": action,
+        "changes": tables.changes[changes],
+        "src_clu": src_clu,
+        "tgt_clu": tgt_clu,
+        "src_pmt": src_pmt,
+        "tgt_pmt": tgt_pmt,
+        "ratio": ratio,
+        "image_pairs": image_pairs,
+        "weight": weight,
+    } for word, action, changes, src_clu, tgt_clu, src_pmt, tgt_pmt, ratio, image_pairs, weight
+        in columns]
+
+
+def derive_edges(prompts, prompt_pairs, ends, tables):
+    '''Weighted edges between the ends and the edge groups, by decreasing weight'''
+    original_edges = generate_original_edges(prompts, prompt_pairs, ends, tables)
+    if len(original_edges) == 0:
+        return original_edges, []
+
+    new_edges = update_weight(original_edges)
+    new_edges = merge_edges(new_edges, tables)
+    new_edges = update_weight(new_edges)
+
+    # bundles by decreasing weight, ties in order of first appearance
+    bundles, first = group_bundles(new_edges)
+    new_weights = bundle_weight(new_edges, bundles, len(first))
+    order = np.argsort(-new_weights, kind="stable")
+    groups = new_edges[first[order]]
+
+    edge_groups = [{
+        "word": word,
+        "changes": tables.changes[changes],
+        "action": action,
+        "src_clu": src_clu,
+        "tgt_clu": tgt_clu,
+        "weight": weight
+    } for word, changes, action, src_clu, tgt_clu, weight in zip(
+        tables.words.decode(groups["word"]),
+        groups["changes"].tolist(),
+        tables.actions.decode(groups["action"]),
+        tables.clusters.decode(groups["src_clu"]),
+        tables.clusters.decode(groups["tgt_clu"]),
+        new_weights[order].tolist(),
+    )]
 
-# Calculate edge weight
-def update_weight(edges, weights):
-    new_edges = []
-
-    image_pairs = {}
-    for idx, edge in enumerate(edges):
-        src = edge["src"]
-        tgt = edge["tgt"]
-        key = (src, tgt)
-        if key not in image_pairs:
-            image_pairs[key] = []
-        image_pairs[key].append(idx)
-
-    for key, idxs in image_pairs.items():
-        sum_weight = 0
-        for idx in idxs:
-            key = edge_to_key(edges[idx])
-            sum_weight += weights[key]
-        for idx in idxs:
-            edge = edges[idx]
-            key = edge_to_key(edge)
-            edge["weight"] = weights[key] / (sum_weight * edge["ratio"])
-            new_edges.append(edge)
-
-    new_edge_dict = bundle_edges(new_edges)
-    return new_edges, new_edge_dict
-
-
-def merge_edges(edges):
-    same_src_tgt_weight_edges = {}
-    for edge in edges:
-        src = edge["src"]
-        tgt = edge["tgt"]
-        weight = edge["weight"]
-        weight = round(weight, 3)
-        key = (src, tgt, weight)
-        if key not in same_src_tgt_weight_edges:
-            same_src_tgt_weight_edges[key] = []
-        same_src_tgt_weight_edges[key].append(edge)
-    new_edges = []
-    for key, value in same_src_tgt_weight_edges.items():
-        changes = [{
-            "word": edge["word"],
-            "action": edge["action"],
-        } for edge in value]
-
-        new_edge = {
-            "word": " ".join([change["word"] for change in changes]),
-            "action": value[0]["action"],
-            "changes": changes,
-            "src": value[0]["src"],
-            "tgt": value[0]["tgt"],
-            "src_clu": value[0]["src_clu"],
-            "tgt_clu": value[0]["tgt_clu"],
-            "src_pmt": value[0]["src_pmt"],
-            "tgt_pmt": value[0]["tgt_pmt"],
-            "ratio": value[0]["ratio"],
-            "weight": min(value[0]["weight"] * len(value), 1.0),
-        }
-        new_edges.append(new_edge)
-    return new_edges
+    return new_edges, edge_groups
 
 
 def derive(prompts, prompt_pairs, image_clusters, image_indices):
     print('derive')
-    original_edges = generate_original_edges(prompts, prompt_pairs, image_clusters, image_indices)
-    normalized_edges = original_edges
-    bundled_edges = bundle_edges(normalized_edges)
-    new_edges, new_weights = update_weight(original_edges, bundled_edges)
-    new_edges = merge_edges(new_edges)
-    new_weights = bundle_edges(new_edges)
-    new_edges, new_weights = update_weight(new_edges, new_weights)
-
-    weights = sorted(bundled_edges.items(), key=lambda x: x[1], reverse=True)
-    new_weights = sorted(new_weights.items(), key=lambda x: x[1], reverse=True)
-
-    edge_groups = []
-    for key, value in new_weights:
-        for edge in new_edges:
-            if edge["word"] ==  key[0] and edge["action"] == key[1] and \
-                edge["src_clu"] == key[2] and edge["tgt_clu"] == key[3]:
-                changes = edge["changes"]
-                break
-        edge_groups.append({
-            "word": key[0],
-            "changes": changes,
-            "action": key[1],
-            "src_clu": key[2],
-            "tgt_clu": key[3],
-            "weight": value
-        })
-
-    return new_edges, edge_groups
+    tables = EdgeTables()
+    ends = EdgeEnds.from_images(image_clusters, image_indices, tables)
+    edges, edge_groups = derive_edges(prompts, prompt_pairs, ends, tables)
+    return edges_to_dicts(edges, tables), edge_groups
+
+
+def derive_clusters(prompts, prompt_pairs, image_clusters, image_indices):
+    '''
+    Derive edges between the clusters of prompts
+
+    Returns:
+        the edges between the images of a prompt in one cluster and the images
+        of another prompt in one cluster, with the number of image pairs each
+        stands for, and the edge groups of derive. Weights equal those of
+        derive up to the order of floating point additions.
+    '''
+    print('derive clusters')
+    tables = EdgeTables()
+    ends = EdgeEnds.from_clusters(image_clusters, image_indices, tables)
+    edges, edge_groups = derive_edges(prompts, prompt_pairs, ends, tables)
+    return cluster_edges_to_dicts(edges, tables), edge_groups
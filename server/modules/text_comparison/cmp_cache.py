@@ -0,0 +1,158 @@
+'''
+Cache of prompt comparisons.
+
+Comparisons are keyed by a hash of the compared tokens and weights, so repeated
+analysis requests on an unchanged or slightly grown prompt history only diff
+the pairs that have not been seen before. Results are kept in an in-memory LRU
+and, inside a session context, persisted to one file per session on disk.
+'''
+import os
+import json
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+
+CACHE_DIR = './cache/comparisons'
+MAX_ENTRIES = 50000
+
+# comparisons made inside the current session context, keyed by hash
+_session_entries = contextvars.ContextVar('session_entries', default=None)
+
+
+def sentence_to_key(sentence):
+    '''The part of a sentence that the comparison depends on'''
+    if isinstance(sentence, str):
+        return sentence
+    return [(item["text"], item["weight"]) for item in sentence]
+
+
+def decode_result(result):
+    '''Restore the tuples of a comparison result read from JSON'''
+    return [tuple(tuple(value) if isinstance(value, list) else value for value in item)
+            for item in result]
+
+
+class ComparisonCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES) -> None:
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self) -> str:
+        return (
+            f"ComparisonCache("
+            f"cache_dir={self.cache_dir}, "
+            f"entries={len(self.entries)}/{self.max_entries}, "
+            f"hits={self.hits}, "
+            f"misses={self.misses}"
+            f")"
+        )
+
+    def key(self, s1, s2, symbols):
+        identity = json.dumps([sentence_to_key(s1), sentence_to_key(s2), symbols], ensure_ascii=False)
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def compare(self, s1, s2, symbols, compute):
+        '''Get the comparison of two sentences, computing it with compute on a miss'''
+        def compute_many(pairs, symbols):
+            return [compute(p1, p2, symbols) for p1, p2 in pairs]
+
+        return self.compare_many([(s1, s2)], symbols, compute_many)[0]
+
+    def compare_many(self, pairs, symbols, compute_many):
+        '''Get the comparisons of (s1, s2) pairs, computing all misses with one call'''
+        keys = [self.key(s1, s2, symbols) for s1, s2 in pairs]
+        results = [self.get(key) for key in keys]
+
+        missing = [idx for idx, result in enumerate(results) if result is None]
+        self.hits += len(pairs) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            computed = compute_many([pairs[idx] for idx in missing], symbols)
+            for idx, result in zip(missing, computed):
+                self.put(keys[idx], result)
+                results[idx] = result
+
+        session_entries = _session_entries.get()
+        if session_entries is not None:
+            for key, result in zip(keys, results):
+                session_entries.setdefault(key, result)
+
+        # results are lists of tuples, a shallow copy protects the cached lists
+        return [list(result) for result in results]
+
+    def get(self, key):
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def session_path(self, session_key):
+        return os.path.join(self.cache_dir, f'{session_key}.json')
+
+    @contextmanager
+    def session(self, session_key):
+        '''
+        Persist the comparisons made inside the context for a session.
+
+        Comparisons saved by earlier requests of the session are loaded first,
+        and the file is rewritten on exit if new pairs were compared.
+        A session_key of None disables persistence.
+        '''
+        if session_key is None:
+            yield
+            return
+
+        session_entries = self.load_session(session_key)
+        loaded = len(session_entries)
+        token = _session_entries.set(session_entries)
+        try:
+            yield
+        finally:
+            _session_entries.reset(token)
+            if len(session_entries) > loaded:
+                self.save_session(session_key, session_entries)
+
+    def load_session(self, session_key):
+        path = self.session_path(session_key)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            print(f"ignore broken comparison cache {path}")
+            return {}
+
+        session_entries = {}
+        for key, result in data.items():
+            result = decode_result(result)
+            session_entries[key] = result
+            if self.get(key) is None:
+                self.put(key, result)
+        return session_entries
+
+    def save_session(self, session_key, session_entries):
+        path = self.session_path(session_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so readers never see a partial cache
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(session_entries, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+comparison_cache = ComparisonCache()
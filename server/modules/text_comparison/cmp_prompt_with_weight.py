@@ -1,5 +1,6 @@
 import os
 import sys
+from collections import defaultdict, deque
 
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -8,7 +9,8 @@ sys.path.append(current_dir)
 sys.path.append(server_dir)
 
 from myers.myers import diff as myers_diff
-from utils.tokenize import split_prompt_into_tokens
+from cmp_cache import comparison_cache
+from utils.tokenize import tokenize_prompt
 
 
 SYMBOLS = [".", ",", "?", "!", "\\"]
@@ -25,13 +27,22 @@ def compare_two_sentences(s1, s2, symbols=SYMBOLS):
             - word (str): the word
             - s1_idx (int): the index of the word in s1, -1 for not existing
             - s2_idx (int): the index of the word in s2, -1 for not existing
+
+    Results are memoized in comparison_cache.
     '''
-    if isinstance(s1, str):
-        t1 = split_prompt_into_tokens(s1, symbols)
-        t2 = split_prompt_into_tokens(s2, symbols)
-    else:
-        t1 = s1
-        t2 = s2
+    return comparison_cache.compare(s1, s2, symbols, _compare_two_sentences)
+
+
+def sentence_to_tokens(sentence, symbols=SYMBOLS):
+    '''Tokens of a prompt given as a string, or the given list of tokens'''
+    if isinstance(sentence, str):
+        return tokenize_prompt(sentence, symbols)
+    return sentence
+
+
+def _compare_two_sentences(s1, s2, symbols):
+    t1 = sentence_to_tokens(s1, symbols)
+    t2 = sentence_to_tokens(s2, symbols)
 
     tw1 = [item["text"] for item in t1]
     tw2 = [item["text"] for item in t2]
@@ -40,59 +51,53 @@ def compare_two_sentences(s1, s2, symbols=SYMBOLS):
 
     # calculate the idx of the words in the old and new sentences
     # -1 for not exist in the sentence
-    for idx, item in enumerate(cmp_res):
-        action, word = item
-        old_idx = -1
-        new_idx = -1
-
-        if action != "i":
-            old_idx = len(["" for w in cmp_res[:idx] if w[0] != "i"])
-        if action != "r":
-            new_idx = len(["" for w in cmp_res[:idx] if w[0] != "r"])
-
-        kir_result.append((action, word, (old_idx, new_idx)))
+    # removed words are indexed by word to pair them with inserted words
+    old_idx = 0
+    new_idx = 0
+    removed_ahead = defaultdict(deque) # removed words not reached yet
+    for action, word in cmp_res:
+        if action == "i":
+            kir_result.append((action, word, (-1, new_idx)))
+            new_idx += 1
+        elif action == "r":
+            removed_ahead[word].append(len(kir_result))
+            kir_result.append((action, word, (old_idx, -1)))
+            old_idx += 1
+        else:
+            kir_result.append((action, word, (old_idx, new_idx)))
+            old_idx += 1
+            new_idx += 1
 
     # find moved words
+    # an inserted word is paired with the next removal of the same word,
+    # or else with the first unpaired removal before it
     kirm_result = [] # k: keep, i: insert, r: remove, m: move
+    removed_behind = defaultdict(deque) # removed words already in the result
+    paired = set()
     for idx, item in enumerate(kir_result):
-        if item is None:
+        if idx in paired:
             continue
 
         action, word, indexes = item
         old_idx, new_idx = indexes
 
-        if action == "k" or word == ",":
+        if action == "r":
+            removed_ahead[word].popleft()
+            removed_behind[word].append(idx)
+        if action != "i" or word == ",":
+            kirm_result.append(item)
+            continue
+
+        if removed_ahead[word]:
+            sub_idx = removed_ahead[word].popleft()
+            paired.add(sub_idx)
+        elif removed_behind[word]:
+            sub_idx = removed_behind[word].popleft()
+        else:
             kirm_result.append(item)
             continue
-        if action == "i" or action == "r": # find if the same word is removed
-            flag = False
-            for sub_idx, sub_item in enumerate(kir_result[idx:]):
-                if sub_item is None:
-                    continue
-                sub_action, sub_word, sub_indexes = sub_item
-                sub_old_idx, sub_new_idx = sub_indexes
-                if sub_word != word:
-                    continue
-                if action == "i" and sub_action == "r":
-                    kirm_result.append(("m", word, (sub_old_idx, new_idx)))
-                    kir_result[idx + sub_idx] = None
-                    flag = True
-                    break
-            if not flag:
-                for sub_idx, sub_item in enumerate(kir_result[:idx]):
-                    if sub_item is None:
-                        continue
-                    sub_action, sub_word, sub_indexes = sub_item
-                    sub_old_idx, sub_new_idx = sub_indexes
-                    if sub_word != word:
-                        continue
-                    if action == "i" and sub_action == "r":
-                        kirm_result.append(("m", word, (sub_old_idx, new_idx)))
-                        kir_result[sub_idx] = None
-                        flag = True
-                        break
-            if not flag:
-                kirm_result.append(item)
+        sub_old_idx = kir_result[sub_idx][2][0]
+        kirm_result.append(("m", word, (sub_old_idx, new_idx)))
 
     # for matched words, compare the weight
     for idx, item in enumerate(kirm_result):
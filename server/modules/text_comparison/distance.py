@@ -0,0 +1,112 @@
+'''
+Pairwise edit distances between prompts.
+
+Only the upper triangle is compared. A pair is first bounded from below by the
+L1 distance of the token count vectors: every removed, inserted or moved word
+appears in the comparison at least as often as its count differs between the
+two prompts. Pairs whose bound exceeds max_dist are skipped without a diff, the
+remaining pairs are looked up in the comparison cache and the misses are
+diffed in a process pool.
+'''
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.spatial.distance import pdist, squareform
+
+from .cmp_prompt_with_weight import (
+    SYMBOLS, comparison_cache, sentence_to_tokens, _compare_two_sentences
+)
+
+DIFF_ACTIONS = ("r", "i", "m")
+MIN_PARALLEL_PAIRS = 256 # below this the pool costs more than it saves
+CHUNK_SIZE = 64
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _executor
+
+
+def count_distance(cmp_res, actions=DIFF_ACTIONS, ignore=()):
+    '''Number of compared words with a counted action, skipping ignored words'''
+    return sum(1 for item in cmp_res if item[0] in actions and item[1] not in ignore)
+
+
+def token_count_bounds(sentences, ignore=(), symbols=SYMBOLS):
+    '''Condensed lower bounds of the pairwise distances, in the order of pdist'''
+    counts = [Counter(token["text"] for token in sentence_to_tokens(sentence, symbols))
+              for sentence in sentences]
+    vocabulary = {}
+    for count in counts:
+        for word in count:
+            if word not in ignore:
+                vocabulary.setdefault(word, len(vocabulary))
+
+    matrix = np.zeros((len(sentences), max(len(vocabulary), 1)))
+    for row, count in enumerate(counts):
+        for word, cnt in count.items():
+            if word in vocabulary:
+                matrix[row, vocabulary[word]] = cnt
+
+    return pdist(matrix, "cityblock")
+
+
+def _compare_pairs(pairs, symbols):
+    return [_compare_two_sentences(s1, s2, symbols) for s1, s2 in pairs]
+
+
+def _compare_pairs_parallel(pairs, symbols):
+    if len(pairs) < MIN_PARALLEL_PAIRS:
+        return _compare_pairs(pairs, symbols)
+
+    chunks = [pairs[i:i + CHUNK_SIZE] for i in range(0, len(pairs), CHUNK_SIZE)]
+    results = []
+    for chunk_results in get_executor().map(_compare_pairs, chunks, [symbols] * len(chunks)):
+        results.extend(chunk_results)
+    return results
+
+
+def compare_pairs(pairs, symbols=SYMBOLS, parallel=True):
+    '''Compare (s1, s2) pairs, diffing the pairs missing in the cache in a process pool'''
+    compute_many = _compare_pairs_parallel if parallel else _compare_pairs
+    return comparison_cache.compare_many(pairs, symbols, compute_many)
+
+
+def distance_matrix(sentences, max_dist=None, actions=DIFF_ACTIONS, ignore=(),
+                    symbols=SYMBOLS, parallel=True):
+    '''
+    Symmetric matrix of pairwise edit distances
+
+    Args:
+        sentences: prompts as strings or token lists, as for compare_two_sentences
+        max_dist: pairs provably farther apart than this are not compared
+            and get np.inf, None compares all pairs
+        actions: comparison actions counted as a difference
+        ignore: words never counted as a difference
+
+    Returns:
+        an n x n float array with zeros on the diagonal
+    '''
+    n = len(sentences)
+    if n < 2:
+        return np.zeros((n, n))
+
+    bounds = token_count_bounds(sentences, ignore, symbols)
+    rows, cols = np.triu_indices(n, 1)
+
+    condensed = np.full(len(bounds), np.inf)
+    selected = np.arange(len(bounds))
+    if max_dist is not None:
+        selected = np.flatnonzero(bounds <= max_dist)
+
+    pairs = [(sentences[i], sentences[j]) for i, j in zip(rows[selected], cols[selected])]
+    results = compare_pairs(pairs, symbols, parallel)
+    condensed[selected] = [count_distance(result, actions, ignore) for result in results]
+
+    return squareform(condensed, checks=False)
@@ -0,0 +1,73 @@
+'''
+Incremental tokenization of the prompt history of a session.
+
+A session keeps the word lineage of its history and a version made of the
+number of prompts and a digest of their texts. Appending prompts to a known
+version only compares and links the new prompts. Phrase merging depends on all
+prompts, as a new prompt can prevent an earlier merge, so it runs over the
+whole lineage, and only the prompts whose result changed are returned.
+'''
+import json
+import hashlib
+from collections import OrderedDict
+
+from .lineage import WordLineage
+from .compare import merge_lineage
+
+MAX_SESSIONS = 64
+
+
+class TokenizeSession:
+    def __init__(self):
+        self.lineage = WordLineage()
+        self.digest = ''
+        self.serialized = [] # JSON of the prompts as last returned
+
+    def __str__(self) -> str:
+        return (
+            f"TokenizeSession("
+            f"version={self.version}"
+            f")"
+        )
+
+    @property
+    def version(self):
+        return f'{len(self.lineage.prompts)}-{self.digest[:16]}'
+
+    def append(self, prompts):
+        '''Add prompts to the history, returns the prompts whose result changed'''
+        for prompt in prompts:
+            self.lineage.append(prompt)
+            identity = f'{self.digest}\0{prompt["prompt"]}'
+            self.digest = hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+        result = merge_lineage(self.lineage.prompts)
+        serialized = [json.dumps(prompt) for prompt in result]
+        changed = [prompt for idx, prompt in enumerate(result)
+                   if idx >= len(self.serialized) or serialized[idx] != self.serialized[idx]]
+        self.serialized = serialized
+        return changed
+
+
+class TokenizeSessions:
+    '''The sessions tokenized recently, least recently used ones are dropped'''
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+
+    def get(self, session_key):
+        session = self.sessions.get(session_key)
+        if session is not None:
+            self.sessions.move_to_end(session_key)
+        return session
+
+    def reset(self, session_key):
+        session = TokenizeSession()
+        self.sessions[session_key] = session
+        self.sessions.move_to_end(session_key)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        return session
+
+
+tokenize_sessions = TokenizeSessions()
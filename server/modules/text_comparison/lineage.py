@@ -0,0 +1,94 @@
+'''
+Lineage of the words of consecutive prompts.
+
+Each prompt is compared with the previous one. Kept, removed and moved words
+are linked to the word of the previous prompt at their old position, and
+inserted words to the words with the same text in the latest earlier prompt
+that has any. Prompts can be appended one at a time: positions are looked up
+in a map of the previous prompt and texts in an index of the latest occurrence
+of every text, so linking a new prompt only costs its own words.
+'''
+from collections import defaultdict
+
+from .cmp_prompt_with_weight import compare_two_sentences
+
+
+class WordLineage:
+    def __init__(self):
+        self.prompts = []
+        # position in the last prompt -> words of the last prompt
+        self.last_positions = {}
+        # text -> words with the text in the latest prompt containing it
+        self.last_occurrences = {}
+
+    def __str__(self) -> str:
+        return (
+            f"WordLineage("
+            f"prompts={len(self.prompts)}, "
+            f"texts={len(self.last_occurrences)}"
+            f")"
+        )
+
+    def extend(self, prompts):
+        for prompt in prompts:
+            self.append(prompt)
+        return self.prompts
+
+    def append(self, prompt):
+        '''Compare a prompt with the last one and link its words, returns the new prompt'''
+        i = len(self.prompts)
+        pre = "" if i == 0 else self.prompts[-1]["text"]
+        cur = prompt["prompt"]
+
+        cmp_res = compare_two_sentences(pre, cur)
+        words = []
+        positions = defaultdict(list)
+
+        for idx, item in enumerate(cmp_res):
+            action, word, indexes, weights = item
+            pre_idx, cur_idx = indexes
+            pre_weight, cur_weight = weights
+            new_word = {
+                "id": f"{i}-{idx}",
+                "text": word,
+                "label": "[F]",
+                "action": action,
+                "pre_weight": pre_weight,
+                "cur_weight": cur_weight,
+                "prev": [],
+                "next": []
+            }
+            words.append(new_word)
+            positions[cur_idx].append(new_word)
+
+            # find previous words
+            if action in ["k", "r", "m"]: # kept or removed or moved from the last prompt
+                pre_words = self.last_positions.get(pre_idx, [])
+            elif action == "i": # inserted, find whether the word appeared in previous prompt words
+                pre_words = self.last_occurrences.get(word, [])
+            else:
+                pre_words = []
+
+            for pre_word in pre_words:
+                new_word["prev"].append({
+                    "id": pre_word["id"],
+                    "link": action
+                })
+                pre_word["next"].append({
+                    "id": new_word["id"],
+                    "link": action
+                })
+
+        self.last_positions = positions
+        occurrences = defaultdict(list)
+        for word in words:
+            occurrences[word["text"]].append(word)
+        self.last_occurrences.update(occurrences)
+
+        result_prompt = {
+            "id": i,
+            "text": cur,
+            "words": words,
+        }
+        self.prompts.append(result_prompt)
+        return result_prompt
@@ -7,6 +7,7 @@ Inspired by
 https://gist.github.com/adamnew123456/37923cf53f51d6b9af32a539cdfa7cc4
 """
 from __future__ import print_function
+from array import array
 import argparse
 
 KEEP, INSERT, REMOVE, OMIT = 'kiro'
@@ -45,11 +46,6 @@ def diff(a, b, context=None, format=None):
          used to format the diff entries.  Otherwise they are returned as-is.
     """
 
-    # print(len(a), len(b))
-
-    a = a[0:5000]
-    b = b[0:5000]
-
     diff = _myers(a, b)
 
     if context is not None:
@@ -66,41 +62,73 @@ def diff(a, b, context=None, format=None):
 
 
 def _myers(a, b):
-    front = {1: (0, [])}
-
-    for d in range(0, len(a) + len(b) + 1):
-        for k in range(-d, d + 1, 2):
-            go_down = k == -d or (k != d and front[k - 1][0] < front[k + 1][0])
-
-            if go_down:
-                old_x, history = front[k + 1]
-                x = old_x
+    # Forward pass: for each edit distance d keep only the furthest reaching x
+    # of every diagonal k in -d..d, stored compactly in trace[d][(k + d) // 2].
+    # The edit script is rebuilt afterwards by walking the trace backwards,
+    # making the same choices as the greedy algorithm.
+    n, m = len(a), len(b)
+
+    x = 0
+    while x < n and x < m and a[x] == b[x]:
+        x += 1
+    trace = [array('l', [x])]
+    if x >= n and x >= m:
+        return _backtrack(a, b, trace, 0)
+
+    for d in range(1, n + m + 1):
+        prev = trace[-1]
+        front = array('l', bytes(prev.itemsize * (d + 1)))
+        trace.append(front)
+        for i in range(d + 1):
+            # prev[i - 1] and prev[i] hold diagonals k - 1 and k + 1
+            k = 2 * i - d
+            if k == -d or (k != d and prev[i - 1] < prev[i]):
+                x = prev[i]
             else:
-                old_x, history = front[k - 1]
-                x = old_x + 1
+                x = prev[i - 1] + 1
             y = x - k
 
-            history = history[:]
-
-            if 1 <= y <= len(b) and go_down:
-                history.append((INSERT, b[y - 1]))
-            elif 1 <= x <= len(a):
-                history.append((REMOVE, a[x - 1]))
-
-            while x < len(a) and y < len(b) and a[x] == b[y]:
+            while x < n and y < m and a[x] == b[y]:
                 x += 1
                 y += 1
-                history.append((KEEP, a[x - 1]))
 
-            if x >= len(a) and y >= len(b):
-                return history
-
-            front[k] = x, history
+            front[i] = x
+            if x >= n and y >= m:
+                return _backtrack(a, b, trace, k)
 
     # TODO: is this possible to reach?
     raise ValueError('Unable to compute diff')
 
 
+def _backtrack(a, b, trace, k):
+    n, m = len(a), len(b)
+    history = []
+
+    for d in range(len(trace) - 1, 0, -1):
+        prev = trace[d - 1]
+        i = (k + d) // 2
+        go_down = k == -d or (k != d and prev[i - 1] < prev[i])
+        if go_down:
+            x = prev[i]
+        else:
+            x = prev[i - 1] + 1
+        y = x - k
+
+        # the snake, then the single insert or remove that led into it
+        history.extend((KEEP, a[j]) for j in range(trace[d][i] - 1, x - 1, -1))
+        if 1 <= y <= m and go_down:
+            history.append((INSERT, b[y - 1]))
+        elif 1 <= x <= n:
+            history.append((REMOVE, a[x - 1]))
+
+        k = k + 1 if go_down else k - 1
+
+    # the common prefix matched at d = 0
+    history.extend((KEEP, a[j]) for j in range(trace[0][0] - 1, -1, -1))
+    history.reverse()
+    return history
+
+
 def _compact(diff, context):
     queue = []
     results = []
@@ -0,0 +1,144 @@
+'''
+Merge phrases shared by all prompts into single words.
+
+A phrase is a run of at least two words of one prompt with the same action and
+no symbols. It can be merged if every prompt either contains it as a run of
+words with a common action, or has none of its words inserted, removed or
+moved. Merges are applied greedily in the order of the prompts and words, and
+each merge can enable a phrase that could not be merged before, so the search
+resumes after every merge.
+
+The search keeps an index from words to the prompts changing them, so only
+those prompts are checked for a phrase. Phrases that cannot be merged are
+remembered until a merge touches one of their words, and the search resumes
+from the first prompt containing a touched word instead of the beginning.
+'''
+from collections import defaultdict
+
+
+class PhraseMerger:
+    def __init__(self, prompts, symbols):
+        self.prompts = prompts
+        self.symbols = set(symbols)
+        # words are never modified, merged words are new dicts
+        self.sentences = [list(prompt["words"]) for prompt in prompts]
+
+        # word text -> {sentence index: count} of all words and of changed words
+        self.present = defaultdict(lambda: defaultdict(int))
+        self.changed = defaultdict(lambda: defaultdict(int))
+        for idx, sentence in enumerate(self.sentences):
+            self.index_sentence(idx, 1)
+
+        # phrases that cannot be merged, by the texts they contain
+        self.failed = set()
+        self.failed_by_text = defaultdict(set)
+
+    def index_sentence(self, idx, delta):
+        for word in self.sentences[idx]:
+            self.index_word(idx, word, delta)
+
+    def index_word(self, idx, word, delta):
+        text = word["text"]
+        self.update_count(self.present[text], idx, delta)
+        if word["action"] != "k":
+            self.update_count(self.changed[text], idx, delta)
+
+    @staticmethod
+    def update_count(counts, idx, delta):
+        counts[idx] += delta
+        if counts[idx] == 0:
+            del counts[idx]
+
+    def run(self):
+        start = 0
+        while True:
+            found = self.find_phrase(start)
+            if found is None:
+                break
+            print("successfully merged")
+            start = self.merge(found)
+
+        return [{
+            "id": prompt["id"],
+            "text": prompt["text"],
+            "words": words
+        } for prompt, words in zip(self.prompts, self.sentences)]
+
+    def find_phrase(self, start):
+        '''The first mergeable phrase in prompt and word order, from prompt start on'''
+        for words in self.sentences[start:]:
+            len_w = len(words)
+            for i, word in enumerate(words):
+                if word["text"] in self.symbols:
+                    continue
+                # phrases end before the last word of a prompt
+                for j in range(i + 2, len_w):
+                    last = words[j - 1]
+                    if last["text"] in self.symbols or last["action"] != word["action"]:
+                        break
+                    phrase = tuple(w["text"] for w in words[i:j])
+                    if phrase in self.failed:
+                        continue
+                    if self.can_merge(phrase):
+                        return phrase
+                    self.failed.add(phrase)
+                    for text in phrase:
+                        self.failed_by_text[text].add(phrase)
+        return None
+
+    def can_merge(self, phrase):
+        candidates = set()
+        for text in phrase:
+            candidates.update(self.changed[text])
+        return all(self.find_run(self.sentences[idx], phrase) >= 0 for idx in candidates)
+
+    @staticmethod
+    def find_run(sentence, phrase, start=0):
+        '''Index of the first run of phrase with a common action, -1 if none'''
+        first = phrase[0]
+        len_p = len(phrase)
+        for i in range(start, len(sentence) - len_p + 1):
+            if sentence[i]["text"] != first:
+                continue
+            action = sentence[i]["action"]
+            for j in range(1, len_p):
+                word = sentence[i + j]
+                if word["text"] != phrase[j] or word["action"] != action:
+                    break
+            else:
+                return i
+        return -1
+
+    def merge(self, phrase):
+        '''Merge phrase in all prompts and return the prompt to resume the search from'''
+        merged_text = " ".join(phrase)
+
+        for idx in list(self.present[phrase[0]]):
+            sentence = self.sentences[idx]
+            i = self.find_run(sentence, phrase)
+            while i >= 0:
+                for word in sentence[i:i + len(phrase)]:
+                    self.index_word(idx, word, -1)
+                first = sentence[i]
+                sentence[i] = {
+                    "id": first["id"],
+                    "text": merged_text,
+                    "label": first["label"],
+                    "action": first["action"],
+                    "pre_weight": first["pre_weight"],
+                    "cur_weight": first["cur_weight"],
+                    "prev": [],
+                    "next": first["next"]
+                }
+                del sentence[i + 1:i + len(phrase)]
+                self.index_word(idx, sentence[i], 1)
+                i = self.find_run(sentence, phrase, i + 1)
+
+        # phrases with a merged word or the new word may be mergeable now
+        touched = set(phrase)
+        touched.add(merged_text)
+        for text in touched:
+            for failed in self.failed_by_text.pop(text, ()):
+                self.failed.discard(failed)
+
+        return min(min(self.present[text], default=len(self.sentences)) for text in touched)
@@ -0,0 +1,115 @@
+'''
+Benchmark clustering images in /image/cluster.
+
+Clusters synthetic 2d projections of 1k to 100k images with exact ward and
+with the grid method. The threshold of every size is chosen between two merges
+of the tree so that it cuts the given number of clusters. Exact ward is
+skipped above --ward-limit points, as its condensed distance matrix alone
+takes 4 n^2 bytes. Agreement is the adjusted Rand index of the two results.
+Ward cuts between close merges are unstable, so the index of exact ward on
+points moved by 0.01 is shown as a baseline.
+
+Run from the server directory:
+    python tests/benchmark_cluster.py --points 1000 3000 10000 30000 100000
+'''
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from modules.cluster.cluster import compute_linkage, fcluster
+
+
+def make_projection(rng, points, blobs):
+    '''Points around blobs of different sizes and spreads'''
+    centers = rng.uniform(-10, 10, size=(blobs, 2))
+    spreads = rng.uniform(0.2, 1.5, size=blobs)
+    blob = rng.choice(blobs, size=points, p=rng.dirichlet(np.ones(blobs)))
+    return centers[blob] + rng.normal(size=(points, 2)) * spreads[blob, None]
+
+
+def cut_threshold(Z, clusters):
+    '''A distance that cuts the tree into the given number of clusters'''
+    return (Z[-clusters, 2] + Z[-clusters + 1, 2]) / 2
+
+
+def adjusted_rand_index(labels1, labels2):
+    _, a = np.unique(labels1, return_inverse=True)
+    _, b = np.unique(labels2, return_inverse=True)
+    _, counts = np.unique(a * (b.max() + 1) + b, return_counts=True)
+
+    def pairs(x):
+        x = np.asarray(x, dtype=np.float64)
+        return (x * (x - 1) / 2).sum()
+
+    index = pairs(counts)
+    rows, cols = pairs(np.bincount(a)), pairs(np.bincount(b))
+    expected = rows * cols / pairs([len(a)])
+    return (index - expected) / ((rows + cols) / 2 - expected)
+
+
+def timed(method, points):
+    start = time.perf_counter()
+    Z, leaves = compute_linkage(points, method)
+    return Z, leaves, time.perf_counter() - start
+
+
+def peak_memory(method, points):
+    tracemalloc.start()
+    compute_linkage(points, method)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def run(point_counts, blobs, clusters, ward_limit, memory, seed):
+    rng = np.random.default_rng(seed)
+
+    print(f"{'points':>8} {'ward (ms)':>10} {'grid (ms)':>10} {'ward (MB)':>10} "
+          f"{'grid (MB)':>10} {'ARI':>6} {'jitter ARI':>11}")
+    for num_points in point_counts:
+        points = make_projection(rng, num_points, blobs)
+
+        grid_Z, grid_leaves, grid_elapsed = timed('grid', points)
+        ward_str = mem_str = ari_str = jitter_str = f"{'-':>10}"
+        grid_mem_str = f"{'-':>10}"
+        if memory:
+            grid_mem_str = f"{peak_memory('grid', points):10.1f}"
+
+        if num_points <= ward_limit:
+            ward_Z, _, ward_elapsed = timed('ward', points)
+            threshold = cut_threshold(ward_Z, clusters)
+            ward_labels = fcluster(ward_Z, t=threshold, criterion='distance')
+            grid_labels = fcluster(grid_Z, t=threshold, criterion='distance')[grid_leaves]
+            ward_str = f'{ward_elapsed * 1000:10.1f}'
+            ari_str = f'{adjusted_rand_index(ward_labels, grid_labels):6.3f}'
+
+            jittered = points + rng.normal(scale=0.01, size=points.shape)
+            jitter_Z, _, _ = timed('ward', jittered)
+            jitter_labels = fcluster(jitter_Z, t=threshold, criterion='distance')
+            jitter_str = f'{adjusted_rand_index(ward_labels, jitter_labels):11.3f}'
+            if memory:
+                mem_str = f"{peak_memory('ward', points):10.1f}"
+
+        print(f'{num_points:8d} {ward_str} {grid_elapsed * 1000:10.1f} {mem_str} '
+              f'{grid_mem_str} {ari_str:>6} {jitter_str:>11}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+', default=[1000, 3000, 10000, 30000, 100000])
+    parser.add_argument('--blobs', type=int, default=12)
+    parser.add_argument('--clusters', type=int, default=12, help='clusters cut by exact ward')
+    parser.add_argument('--ward-limit', type=int, default=10000,
+                        help='skip exact ward above this many points')
+    parser.add_argument('--memory', action='store_true', help='also measure peak memory')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.points, args.blobs, args.clusters, args.ward_limit, args.memory, args.seed)
@@ -0,0 +1,295 @@
+'''
+Benchmark deriving edges in /compute/edge_derive.
+
+Compares the columnar derive with the previous implementation, which built one
+dict per changed word and image pair and searched all edges for the changes of
+every edge group, on synthetic sessions of growing length. Both must produce
+the same edges and edge groups. The cluster edges of derive_clusters, expanded
+to image pairs, must match the edges of derive up to floating point rounding,
+except for the image pairs where that rounding decides a merge.
+
+Run from the server directory:
+    python tests/benchmark_derive.py --prompts 25 50 100 200
+'''
+import os
+import sys
+import time
+import random
+import argparse
+import contextlib
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from modules.edge_derivation.derive import cmp_prompts, derive, derive_clusters, get_prompt_pairs
+
+
+def legacy_generate_original_edges(prompts, pairs, img_cluster, image_indexes):
+    edges = []
+
+    for i, j in pairs:
+        images1 = image_indexes[i]
+        images2 = image_indexes[j]
+
+        diff_words = cmp_prompts(prompts[i], prompts[j])
+
+        for diff in diff_words:
+            for idx1 in images1:
+                for idx2 in images2:
+                    sum_weight = 1
+                    edge = {
+                        "word": diff[1],
+                        "action": diff[0],
+                        "src": idx1,
+                        "tgt": idx2,
+                        "src_clu": img_cluster[idx1],
+                        "tgt_clu": img_cluster[idx2],
+                        "src_pmt": i,
+                        "tgt_pmt": j,
+                        "ratio": len(images1) * len(images2),
+                        "weight": sum_weight / (len(diff_words) * len(images1) * len(images2))
+                    }
+                    edges.append(edge)
+
+    return edges
+
+
+def legacy_edge_to_key(edge):
+    word = edge["word"]
+    action = edge["action"]
+    src_clu = edge["src_clu"]
+    tgt_clu = edge["tgt_clu"]
+    return (word, action, src_clu, tgt_clu)
+
+
+def legacy_bundle_edges(edges):
+    edge_dict = {}
+
+    for edge in edges:
+        weight = edge["weight"]
+        key = legacy_edge_to_key(edge)
+        if key not in edge_dict:
+            edge_dict[key] = 0
+        edge_dict[key] += weight
+
+    return edge_dict
+
+
+def legacy_update_weight(edges, weights):
+    new_edges = []
+
+    image_pairs = {}
+    for idx, edge in enumerate(edges):
+        src = edge["src"]
+        tgt = edge["tgt"]
+        key = (src, tgt)
+        if key not in image_pairs:
+            image_pairs[key] = []
+        image_pairs[key].append(idx)
+
+    for key, idxs in image_pairs.items():
+        sum_weight = 0
+        for idx in idxs:
+            key = legacy_edge_to_key(edges[idx])
+            sum_weight += weights[key]
+        for idx in idxs:
+            edge = edges[idx]
+            key = legacy_edge_to_key(edge)
+            edge["weight"] = weights[key] / (sum_weight * edge["ratio"])
+            new_edges.append(edge)
+
+    new_edge_dict = legacy_bundle_edges(new_edges)
+    return new_edges, new_edge_dict
+
+
+def legacy_merge_edges(edges):
+    same_src_tgt_weight_edges = {}
+    for edge in edges:
+        src = edge["src"]
+        tgt = edge["tgt"]
+        weight = edge["weight"]
+        weight = round(weight, 3)
+        key = (src, tgt, weight)
+        if key not in same_src_tgt_weight_edges:
+            same_src_tgt_weight_edges[key] = []
+        same_src_tgt_weight_edges[key].append(edge)
+    new_edges = []
+    for key, value in same_src_tgt_weight_edges.items():
+        changes = [{
+            "word": edge["word"],
+            "action": edge["action"],
+        } for edge in value]
+
+        new_edge = {
+            "word": " ".join([change["word"] for change in changes]),
+            "action": value[0]["action"],
+            "changes": changes,
+            "src": value[0]["src"],
+            "tgt": value[0]["tgt"],
+            "src_clu": value[0]["src_clu"],
+            "tgt_clu": value[0]["tgt_clu"],
+            "src_pmt": value[0]["src_pmt"],
+            "tgt_pmt": value[0]["tgt_pmt"],
+            "ratio": value[0]["ratio"],
+            "weight": min(value[0]["weight"] * len(value), 1.0),
+        }
+        new_edges.append(new_edge)
+    return new_edges
+
+
+def legacy_derive(prompts, prompt_pairs, image_clusters, image_indices):
+    '''The previous implementation, kept here for reference'''
+    original_edges = legacy_generate_original_edges(prompts, prompt_pairs, image_clusters, image_indices)
+    normalized_edges = original_edges
+    bundled_edges = legacy_bundle_edges(normalized_edges)
+    new_edges, new_weights = legacy_update_weight(original_edges, bundled_edges)
+    new_edges = legacy_merge_edges(new_edges)
+    new_weights = legacy_bundle_edges(new_edges)
+    new_edges, new_weights = legacy_update_weight(new_edges, new_weights)
+
+    new_weights = sorted(new_weights.items(), key=lambda x: x[1], reverse=True)
+
+    edge_groups = []
+    for key, value in new_weights:
+        for edge in new_edges:
+            if edge["word"] ==  key[0] and edge["action"] == key[1] and \
+                edge["src_clu"] == key[2] and edge["tgt_clu"] == key[3]:
+                changes = edge["changes"]
+                break
+        edge_groups.append({
+            "word": key[0],
+            "changes": changes,
+            "action": key[1],
+            "src_clu": key[2],
+            "tgt_clu": key[3],
+            "weight": value
+        })
+
+    return new_edges, edge_groups
+
+
+WORDS = ['a', 'cat', 'castle', 'fox', 'lighthouse', 'oil', 'painting', 'watercolor',
+         'detailed', 'artstation', 'golden', 'hour', 'sharp', 'focus', 'fog', 'render', ',']
+
+
+def make_session(rng, prompts, images_per_prompt, clusters):
+    '''Tokenized prompts written by editing the previous prompt, with clustered images'''
+    tokens = [rng.choice(WORDS) for _ in range(8)]
+    session = []
+    image_indices = []
+    for i in range(prompts):
+        for _ in range(rng.randint(1, 3)):
+            r = rng.random()
+            if r < 0.4:
+                tokens.insert(rng.randrange(len(tokens) + 1), rng.choice(WORDS))
+            elif r < 0.7 and len(tokens) > 4:
+                tokens.pop(rng.randrange(len(tokens)))
+            else:
+                tokens[rng.randrange(len(tokens))] = rng.choice(WORDS)
+        session.append({'words': [{'text': token, 'weight': 1} for token in tokens]})
+        image_indices.append([f'{i}-{k}' for k in range(images_per_prompt)])
+
+    image_clusters = {idx: rng.randint(1, clusters) for indexes in image_indices for idx in indexes}
+    return session, image_indices, image_clusters
+
+
+def expand_cluster_edges(cluster_edges, image_clusters, image_indices):
+    '''Image edges of cluster edges, as the client expands them'''
+    edges = []
+    for edge in cluster_edges:
+        for src in image_indices[edge['src_pmt']]:
+            if image_clusters[src] != edge['src_clu']:
+                continue
+            for tgt in image_indices[edge['tgt_pmt']]:
+                if image_clusters[tgt] == edge['tgt_clu']:
+                    edges.append({**edge, 'src': src, 'tgt': tgt})
+    return edges
+
+
+def image_pair_edges(edges):
+    pair_edges = {}
+    for edge in edges:
+        pair_edges.setdefault((edge['src'], edge['tgt']), []).append(edge)
+    return pair_edges
+
+
+def compare_cluster_edges(edges, cluster_edges):
+    '''
+    Image pairs whose edges differ between derive and the expanded cluster
+    edges, and the largest relative difference of the other weights
+
+    A weight within rounding error of a tie at 3 digits can be merged with
+    other edges by one and not by the other, which also shifts the weights of
+    the bundles of the merged words.
+    '''
+    def key(edge):
+        return (edge['word'], edge['action'], edge['src_pmt'], edge['tgt_pmt'], edge['ratio'])
+
+    pair_edges = image_pair_edges(edges)
+    pair_cluster_edges = image_pair_edges(cluster_edges)
+    assert pair_edges.keys() == pair_cluster_edges.keys()
+
+    flips = 0
+    max_diff = 0
+    for pair, edges in pair_edges.items():
+        edges = sorted(edges, key=key)
+        cluster_edges = sorted(pair_cluster_edges[pair], key=key)
+        if [key(edge) for edge in edges] != [key(edge) for edge in cluster_edges]:
+            flips += 1
+            continue
+        for edge, cluster_edge in zip(edges, cluster_edges):
+            assert edge['changes'] == cluster_edge['changes']
+            diff = abs(edge['weight'] - cluster_edge['weight']) / edge['weight']
+            max_diff = max(max_diff, diff)
+    return flips, max_diff
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(None):
+        result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(prompt_counts, images_per_prompt, clusters, legacy_limit, seed):
+    rng = random.Random(seed)
+
+    print(f"{'prompts':>8} {'pairs':>6} {'edges':>7} {'derive (ms)':>12} "
+          f"{'clusters (ms)':>14} {'tie flips':>10} {'max diff':>9} {'legacy (ms)':>12}")
+    for prompts in prompt_counts:
+        session, image_indices, image_clusters = make_session(
+            rng, prompts, images_per_prompt, clusters)
+        pairs = get_prompt_pairs(session)
+        # compare the pairs once, so both sides find them in the comparison cache
+        edges = sum(len(cmp_prompts(session[i], session[j])) for i, j in pairs)
+        edges *= images_per_prompt ** 2
+
+        result, elapsed = timed(derive, session, pairs, image_clusters, image_indices)
+        cluster_result, cluster_elapsed = timed(
+            derive_clusters, session, pairs, image_clusters, image_indices)
+        flips, max_diff = compare_cluster_edges(
+            result[0], expand_cluster_edges(cluster_result[0], image_clusters, image_indices))
+        assert flips > 0 or max_diff < 1e-9
+
+        legacy_str = f"{'-':>12}"
+        if prompts <= legacy_limit:
+            legacy_result, legacy_elapsed = timed(
+                legacy_derive, session, pairs, image_clusters, image_indices)
+            assert legacy_result == result
+            legacy_str = f'{legacy_elapsed * 1000:12.1f}'
+
+        print(f'{prompts:8d} {len(pairs):6d} {edges:7d} {elapsed * 1000:12.1f} '
+              f'{cluster_elapsed * 1000:14.1f} {flips:10d} {max_diff:9.1e} {legacy_str}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--prompts', type=int, nargs='+', default=[25, 50, 100, 200])
+    parser.add_argument('--images', type=int, default=4, help='images per prompt')
+    parser.add_argument('--clusters', type=int, default=8)
+    parser.add_argument('--legacy-limit', type=int, default=100,
+                        help='skip the previous implementation above this many prompts')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.prompts, args.images, args.clusters, args.legacy_limit, args.seed)
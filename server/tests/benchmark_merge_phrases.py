@@ -0,0 +1,198 @@
+'''
+Benchmark merging shared phrases in /prompt/tokenize.
+
+Compares PhraseMerger with the previous merge_phrases, which deep-copied all
+prompts and restarted the search from the first prompt after every merge, on
+synthetic sessions of growing length. Both must produce the same prompts.
+
+Run from the server directory:
+    python tests/benchmark_merge_phrases.py --prompts 25 50 100 200
+'''
+import os
+import sys
+import copy
+import time
+import random
+import argparse
+import contextlib
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from modules.text_comparison.compare import SYMBOLS, calculate_consecutive_editing
+from modules.text_comparison.phrase_merge import PhraseMerger
+
+
+def legacy_merge_phrases(prompts, symbols=SYMBOLS):
+    '''The previous implementation, kept here for reference'''
+    result_prompts = []
+
+    def merge_phrase(phrase, word_array):
+        result = []
+        def sentence_contains_phrase(sentence, phrase):
+            for i in range(len(sentence) - len(phrase) + 1):
+                segment = sentence[i:i+len(phrase)]
+                flag = True
+                for j, seg in enumerate(segment):
+                    if seg["text"] != phrase[j]["text"]:
+                        flag = False
+                if flag:
+                    action = segment[0]["action"]
+                    for _, seg in enumerate(segment):
+                        if seg["action"] != action:
+                            flag = False
+                if flag:
+                    return True
+            phrase_texts = [word["text"] for word in phrase]
+            for words in sentence:
+                if words["action"] != "k" and words["text"] in phrase_texts:
+                    return False
+            return True
+
+        def merge(sentence, phrase):
+            def apply(sentence):
+                len_s = len(sentence)
+                len_p = len(phrase)
+
+                for i in range(len_s - len_p + 1):
+                    segment = sentence[i:i+len_p]
+                    flag = True
+                    for j, seg in enumerate(segment):
+                        if seg["text"] != phrase[j]["text"]:
+                            flag = False
+                            break
+                    action = segment[0]["action"]
+                    for _, seg in enumerate(segment):
+                        if seg["action"] != action:
+                            flag = False
+                            break
+                    if not flag:
+                        continue
+                    new_word = {
+                        "id": segment[0]["id"],
+                        "text": " ".join([word["text"] for word in segment]),
+                        "label": segment[0]["label"],
+                        "action": action,
+                        "pre_weight": segment[0]["pre_weight"],
+                        "cur_weight": segment[0]["cur_weight"],
+                        "prev": [],
+                        "next": segment[0]["next"]
+                    }
+                    sentence[i] = new_word
+                    del sentence[i+1:i+len_p]
+                    return True, sentence
+                return False, sentence
+            flag, sentence = apply(sentence)
+            while flag:
+                flag, sentence = apply(sentence)
+            return sentence
+
+        for words in word_array:
+            if not sentence_contains_phrase(words, phrase):
+                return False, word_array
+
+        for words in word_array:
+            words = merge(words, phrase)
+            result.append(words)
+
+        return True, result
+
+    def apply(_prompts):
+        prompts = copy.deepcopy(_prompts)
+        word_array = [prompt["words"] for prompt in prompts]
+        for words in word_array:
+            len_w = len(words)
+            for i, word in enumerate(words):
+                for j in range(i+2, len_w):
+                    if j >= len_w:
+                        break
+                    phrase = words[i:j]
+                    flag = True
+                    for _, phrase_word in enumerate(phrase):
+                        if phrase_word["text"] in symbols:
+                            flag = False
+                            break
+                        if phrase_word["action"] != word["action"]:
+                            flag = False
+                            break
+                    if not flag:
+                        break
+                    flag, result = merge_phrase(phrase, word_array)
+                    if flag:
+                        result = [{
+                            "id": prompt["id"],
+                            "text": prompt["text"],
+                            "words": words
+                        } for prompt, words in zip(_prompts, result)]
+
+                        return True, result
+        return False, _prompts
+
+    flag, result_prompts = apply(prompts)
+    while flag:
+        flag, result_prompts = apply(result_prompts)
+    return result_prompts
+
+
+SUBJECTS = ['a cat', 'an old castle', 'a red fox', 'a lighthouse']
+STYLES = ['oil painting', 'by greg rutkowski', 'studio ghibli style', 'watercolor']
+DETAILS = ['highly detailed', 'trending on artstation', 'golden hour lighting',
+           'sharp focus', 'volumetric fog', 'octane render', '8k resolution']
+
+
+def make_session(rng, prompts):
+    '''Prompts written by repeatedly editing clauses of the previous prompt'''
+    clauses = [rng.choice(SUBJECTS), rng.choice(STYLES), rng.choice(DETAILS)]
+    session = []
+    for _ in range(prompts):
+        r = rng.random()
+        if r < 0.3:
+            clauses.insert(rng.randrange(len(clauses) + 1), rng.choice(DETAILS))
+        elif r < 0.5 and len(clauses) > 2:
+            clauses.pop(rng.randrange(1, len(clauses)))
+        elif r < 0.7:
+            clauses[0] = rng.choice(SUBJECTS)
+        elif r < 0.9:
+            idx = rng.randrange(len(clauses))
+            clauses[idx] = rng.choice(STYLES + DETAILS)
+        else:
+            rng.shuffle(clauses)
+        session.append({'prompt': ', '.join(clauses)})
+    return session
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(None):
+        result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(prompt_counts, legacy_limit, seed):
+    rng = random.Random(seed)
+
+    print(f"{'prompts':>8} {'words':>6} {'merger (ms)':>12} {'legacy (ms)':>12}")
+    for prompts in prompt_counts:
+        tokenized = calculate_consecutive_editing(make_session(rng, prompts))
+        words = sum(len(prompt['words']) for prompt in tokenized)
+
+        result, elapsed = timed(lambda p: PhraseMerger(p, SYMBOLS).run(), tokenized)
+
+        legacy_str = f"{'-':>12}"
+        if prompts <= legacy_limit:
+            legacy_result, legacy_elapsed = timed(legacy_merge_phrases, copy.deepcopy(tokenized))
+            assert legacy_result == result
+            legacy_str = f'{legacy_elapsed * 1000:12.1f}'
+
+        print(f'{prompts:8d} {words:6d} {elapsed * 1000:12.1f} {legacy_str}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--prompts', type=int, nargs='+', default=[10, 25, 50, 100, 200])
+    parser.add_argument('--legacy-limit', type=int, default=100,
+                        help='skip the previous implementation above this many prompts')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.prompts, args.legacy_limit, args.seed)
@@ -0,0 +1,137 @@
+'''
+Benchmark the Myers diff used by the prompt comparison.
+
+Compares the trace based implementation in myers.py with the previous one,
+which copied the whole edit history for every diagonal at every edit
+distance, on long and heavily edited prompts. Both must produce the same
+edit script.
+
+Run from the server directory:
+    python tests/benchmark_myers.py --tokens 200 500 1000 2000
+'''
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(cur_dir), 'modules', 'text_comparison'))
+
+from myers import myers
+
+KEEP, INSERT, REMOVE = myers.KEEP, myers.INSERT, myers.REMOVE
+
+
+def legacy_myers(a, b):
+    '''The previous implementation, kept here for reference'''
+    front = {1: (0, [])}
+
+    for d in range(0, len(a) + len(b) + 1):
+        for k in range(-d, d + 1, 2):
+            go_down = k == -d or (k != d and front[k - 1][0] < front[k + 1][0])
+
+            if go_down:
+                old_x, history = front[k + 1]
+                x = old_x
+            else:
+                old_x, history = front[k - 1]
+                x = old_x + 1
+            y = x - k
+
+            history = history[:]
+
+            if 1 <= y <= len(b) and go_down:
+                history.append((INSERT, b[y - 1]))
+            elif 1 <= x <= len(a):
+                history.append((REMOVE, a[x - 1]))
+
+            while x < len(a) and y < len(b) and a[x] == b[y]:
+                x += 1
+                y += 1
+                history.append((KEEP, a[x - 1]))
+
+            if x >= len(a) and y >= len(b):
+                return history
+
+            front[k] = x, history
+
+    raise ValueError('Unable to compute diff')
+
+
+VOCABULARY = [
+    'a', 'photo', 'of', 'cat', 'dog', 'sitting', 'on', 'the', 'beach', 'at',
+    'sunset', 'highly', 'detailed', 'masterpiece', 'best', 'quality', '8k',
+    'oil', 'painting', 'by', 'greg', 'rutkowski', 'trending', 'artstation',
+    ',', '(', ')', ':', '1.2', 'cinematic', 'lighting', 'portrait', 'red',
+]
+
+
+def make_prompt_pair(rng, tokens, edit_ratio):
+    a = [rng.choice(VOCABULARY) for _ in range(tokens)]
+    b = []
+    for token in a:
+        r = rng.random()
+        if r < edit_ratio / 3:
+            continue  # remove
+        if r < edit_ratio * 2 / 3:
+            b.append(rng.choice(VOCABULARY))  # replace
+        elif r < edit_ratio:
+            b.extend([token, rng.choice(VOCABULARY)])  # insert
+        else:
+            b.append(token)
+    return a, b
+
+
+def measure(func, a, b):
+    start = time.perf_counter()
+    result = func(a, b)
+    elapsed = time.perf_counter() - start
+
+    # memory is traced in a separate run, tracing slows down the diff
+    tracemalloc.start()
+    func(a, b)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def check_equivalence(rng, rounds):
+    for _ in range(rounds):
+        a, b = make_prompt_pair(rng, rng.randint(0, 40), rng.random())
+        assert myers._myers(a, b) == legacy_myers(a, b), (a, b)
+    print(f'{rounds} random pairs: identical edit scripts')
+
+
+def run(token_counts, edit_ratio, legacy_limit, seed):
+    rng = random.Random(seed)
+    check_equivalence(rng, 2000)
+
+    print(f"{'tokens':>8} {'edits':>6} {'trace (ms)':>11} {'trace (MB)':>11} "
+          f"{'legacy (ms)':>12} {'legacy (MB)':>12}")
+    for tokens in token_counts:
+        a, b = make_prompt_pair(rng, tokens, edit_ratio)
+        result, elapsed, peak = measure(myers._myers, a, b)
+        edits = sum(1 for action, _ in result if action != KEEP)
+
+        legacy_str = f"{'-':>12} {'-':>12}"
+        if tokens <= legacy_limit:
+            legacy_result, legacy_elapsed, legacy_peak = measure(legacy_myers, a, b)
+            assert legacy_result == result
+            legacy_str = f'{legacy_elapsed * 1000:12.1f} {legacy_peak / 2 ** 20:12.2f}'
+
+        print(f'{tokens:8d} {edits:6d} {elapsed * 1000:11.1f} {peak / 2 ** 20:11.2f} {legacy_str}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tokens', type=int, nargs='+', default=[100, 200, 500, 1000, 2000, 5000])
+    parser.add_argument('--edit-ratio', type=float, default=0.5,
+                        help='fraction of tokens removed, replaced or followed by an insertion')
+    parser.add_argument('--legacy-limit', type=int, default=2000,
+                        help='skip the previous implementation above this many tokens')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.tokens, args.edit_ratio, args.legacy_limit, args.seed)
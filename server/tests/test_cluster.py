@@ -13,3 +13,9 @@ payload = {
 
 response = requests.post(url=f'{URL_HOST}/image/cluster', json=payload)
 print(response.json())
+
+# the same embeddings at another threshold reuse the linkage, with the tree for local cuts
+payload['threshold'] = 0.1
+payload['tree'] = True
+response = requests.post(url=f'{URL_HOST}/image/cluster', json=payload)
+print(response.json())
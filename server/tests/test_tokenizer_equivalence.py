@@ -0,0 +1,186 @@
+'''
+Equivalence of the tokenizer with its previous implementation.
+
+Run from the server directory:
+    python -m pytest tests/test_tokenizer_equivalence.py
+'''
+import os
+import sys
+import random
+from unittest import TestCase
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+from utils import tokenize
+
+
+# previous implementation, kept as the reference
+
+SYMBOLS = [".", ",", "?", "!", "\\"]
+
+
+def legacy_split_into_tokens(text):
+    text = text.replace('|', '||ææææ||')  # use | as delimiter
+    text = text.replace('\n', '||').replace(' ', '||')
+
+    symbols = ['.', ',', ';', ':', '?', '!']
+    # [ '-', '_', '/', '\\', '(', ')', '[', ']', '{', '}',
+    #             '*', '#', '@', '&', '=', '+', '%', '~', '$', '^', '<', '>', '"',
+    #            '´', '`', '¸', '˛', '’',
+    #            '¤', '₳', '฿', '₵', '¢', '₡', '₢', '₫', '₯', '֏', '₠', '€', 'ƒ', '₣', '₲', '₴', '₭',
+    #            '₺', '₾', 'ℳ', '₥', '₦', '₧', '₱', '₰', '£', '៛', '₽', '₹', '₨', '₪', '৳', '₸', '₮',
+    #            '₩', '¥', '§', '‖', '¦', '⟨', '⟩', '–', '—', '¯', '»', '«', '”', '÷', '×', '′', '″',
+    #            '‴', '¡', '¿', '©', '℗', '®', '℠', '™']
+
+    for c in symbols:
+        text = text.replace(c, '||{}||'.format(c))
+
+    # re-construct some special character groups as they are tokens
+    text = text.replace('[||||[', '[[').replace(']||||]', ']]')
+    text = text.replace('{||||{', '{{').replace('}||||}', '}}')
+    text = text.replace('<||||!||||-||||-||', '||<!--||').replace('||-||||-||||>', '||-->||')
+
+    while '||||' in text:
+        text = text.replace('||||', '||')
+
+    tokens = filter(lambda a: a != '', text.split('||'))  # filter empty strings
+    tokens = ['|' if w == 'ææææ' else w for w in tokens]  # insert back the |s
+    return tokens
+
+
+def legacy_split_prompt_into_tokens(prompt, symbols = SYMBOLS):
+    sentences = legacy_split_prompt_into_sentences(prompt)
+    tokens = []
+    for sentence in sentences:
+        tokens += legacy_split_sentence_into_tokens(sentence, symbols)
+    return tokens
+
+
+def legacy_split_prompt_into_sentences(prompt):
+    sentences = prompt.split(";")
+    sentences = [s.strip() for s in sentences]
+    return sentences
+
+
+def legacy_split_sentence_into_tokens(sentence, symbols=SYMBOLS):
+    weight = 1.0
+    sd_weight_map = {"(": 1.1, ")": 1.1, "[": 0.9, "]": 0.9}
+
+    # for disco prompt, weight is after ":"
+    if ":" in sentence:
+        segments = sentence.split(":")
+        assert len(segments) == 2
+        sentence, weight = segments
+        weight = float(weight)
+
+    sentence = sentence.replace(" ", "||")
+    for symbol in symbols:
+        sentence = sentence.replace(symbol, f"||{symbol}||")
+
+    tokens = filter(lambda x: x != "", sentence.split("||"))
+    tokens = list(tokens)
+
+    stack = []
+    tokens_with_weight = [{}] * len(tokens)
+
+    for idx, token in enumerate(tokens):
+        if token[0] not in "([" and token[-1] not in ")]" and len(stack) == 0:
+            tokens_with_weight[idx] = {
+                "text": token,
+                "text_original": token,
+                "weight": weight,
+            }
+            continue
+        stack.append((idx, token))
+        if token[-1] in ")]":
+            assert len(stack) > 0
+            cnt = 0
+            for i in range(len(token) - 1, -1, -1):
+                if token[i] == token[-1]:
+                    cnt += 1
+                else:
+                    break
+            token_weight = weight * pow(sd_weight_map[token[-1]], cnt)
+            while True:
+                try:
+                    top_idx, top = stack.pop()
+                    tokens_with_weight[top_idx] = {
+                        "text": top.strip("()[]"),
+                        "text_original": top,
+                        "weight": token_weight,
+                    }
+                    if top[0] in "([":
+                        break
+                except:
+                    break
+
+    return tokens_with_weight
+
+
+PROMPTS = [
+    "",
+    "a photo of a cat",
+    "The octopus spaceship in the green fields of england comes to save us, 90s, romantism Caspar David Friedrich and chris foss contemplative:2; signature signed watermark:-1",
+    "((masterpiece)), best quality, [blurry], (red:1.2) hair",
+    "a (very (nested) group) here; [[faded]] edges",
+    "a cat). b (dog",
+    "a)  ]b  (c  [d ] ).",
+    "trailing space ; ;; semi;colons ",
+    "dots... and? bangs! back\\slash",
+    "pipes | in a||b text|",
+    "newlines\nand\ttabs",
+]
+
+ALPHABET = "ab  ().[],;:!?\\|\n<>-{}æ"
+
+
+def random_texts(seed, count=3000, max_length=24):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+
+def outcome(func, *args):
+    try:
+        return func(*args)
+    except (AssertionError, ValueError) as e:
+        return type(e)
+
+
+class TestTokenizerEquivalence(TestCase):
+    def test_split_into_tokens(self):
+        for text in PROMPTS + list(random_texts(0)):
+            assert tokenize.split_into_tokens(text) == legacy_split_into_tokens(text), text
+
+    def test_special_groups(self):
+        for text in ["[  [x", "a]\n ]", "{  {  {", "} \n}", "< ! -  -", "<\n! -  -.", "a -  -  >", "x. -  -  > y"]:
+            assert tokenize.split_into_tokens(text) == legacy_split_into_tokens(text), text
+
+    def test_split_sentence_into_tokens(self):
+        for text in PROMPTS + list(random_texts(1)):
+            expected = outcome(legacy_split_sentence_into_tokens, text)
+            assert outcome(tokenize.split_sentence_into_tokens, text) == expected, text
+
+    def test_split_prompt_into_tokens(self):
+        for text in PROMPTS + list(random_texts(2)):
+            expected = outcome(legacy_split_prompt_into_tokens, text)
+            assert outcome(tokenize.split_prompt_into_tokens, text) == expected, text
+
+    def test_other_symbols(self):
+        for symbols in [[], [","], ["by", "|", "."], [".", "."]]:
+            for text in PROMPTS + ["baby by the sea.by|the,way"]:
+                expected = outcome(legacy_split_prompt_into_tokens, text, symbols)
+                assert outcome(tokenize.split_prompt_into_tokens, text, symbols) == expected, text
+
+    def test_cached_tokens_are_immutable(self):
+        tokens = tokenize.tokenize_prompt(PROMPTS[4])
+        assert tokenize.tokenize_prompt(PROMPTS[4]) is tokens
+        assert isinstance(tokens, tuple)
+        with self.assertRaises(TypeError):
+            tokens[0]["weight"] = 2
+
+        # the list returned by split_prompt_into_tokens is a copy
+        copied = tokenize.split_prompt_into_tokens(PROMPTS[4])
+        copied[0]["weight"] = 2
+        assert tokens[0]["weight"] != 2
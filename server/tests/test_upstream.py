@@ -0,0 +1,102 @@
+'''
+Connection reuse and aborts of the upstream client, against a fake diffusion app.
+
+Run from the server directory:
+    python -m pytest tests/test_upstream.py
+'''
+import os
+import sys
+import json
+import socket
+import asyncio
+from unittest import TestCase, mock
+
+import tornado.web
+import tornado.httpserver
+from tornado.testing import bind_unused_port
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(cur_dir))
+
+import app
+from utils import upstream
+
+
+class FakeDiffusion(tornado.web.Application):
+    '''Answers /login at once and /fetch/log after a delay, recording its connections'''
+    def __init__(self):
+        self.connections = set()
+        self.started = asyncio.Event()
+        self.closed = asyncio.Event()
+        fake = self
+
+        class Handler(tornado.web.RequestHandler):
+            async def post(self, route):
+                fake.connections.add(id(self.request.connection.stream))
+                fake.started.set()
+                if route == 'fetch/log':
+                    await asyncio.sleep(10)
+                self.write({'route': route})
+
+            def on_connection_close(self):
+                fake.closed.set()
+
+        super().__init__([(r'/(.*)', Handler)])
+
+
+class TestUpstream(TestCase):
+    def setUp(self):
+        upstream.configure_client()
+
+    def run_with_servers(self, test):
+        async def main():
+            fake = FakeDiffusion()
+            sock, port = bind_unused_port()
+            server = tornado.httpserver.HTTPServer(fake)
+            server.add_sockets([sock])
+            try:
+                await test(fake, f'http://127.0.0.1:{port}')
+            finally:
+                server.stop()
+        asyncio.run(main())
+
+    def test_connections_reused(self):
+        async def test(fake, url_head):
+            for _ in range(3):
+                data = await upstream.post(url_head, '/login', {})
+                self.assertEqual(data, {'route': 'login'})
+            self.assertEqual(len(fake.connections), 1)
+        self.run_with_servers(test)
+
+    def test_cancel_closes_upstream_socket(self):
+        async def test(fake, url_head):
+            task = asyncio.ensure_future(upstream.post(url_head, '/fetch/log', {}))
+            await asyncio.wait_for(fake.started.wait(), 5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await asyncio.wait_for(fake.closed.wait(), 1)
+
+            # the pool still serves requests
+            data = await upstream.post(url_head, '/login', {})
+            self.assertEqual(data, {'route': 'login'})
+        self.run_with_servers(test)
+
+    def test_browser_disconnect_closes_upstream_socket(self):
+        async def test(fake, url_head):
+            sock, port = bind_unused_port()
+            server = tornado.httpserver.HTTPServer(app.Application())
+            server.add_sockets([sock])
+            try:
+                with mock.patch.object(app, 'get_url_head', return_value=url_head):
+                    body = json.dumps({'userId': 0, 'sessionId': 0}).encode()
+                    _, writer = await asyncio.open_connection('127.0.0.1', port)
+                    writer.write(b'POST /fetch/session_data HTTP/1.1\r\nHost: localhost\r\n'
+                                 b'Content-Type: application/json\r\n'
+                                 b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+                    await asyncio.wait_for(fake.started.wait(), 5)
+                    writer.transport.abort()
+                    await asyncio.wait_for(fake.closed.wait(), 1)
+            finally:
+                server.stop()
+        self.run_with_servers(test)
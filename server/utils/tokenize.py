@@ -1,4 +1,17 @@
+'''
+Split prompts into tokens.
+
+Tokenized prompts are cached by prompt text in an LRU and returned as tuples
+of read-only token mappings, so prompts that are tokenized again by every
+analysis request cost a lookup.
+'''
+from functools import lru_cache
+from types import MappingProxyType
+
 SYMBOLS = [".", ",", "?", "!", "\\"]
+MAX_CACHED_PROMPTS = 4096
+
+SD_WEIGHT_MAP = {"(": 1.1, ")": 1.1, "[": 0.9, "]": 0.9}
 
 
 def split_into_tokens(text):
@@ -22,20 +35,33 @@ def split_into_tokens(text):
     text = text.replace('{||||{', '{{').replace('}||||}', '}}')
     text = text.replace('<||||!||||-||||-||', '||<!--||').replace('||-||||-||||>', '||-->||')
 
-    while '||||' in text:
-        text = text.replace('||||', '||')
-
-    tokens = filter(lambda a: a != '', text.split('||'))  # filter empty strings
+    tokens = [w for w in text.split('||') if w != '']  # filter empty strings
     tokens = ['|' if w == 'ææææ' else w for w in tokens]  # insert back the |s
     return tokens
 
 
 def split_prompt_into_tokens(prompt, symbols = SYMBOLS):
-    sentences = split_prompt_into_sentences(prompt)
+    '''Tokens of a prompt as new dicts, see tokenize_prompt for the cached tokens'''
+    return [dict(token) for token in tokenize_prompt(prompt, symbols)]
+
+
+def tokenize_prompt(prompt, symbols=SYMBOLS):
+    '''
+    Tokens of a prompt, cached by prompt text
+
+    Returns:
+        a tuple of read-only mappings with "text", "text_original" and "weight",
+        or empty mappings for the tokens of a bracket that is never closed
+    '''
+    return _tokenize_prompt(prompt, tuple(symbols))
+
+
+@lru_cache(maxsize=MAX_CACHED_PROMPTS)
+def _tokenize_prompt(prompt, symbols):
     tokens = []
-    for sentence in sentences:
+    for sentence in split_prompt_into_sentences(prompt):
         tokens += split_sentence_into_tokens(sentence, symbols)
-    return tokens
+    return tuple(MappingProxyType(token) for token in tokens)
 
 
 def split_prompt_into_sentences(prompt):
@@ -46,7 +72,6 @@ def split_prompt_into_sentences(prompt):
 
 def split_sentence_into_tokens(sentence, symbols=SYMBOLS):
     weight = 1.0
-    sd_weight_map = {"(": 1.1, ")": 1.1, "[": 0.9, "]": 0.9}
 
     # for disco prompt, weight is after ":"
     if ":" in sentence:
@@ -59,8 +84,7 @@ def split_sentence_into_tokens(sentence, symbols=SYMBOLS):
     for symbol in symbols:
         sentence = sentence.replace(symbol, f"||{symbol}||")
 
-    tokens = filter(lambda x: x != "", sentence.split("||"))
-    tokens = list(tokens)
+    tokens = [x for x in sentence.split("||") if x != ""]
 
     stack = []
     tokens_with_weight = [{}] * len(tokens)
@@ -75,25 +99,16 @@ def split_sentence_into_tokens(sentence, symbols=SYMBOLS):
             continue
         stack.append((idx, token))
         if token[-1] in ")]":
-            assert len(stack) > 0
-            cnt = 0
-            for i in range(len(token) - 1, -1, -1):
-                if token[i] == token[-1]:
-                    cnt += 1
-                else:
-                    break
-            token_weight = weight * pow(sd_weight_map[token[-1]], cnt)
-            while True:
-                try:
-                    top_idx, top = stack.pop()
-                    tokens_with_weight[top_idx] = {
-                        "text": top.strip("()[]"),
-                        "text_original": top,
-                        "weight": token_weight,
-                    }
-                    if top[0] in "([":
-                        break
-                except:
+            cnt = len(token) - len(token.rstrip(token[-1]))
+            token_weight = weight * pow(SD_WEIGHT_MAP[token[-1]], cnt)
+            while stack:
+                top_idx, top = stack.pop()
+                tokens_with_weight[top_idx] = {
+                    "text": top.strip("()[]"),
+                    "text_original": top,
+                    "weight": token_weight,
+                }
+                if top[0] in "([":
                     break
 
     return tokens_with_weight
@@ -0,0 +1,135 @@
+'''Non-blocking client for requests to the diffusion app
+
+Requests run on Tornado's curl AsyncHTTPClient, so a slow upstream call never
+blocks the IOLoop, and connections to the diffusion app are kept alive and
+reused across requests. pycurl is a dependency of the server, see
+requirements.txt.
+
+Cancelling the task awaiting a request, as the app does when the browser
+disconnects, aborts the request: its socket is shut down, so the diffusion app
+sees the disconnect at once, and a request still queued for a free handle is
+aborted as soon as it starts.
+'''
+import json
+import socket
+import asyncio
+from urllib.parse import urlencode
+
+import pycurl
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+MAX_CLIENTS = 64
+CONNECT_TIMEOUT = 5
+DEFAULT_TIMEOUT = 10
+
+# request timeout (seconds) of each upstream route
+ROUTE_TIMEOUTS = {
+    '/login': 10,
+    '/create/session': 10,
+    '/create/txt2img': 10,
+    '/fetch/session_list': 10,
+    '/fetch/log': 30,
+    '/fetch/new_generation': 10,
+    '/fetch/full_image': 10,
+    '/fetch/image': 10,
+}
+
+
+def configure_client(max_clients=MAX_CLIENTS):
+    '''Use the curl client, which pools connections; call once before the IOLoop starts'''
+    AsyncHTTPClient.configure('tornado.curl_httpclient.CurlAsyncHTTPClient',
+                              max_clients=max_clients)
+
+
+class Transfer:
+    '''The curl handle of a request, to abort it'''
+    def __init__(self) -> None:
+        self.curl = None
+        self.aborted = False
+
+    def prepare(self, curl):
+        '''prepare_curl_callback of the request, called when a handle starts it'''
+        self.curl = curl
+        curl.setopt(pycurl.NOPROGRESS, 0)
+        curl.setopt(pycurl.XFERINFOFUNCTION, self.progress)
+
+    def progress(self, *_):
+        # a non-zero value makes curl abort the transfer
+        return 1 if self.aborted else 0
+
+    def abort(self):
+        '''Abort the transfer, shutting its socket down if it has one'''
+        self.aborted = True
+        if self.curl is None:
+            return
+        fd = self.curl.getinfo(pycurl.ACTIVESOCKET)
+        if fd == -1:
+            return
+        # curl sees the end of the stream and drops the connection from its pool
+        sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+
+async def fetch(request):
+    '''Fetch a request, aborting it if the awaiting task is cancelled'''
+    transfer = Transfer()
+    request.prepare_curl_callback = transfer.prepare
+    future = AsyncHTTPClient().fetch(request)
+    try:
+        # shielded, so the future only completes with the response of the request
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        if not future.done():
+            transfer.abort()
+            # the aborted request fails, nobody waits for it
+            future.add_done_callback(lambda f: f.exception())
+        raise
+
+
+async def post(url_head, route, payload, timeout=None):
+    '''POST a JSON payload to the diffusion app and return the decoded response'''
+    if timeout is None:
+        timeout = ROUTE_TIMEOUTS.get(route, DEFAULT_TIMEOUT)
+
+    request = HTTPRequest(
+        f'{url_head}{route}',
+        method='POST',
+        body=json.dumps(payload),
+        headers={'Content-Type': 'application/json'},
+        connect_timeout=CONNECT_TIMEOUT,
+        request_timeout=timeout,
+    )
+    response = await fetch(request)
+    return json.loads(response.body)
+
+
+async def stream(url_head, route, params, on_chunk, timeout=None):
+    '''GET a binary resource from the diffusion app, passing each chunk to on_chunk'''
+    if timeout is None:
+        timeout = ROUTE_TIMEOUTS.get(route, DEFAULT_TIMEOUT)
+
+    # only pass on the body of a successful response, errors are raised by fetch
+    status = {}
+
+    def on_header(line):
+        if line.startswith('HTTP/'):
+            status['code'] = int(line.split(' ')[1])
+
+    def on_body(chunk):
+        if status.get('code') == 200:
+            on_chunk(chunk)
+
+    request = HTTPRequest(
+        f'{url_head}{route}?{urlencode(params)}',
+        method='GET',
+        header_callback=on_header,
+        streaming_callback=on_body,
+        connect_timeout=CONNECT_TIMEOUT,
+        request_timeout=timeout,
+    )
+    return await fetch(request)